@@ -86,11 +86,44 @@ TEMPLATES = [
 # WSGI_APPLICATION = 'backend.wsgi.application'
 ASGI_APPLICATION = 'backend.asgi.application'
 
+# InMemoryChannelLayer only reaches websockets of the same process. Dataset job notifications (chat/jobs.py)
+# are sent on the server's event loop; run several server processes only with a cross-process layer such as
+# channels_redis, or rely on the ChatSessionStatus endpoint for job progress.
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
     }
 }
+
+# Background dataset ingestion (see chat/jobs.py). 'local' runs jobs on an in-process
+# thread pool, 'sync' runs them inline in the request (tests).
+DATASET_JOB_BACKEND = os.environ.get('DATASET_JOB_BACKEND', 'local')
+DATASET_JOB_WORKERS = int(os.environ.get('DATASET_JOB_WORKERS', 2))
+
+# Max visualizations generated concurrently per request (see ChatConsumer.generate_and_send_visualizations).
+VIZ_FANOUT_LIMIT = int(os.environ.get('VIZ_FANOUT_LIMIT', 4))
+
+# Content-addressed storage for chart artifacts (see chat/artifacts.py). 'filesystem' stores under
+# ARTIFACT_STORE_DIR; 's3' uses ARTIFACT_S3_BUCKET, optionally on an S3-compatible endpoint (e.g. MinIO).
+ARTIFACT_STORE_BACKEND = os.environ.get('ARTIFACT_STORE_BACKEND', 'filesystem')
+ARTIFACT_STORE_DIR = os.environ.get('ARTIFACT_STORE_DIR', os.path.join(BASE_DIR, 'artifacts'))
+ARTIFACT_S3_BUCKET = os.environ.get('ARTIFACT_S3_BUCKET', '')
+ARTIFACT_S3_PREFIX = os.environ.get('ARTIFACT_S3_PREFIX', 'artifacts/')
+ARTIFACT_S3_ENDPOINT_URL = os.environ.get('ARTIFACT_S3_ENDPOINT_URL') or None
+
+# Warm DatasetVisualizations handlers shared by all connections of a chat session (see chat/handler_registry.py).
+# Handlers no connection uses are closed after SESSION_HANDLER_IDLE_TTL seconds, or earlier, least recently used
+# first, once the datasets they hold exceed SESSION_HANDLER_MAX_BYTES or there are more than SESSION_HANDLER_MAX_COUNT.
+SESSION_HANDLER_IDLE_TTL = int(os.environ.get('SESSION_HANDLER_IDLE_TTL', 15 * 60))
+SESSION_HANDLER_MAX_BYTES = int(os.environ.get('SESSION_HANDLER_MAX_BYTES', 2 * 1024 ** 3))
+SESSION_HANDLER_MAX_COUNT = int(os.environ.get('SESSION_HANDLER_MAX_COUNT', 64))
+
+# Streamed codegen progress (see chat/streaming.py). Stage events queue up to PROGRESS_QUEUE_SIZE per connection;
+# partial LLM output is batched every PROGRESS_FLUSH_INTERVAL seconds and cut to PROGRESS_MAX_PENDING_CHARS when the client lags.
+PROGRESS_STREAMING_ENABLED = os.environ.get('PROGRESS_STREAMING_ENABLED', 'True') == 'True'
+PROGRESS_QUEUE_SIZE = int(os.environ.get('PROGRESS_QUEUE_SIZE', 256))
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 0.1))
+PROGRESS_MAX_PENDING_CHARS = int(os.environ.get('PROGRESS_MAX_PENDING_CHARS', 4000))
     
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -1,9 +1,10 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Dataset, ChatSession, UserMessage, AssistantMessage
+from .models import Dataset, ChatSession, UserMessage, AssistantMessage, DatasetJob
 
 admin.site.register(Dataset)
 admin.site.register(ChatSession)
 admin.site.register(UserMessage)
-admin.site.register(AssistantMessage)
\ No newline at end of file
+admin.site.register(AssistantMessage)
+admin.site.register(DatasetJob)
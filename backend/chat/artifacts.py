@@ -0,0 +1,136 @@
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+
+# File extension used in artifact keys, so the content type can be recovered from the key alone.
+CONTENT_TYPE_EXTENSIONS = {
+    'image/svg+xml': 'svg',
+    'image/png': 'png',
+    'application/json': 'json',
+}
+mimetypes.add_type('image/svg+xml', '.svg')
+
+
+def artifact_key(data: bytes, content_type: str) -> str:
+    """Content address of an artifact: sha256 of the raw bytes plus an extension for its type."""
+    return f"{hashlib.sha256(data).hexdigest()}.{CONTENT_TYPE_EXTENSIONS.get(content_type, 'bin')}"
+
+
+def artifact_content_type(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class ArtifactStore(ABC):
+    """
+        Content-addressed, gzip-compressed blob store for chart artifacts.
+
+        put() returns the artifact's key and skips the write when the same bytes are already stored,
+        so identical charts are kept once. Keys never change meaning, which makes them safe to cache forever.
+    """
+    def put(self, data: bytes, content_type: str) -> str:
+        key = artifact_key(data, content_type)
+        if not self.exists(key):
+            self._write(key, gzip.compress(data))
+        return key
+
+    def get(self, key: str) -> bytes:
+        return gzip.decompress(self.get_compressed(key))
+
+    @abstractmethod
+    def get_compressed(self, key: str) -> bytes:
+        """The stored (gzip) bytes of an artifact. Raises KeyError if there is none."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def _write(self, key: str, compressed: bytes):
+        pass
+
+
+class FileSystemArtifactStore(ArtifactStore):
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        # Fan out by hash prefix to keep directories small.
+        return os.path.join(self.directory, key[:2], key[2:4], f"{key}.gz")
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get_compressed(self, key: str) -> bytes:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def _write(self, key: str, compressed: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+
+
+class S3ArtifactStore(ArtifactStore):
+    """Artifacts in an S3 bucket. endpoint_url points it at an S3-compatible server such as MinIO for local setups."""
+    def __init__(self, bucket: str, prefix: str = '', endpoint_url: str = None) -> None:
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}.gz"
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def get_compressed(self, key: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            raise KeyError(key)
+
+    def _write(self, key: str, compressed: bytes):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=compressed,
+            ContentType=artifact_content_type(key),
+            ContentEncoding='gzip',
+        )
+
+
+_artifact_store = None
+_artifact_store_lock = threading.Lock()
+
+
+def get_artifact_store() -> ArtifactStore:
+    """The store configured by settings.ARTIFACT_STORE_BACKEND."""
+    global _artifact_store
+    with _artifact_store_lock:
+        if _artifact_store is None:
+            if settings.ARTIFACT_STORE_BACKEND == 's3':
+                _artifact_store = S3ArtifactStore(settings.ARTIFACT_S3_BUCKET, settings.ARTIFACT_S3_PREFIX, settings.ARTIFACT_S3_ENDPOINT_URL)
+            elif settings.ARTIFACT_STORE_BACKEND == 'filesystem':
+                _artifact_store = FileSystemArtifactStore(settings.ARTIFACT_STORE_DIR)
+            else:
+                raise ValueError(f"Unknown ARTIFACT_STORE_BACKEND {settings.ARTIFACT_STORE_BACKEND}")
+        return _artifact_store
@@ -13,6 +13,7 @@ import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from asgiref.sync import sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
 
 # Assuming these imports are correct and the modules exist
 from llm_agents.helpers.dataset_enrich import DatasetHelper
@@ -20,6 +21,13 @@ from llm_agents.helpers.question_viz import DatasetVisualizations
 from chat.models import Dataset as DatasetModel, ChatSession as ChatSessionModel, UserMessage as UserMessageModel, AssistantMessage as AssistantMessageModel
 from accounts.models import User as UserModel
 from chat.serializers import ChatSessionSerializer
+from chat.jobs import session_group_name, register_server_loop
+from chat.artifacts import get_artifact_store
+from chat.handler_registry import get_handler_registry
+from chat.streaming import ProgressSender
+from llm_agents.helpers.progress import ProgressReporter, reporting
+from llm_agents.helpers.chat_context import load_context_window, update_context_summary
+from urllib.parse import parse_qs
 
 # Add the parent directory to sys.path
 
@@ -58,17 +66,54 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.enrich_dataset = None
         self.session_id = None
         self.dataset_viz_handler = None
+        self.handler_session_id = None
         self.viz_types = None
         self.questions = None
         self.chat_session = None
         self.active_user_message = None
+        self.session_group = None
+        self.progress_sender = None
+        self.summary_task = None
         
     async def connect(self):
+        register_server_loop(asyncio.get_running_loop())
         await self.accept()
         await self.send_json({"message": "Connected to server"})
+        
+        if settings.PROGRESS_STREAMING_ENABLED:
+            self.progress_sender = ProgressSender(self.send_progress)
+            self.progress_sender.start()
+        
+        # Clients may pass ?session_id=... to get dataset job progress before sending a message.
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        if query.get('session_id'):
+            await self.join_session_group(query['session_id'][0])
 
     async def disconnect(self, close_code=None):
         print(f"Disconnected with code: {close_code}")
+        if self.session_group is not None:
+            await self.channel_layer.group_discard(self.session_group, self.channel_name)
+        if self.progress_sender is not None:
+            await self.progress_sender.stop()
+            self.progress_sender = None
+        await sync_to_async(self.release_dataset_viz_handler)()
+            
+    async def join_session_group(self, session_id):
+        group = session_group_name(session_id)
+        if group == self.session_group:
+            return
+        if self.session_group is not None:
+            await self.channel_layer.group_discard(self.session_group, self.channel_name)
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.session_group = group
+        
+    async def dataset_job(self, event):
+        """Relays dataset ingestion progress sent by chat.jobs to the client."""
+        await self.send_json({
+            'role': 'assistant',
+            'type': 'dataset_status',
+            **event['payload']
+        })
         
     async def send_ack(self, message: str):
         print("message", message)
@@ -79,6 +124,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'chartData': None
         })
         
+    async def send_progress(self, event: dict):
+        await self.send_json({
+            'role': 'assistant',
+            **event
+        })
+        
+    def progress_reporter(self, **tags):
+        """Reporter whose stage timings and partial LLM output stream to this connection, or None if disabled."""
+        if self.progress_sender is None:
+            return None
+        return ProgressReporter(self.progress_sender.emit, **tags)
+        
     async def send_error(self, message: str):
         await self.send_json({
             'role': 'assistant',
@@ -97,6 +154,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         data = ServerMessage(**json.loads(text_data))
         message_body = UserMessageBody(**data.user_message_body)
         self.chat_session = await self.get_chat_session(message_body.session_id)
+        await self.join_session_group(message_body.session_id)
         
         self.active_user_message = await self.create_user_message(message_body)
 
@@ -128,9 +186,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             assistant_message = await self.get_assistant_message(reply_to_assistant_message_uuid)
             
-            last_5_questions = await self.get_last_x_questions(1000)
+            chat_context_window = await sync_to_async(load_context_window)(self.chat_session)
+            
+            with reporting(self.progress_reporter()):
+                visualization_objects = await self.dataset_viz_handler.avisualization_refine_helper(user_message=message_body, assistant_message=assistant_message, chat_context_window=chat_context_window)
             
-            visualization_objects = self.dataset_viz_handler.visualization_refine_helper(user_message=message_body, assistant_message=assistant_message, last_x_questions=last_5_questions)
+            # Fold older questions into the rolling summary off the request path, for the next refine.
+            self.schedule_chat_summary_update()
             
             print("visualization_objects", visualization_objects)
 
@@ -155,8 +217,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             
             # TODO: Add analysis to the assistant message.
             assistant_message_db = await self.get_assistant_message(reply_to_assistant_message_uuid)
+            svg_json = await sync_to_async(assistant_message_db.get_svg_json)()
                         
-            analysis = self.dataset_viz_handler.analyze_visualization(assistant_message_db)
+            analysis = await self.dataset_viz_handler.aanalyze_visualization(assistant_message_db, svg_json=svg_json)
             
             assistant_message = AssistantMessageBody(
                 reason=analysis,
@@ -164,7 +227,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 columns_involved=assistant_message_db.columns_involved,
                 pd_code=assistant_message_db.pd_code,
                 pd_viz_code=assistant_message_db.pd_viz_code,
-                svg_json=assistant_message_db.svg_json,
+                svg_json=svg_json,
                 data=[],
                 extra_attrs=assistant_message_db.extra_attrs
             )
@@ -198,7 +261,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
             if self.dataset_viz_handler is None:
                 raise ValueError("Dataset visualization handler not initialized")
             
-            visualization_objects = self.dataset_viz_handler.visualization_recommender_helper(user_message_body=message_body)
+            with reporting(self.progress_reporter()):
+                visualization_objects = await self.dataset_viz_handler.avisualization_recommender_helper(user_message_body=message_body)
             
             all_viz = [viz.visualization_type for viz in visualization_objects]
             print("all_viz", all_viz)
@@ -217,20 +281,37 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     @sync_to_async
     def initialize_dataset_viz_handler(self, user_message: UserMessageBody):
-        if self.dataset_viz_handler is not None:
+        """
+            Attaches to the session's handler in the process-wide registry, building it on first use. Reconnects
+            and other tabs of the same session share the warm handler, so it holds no per-request state: the
+            question goes to each handler call with the message. This connection's reference is released on disconnect.
+        """
+        session_id = str(self.chat_session.session_id)
+        if self.dataset_viz_handler is not None and self.handler_session_id == session_id:
             return self.dataset_viz_handler
+        # The client moved to another session on this connection.
+        self.release_dataset_viz_handler()
         
         try:
             dataset_chat_model = self.chat_session.main_dataset
             
-            self.enrich_dataset = DatasetHelper(
-                dataset_chat_model.s3Uri,
-                enriched_columns_properties=dataset_chat_model.enriched_columns_properties,
-                enriched_dataset_schema=dataset_chat_model.enriched_dataset_schema,
-                save_to_db=False
-            )
+            if dataset_chat_model.status == DatasetModel.ENRICHING:
+                raise ValueError("Dataset is still being enriched")
+            if dataset_chat_model.status == DatasetModel.FAILED:
+                raise ValueError("Dataset enrichment failed")
             
-            self.dataset_viz_handler = DatasetVisualizations(self.enrich_dataset, user_message.question)
+            def build_handler():
+                enrich_dataset = DatasetHelper(
+                    dataset_chat_model.s3Uri,
+                    enriched_columns_properties=dataset_chat_model.enriched_columns_properties,
+                    enriched_dataset_schema=dataset_chat_model.enriched_dataset_schema,
+                    save_to_db=False
+                )
+                return DatasetVisualizations(enrich_dataset)
+            
+            self.dataset_viz_handler = get_handler_registry().acquire(session_id, build_handler)
+            self.handler_session_id = session_id
+            self.enrich_dataset = self.dataset_viz_handler.main_dataset
             print("dataset_viz_handler", self.dataset_viz_handler)
             
             return self.dataset_viz_handler
@@ -239,6 +320,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             raise ValueError("Chat session not found")
         except Exception as e:
             raise ValueError(f"Failed to initialize visualization handler: {str(e)}")
+    
+    def release_dataset_viz_handler(self):
+        if self.handler_session_id is not None:
+            get_handler_registry().release(self.handler_session_id)
+        self.dataset_viz_handler = None
+        self.enrich_dataset = None
+        self.handler_session_id = None
 
     @sync_to_async    
     def create_user_message(self, user_message_body: UserMessageBody):
@@ -258,19 +346,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         return assistant_message_db
     
-    @sync_to_async
-    def get_last_x_questions(self, x: int):
-        user_messages = UserMessageModel.objects.filter(session=self.chat_session).order_by('-id')[:x]
-        return list(user_messages.values_list('question', flat=True))
+    def schedule_chat_summary_update(self):
+        """Starts a summary update unless this connection already has one running. The task is kept so it isn't collected mid-flight."""
+        if self.summary_task is not None and not self.summary_task.done():
+            return
+        self.summary_task = asyncio.ensure_future(self.update_chat_summary())
+    
+    async def update_chat_summary(self):
+        try:
+            # Not thread_sensitive: the summary LLM call must not hold up the other ORM calls.
+            await sync_to_async(update_context_summary, thread_sensitive=False)(self.chat_session)
+        except Exception as e:
+            print("Skipping chat summary update because of error: ", e)
     
     @sync_to_async
     def create_assistant_message(self, assistant_msg_body: AssistantMessageBody):
+        # The row keeps a reference; the SVG itself goes to the content-addressed artifact store.
+        svg_json, svg_artifact = assistant_msg_body.svg_json, None
+        try:
+            svg = json.loads(assistant_msg_body.svg_json or '{}').get('svg')
+            if svg:
+                svg_artifact = get_artifact_store().put(svg.encode('utf-8'), 'image/svg+xml')
+                svg_json = None
+        except Exception as e:
+            print("Storing svg_json inline because the artifact store failed: ", e)
+        
         assistant_message = AssistantMessageModel.objects.create(
             session=self.chat_session,
             viz_name=assistant_msg_body.viz_name,
             pd_code=assistant_msg_body.pd_code,
             pd_viz_code=assistant_msg_body.pd_viz_code,
-            svg_json=assistant_msg_body.svg_json,
+            svg_json=svg_json,
+            svg_artifact=svg_artifact,
             reason=assistant_msg_body.reason,
             columns_involved=assistant_msg_body.columns_involved,
             extra_attrs=assistant_msg_body.extra_attrs,
@@ -281,20 +388,44 @@ class ChatConsumer(AsyncWebsocketConsumer):
         return assistant_message
     
     async def generate_and_send_visualizations(self, visualization_objects):
+        """
+            Generates the visualizations concurrently (at most VIZ_FANOUT_LIMIT at a time) and sends each
+            one as soon as it is ready. viz_index/viz_total tell the client where it belongs, and tag the
+            progress events streamed while it is generated.
+        """
         if self.dataset_viz_handler is None:
             raise ValueError("Dataset visualization handler not initialized")
         
-        for viz in visualization_objects:
+        semaphore = asyncio.Semaphore(settings.VIZ_FANOUT_LIMIT)
+        viz_total = len(visualization_objects)
+        
+        async def generate(viz_index, viz):
+            async with semaphore:
+                with reporting(self.progress_reporter(viz_index=viz_index, viz_name=viz.visualization_type)):
+                    assistant_msg_body = await self.dataset_viz_handler.agenerate_viz(viz)
+            return viz_index, assistant_msg_body
+        
+        tasks = [asyncio.ensure_future(generate(viz_index, viz)) for viz_index, viz in enumerate(visualization_objects)]
+        
+        for next_done in asyncio.as_completed(tasks):
             try:
-                assistant_msg_body: AssistantMessageBody = await sync_to_async(self.dataset_viz_handler.generate_viz)(viz)
+                viz_index, assistant_msg_body = await next_done
+                if assistant_msg_body is None:
+                    raise ValueError("Visualization generation failed after retries")
                 
                 assistant_msg_db = await self.create_assistant_message(assistant_msg_body)
+                if self.progress_sender is not None:
+                    # The client gets this visualization's remaining progress before the visualization itself.
+                    await self.progress_sender.flush()
                 
                 visualization_response = {
                     'role': 'assistant',
                     'type': 'viz_code',
                     # Using UUIDs to avoid message collisions in DB/FE.
                     'assistant_message_uuid': str(assistant_msg_db.uuid),
+                    'svg_artifact': assistant_msg_db.svg_artifact,
+                    'viz_index': viz_index,
+                    'viz_total': viz_total,
                     **asdict(assistant_msg_body)
                 }
                 
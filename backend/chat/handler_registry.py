@@ -0,0 +1,146 @@
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from llm_agents.helpers.dataframe_cache import dataframe_cache
+
+
+class _Entry:
+    def __init__(self, handler) -> None:
+        self.handler = handler
+        self.refs = 0
+        self.last_used = time.monotonic()
+        dataset = handler.main_dataset
+        self.dataset_uri = dataset.uri
+        self.nbytes = dataframe_cache.nbytes(dataset.df)
+
+
+class SessionHandlerRegistry:
+    """
+        Process-wide DatasetVisualizations handlers keyed by chat session id.
+
+        Every websocket connection of a session (reconnects, other tabs) acquires the same handler, so the
+        dataset, its published copy and the dspy modules are built once per session. Handlers are reference
+        counted; once no connection holds one it stays warm for idle_ttl seconds, and idle handlers are closed
+        least recently used first when the datasets they hold exceed max_bytes or there are more than
+        max_handlers. Handlers in use are never evicted. Concurrent builds for one session are single-flighted.
+    """
+    def __init__(self, idle_ttl: float, max_bytes: int, max_handlers: int) -> None:
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.max_handlers = max_handlers
+        self._entries = OrderedDict()  # session_id -> _Entry, least recently used first
+        self._building = {}  # session_id -> threading.Event
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def acquire(self, session_id, factory):
+        """Returns the session's handler, calling factory() to build it if there is none, and takes a reference."""
+        session_id = str(session_id)
+        while True:
+            with self._lock:
+                entry = self._entries.get(session_id)
+                if entry is not None:
+                    entry.refs += 1
+                    entry.last_used = time.monotonic()
+                    self._entries.move_to_end(session_id)
+                    return entry.handler
+
+                event = self._building.get(session_id)
+                is_builder = event is None
+                if is_builder:
+                    event = threading.Event()
+                    self._building[session_id] = event
+
+            if not is_builder:
+                # Another connection is building this session's handler. If it failed, the loop builds it here.
+                event.wait()
+                continue
+
+            try:
+                entry = _Entry(factory())
+                entry.refs = 1
+                with self._lock:
+                    self._entries[session_id] = entry
+                self._start_sweeper()
+                self.prune()
+                return entry.handler
+            finally:
+                with self._lock:
+                    self._building.pop(session_id, None)
+                event.set()
+
+    def release(self, session_id):
+        """Drops a reference taken by acquire(). The handler stays warm until it's evicted."""
+        with self._lock:
+            entry = self._entries.get(str(session_id))
+            if entry is None:
+                return
+            entry.refs = max(entry.refs - 1, 0)
+            entry.last_used = time.monotonic()
+        self.prune()
+
+    def _total_bytes(self) -> int:
+        # Sessions on the same dataset share one cached frame, so count each dataset once.
+        sizes = {entry.dataset_uri: entry.nbytes for entry in self._entries.values()}
+        return sum(sizes.values())
+
+    def prune(self):
+        """Closes idle handlers past the TTL, then idle ones over the memory or count cap."""
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            for session_id, entry in list(self._entries.items()):
+                if entry.refs == 0 and now - entry.last_used > self.idle_ttl:
+                    evicted.append(self._entries.pop(session_id))
+
+            for session_id, entry in list(self._entries.items()):
+                if self._total_bytes() <= self.max_bytes and len(self._entries) <= self.max_handlers:
+                    break
+                if entry.refs == 0:
+                    evicted.append(self._entries.pop(session_id))
+
+        for entry in evicted:
+            try:
+                entry.handler.close()
+            except Exception as e:
+                print(f"Error closing visualization handler: {str(e)}")
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep, name='session-handler-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def _sweep(self):
+        interval = max(min(self.idle_ttl / 4, 60), 1)
+        while True:
+            time.sleep(interval)
+            self.prune()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'handlers': len(self._entries),
+                'active': sum(1 for entry in self._entries.values() if entry.refs > 0),
+                'bytes': self._total_bytes(),
+            }
+
+
+_handler_registry = None
+_handler_registry_lock = threading.Lock()
+
+
+def get_handler_registry() -> SessionHandlerRegistry:
+    global _handler_registry
+    with _handler_registry_lock:
+        if _handler_registry is None:
+            _handler_registry = SessionHandlerRegistry(
+                idle_ttl=settings.SESSION_HANDLER_IDLE_TTL,
+                max_bytes=settings.SESSION_HANDLER_MAX_BYTES,
+                max_handlers=settings.SESSION_HANDLER_MAX_COUNT,
+            )
+        return _handler_registry
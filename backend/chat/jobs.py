@@ -0,0 +1,149 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from chat.models import Dataset as DatasetModel, DatasetJob as DatasetJobModel
+from llm_agents.helpers.dataset_enrich import DatasetEnrich
+
+
+def session_group_name(session_id) -> str:
+    """Channel layer group that every websocket of a chat session joins."""
+    return f"chat_session_{session_id}"
+
+
+class LocalJobQueue:
+    """In-process job queue backed by a thread pool. Jobs don't survive a restart."""
+    def __init__(self, max_workers: int) -> None:
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dataset-job')
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+
+class SyncJobQueue:
+    """Runs jobs inline in the caller's thread. Handy for tests and management commands."""
+    def submit(self, fn, *args):
+        return fn(*args)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            backend = getattr(settings, 'DATASET_JOB_BACKEND', 'local')
+            if backend == 'local':
+                _job_queue = LocalJobQueue(max_workers=getattr(settings, 'DATASET_JOB_WORKERS', 2))
+            elif backend == 'sync':
+                _job_queue = SyncJobQueue()
+            else:
+                raise ValueError(f"Unknown dataset job backend: {backend}")
+    return _job_queue
+
+
+def job_payload(job: DatasetJobModel) -> dict:
+    return {
+        'job_uuid': str(job.uuid),
+        'dataset_status': job.dataset.status,
+        'job_status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+    }
+
+
+# Event loop serving the websockets of this process, registered by ChatConsumer.connect. InMemoryChannelLayer
+# keeps its queues on that loop and they aren't thread-safe, so job threads hand their sends over to it.
+NOTIFY_TIMEOUT = 5
+_server_loop = None
+
+
+def register_server_loop(loop: asyncio.AbstractEventLoop):
+    global _server_loop
+    _server_loop = loop
+
+
+def _group_send(channel_layer, group: str, message: dict):
+    loop = _server_loop
+    if loop is None or loop.is_closed():
+        # No websocket has connected in this process yet, so nobody can be listening on an in-memory layer.
+        async_to_sync(channel_layer.group_send)(group, message)
+        return
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is loop:
+        loop.create_task(channel_layer.group_send(group, message))
+        return
+    asyncio.run_coroutine_threadsafe(channel_layer.group_send(group, message), loop).result(timeout=NOTIFY_TIMEOUT)
+
+
+def notify_dataset_sessions(job: DatasetJobModel):
+    """
+        Pushes the job state to every chat session using the dataset. Sends run on the server's event loop;
+        with several server processes the layer must be cross-process (e.g. channels_redis), otherwise only
+        ChatSessionStatus polling reaches clients connected to another process.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    payload = job_payload(job)
+    for session_id in job.dataset.chat_sessions.values_list('session_id', flat=True):
+        try:
+            _group_send(channel_layer, session_group_name(session_id), {'type': 'dataset.job', 'payload': payload})
+        except Exception as e:
+            print(f"Skipping dataset job notification because of error: {str(e)}")
+
+
+def run_dataset_job(job_id: int):
+    """Enriches the job's dataset and records the outcome on both the job and the dataset."""
+    close_old_connections()
+    job = DatasetJobModel.objects.select_related('dataset').get(id=job_id)
+    dataset = job.dataset
+
+    try:
+        job.status = DatasetJobModel.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at', 'updated_at'])
+        notify_dataset_sessions(job)
+
+        def on_progress(done: int, total: int):
+            job.progress = done / total if total else 1.0
+            job.save(update_fields=['progress', 'updated_at'])
+            notify_dataset_sessions(job)
+
+        enrich_schema = DatasetEnrich(dataset.s3Uri).forward(progress_callback=on_progress)
+
+        dataset.enriched_columns_properties = enrich_schema['enriched_column_properties']
+        dataset.enriched_dataset_schema = enrich_schema['enriched_dataset_schema']
+        dataset.status = DatasetModel.READY
+        job.status = DatasetJobModel.SUCCEEDED
+        job.progress = 1.0
+    except Exception as e:
+        print(f"Dataset job {job.uuid} failed: {str(e)}")
+        dataset.status = DatasetModel.FAILED
+        job.status = DatasetJobModel.FAILED
+        job.error = str(e)
+    finally:
+        job.finished_at = timezone.now()
+        dataset.save()
+        job.save()
+        notify_dataset_sessions(job)
+        close_old_connections()
+
+
+def enqueue_dataset_job(dataset: DatasetModel) -> DatasetJobModel:
+    """Creates a job for the dataset and submits it once the surrounding transaction commits."""
+    job = DatasetJobModel.objects.create(dataset=dataset)
+    transaction.on_commit(lambda: get_job_queue().submit(run_dataset_job, job.id))
+    return job
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+from chat.models import AssistantMessage as AssistantMessageModel
+from chat.artifacts import get_artifact_store
+
+
+class Command(BaseCommand):
+    help = 'Moves the SVGs of assistant messages saved with inline svg_json into the artifact store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Count the messages that would move without writing anything')
+
+    def handle(self, *args, **options):
+        store = get_artifact_store()
+        moved = skipped = 0
+        last_id = 0
+        while True:
+            batch = list(
+                AssistantMessageModel.objects
+                .filter(id__gt=last_id, svg_artifact__isnull=True, svg_json__isnull=False)
+                .order_by('id')
+                .values_list('id', 'svg_json')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            for message_id, svg_json in batch:
+                try:
+                    svg = json.loads(svg_json).get('svg')
+                except (ValueError, AttributeError):
+                    svg = None
+                if not svg:
+                    skipped += 1
+                    continue
+                if options['dry_run']:
+                    moved += 1
+                    continue
+                key = store.put(svg.encode('utf-8'), 'image/svg+xml')
+                # Legacy png_base64 goes with svg_json; PNGs are rasterized from the SVG on demand.
+                moved += AssistantMessageModel.objects.filter(id=message_id, svg_artifact__isnull=True).update(svg_artifact=key, svg_json=None)
+            self.stdout.write(f"Up to id {last_id}: {moved} moved, {skipped} skipped")
+
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f"{verb} {moved} messages to the artifact store, skipped {skipped} without an SVG"))
@@ -0,0 +1,98 @@
+import time
+import uuid
+import random
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from chat.models import Dataset as DatasetModel, ChatSession as ChatSessionModel, UserMessage as UserMessageModel, AssistantMessage as AssistantMessageModel
+from llm_agents.helpers.chat_context import CHAT_CONTEXT_RECENT_TURNS, summary_query, recent_questions_query
+
+
+class Command(BaseCommand):
+    help = 'Seeds chat messages and checks the latency of the queries the chat consumer runs on every message'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1_000_000, help='Total messages to seed (half user, half assistant)')
+        parser.add_argument('--sessions', type=int, default=1_000, help='Chat sessions the messages are spread over')
+        parser.add_argument('--repeat', type=int, default=200, help='Timed runs per query')
+        parser.add_argument('--max-p95-ms', type=float, default=5.0, help='Fail if any query p95 exceeds this')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--keep', action='store_true', help='Commit the seeded rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            sessions, user_uuids, assistant_uuids = self.seed(options)
+            self.analyze()
+            results = self.run_queries(sessions, user_uuids, assistant_uuids, options['repeat'])
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        failed = []
+        for name, (p50, p95, plan) in results.items():
+            self.stdout.write(f"{name}: p50={p50:.2f}ms p95={p95:.2f}ms")
+            self.stdout.write(f"    {plan}")
+            if p95 > options['max_p95_ms']:
+                failed.append(name)
+
+        if failed:
+            raise CommandError(f"p95 above {options['max_p95_ms']}ms for: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('All message queries within budget'))
+
+    def seed(self, options):
+        dataset = DatasetModel.objects.create(name='benchmark', description='benchmark_message_queries seed data')
+        sessions = ChatSessionModel.objects.bulk_create([ChatSessionModel(main_dataset=dataset) for _ in range(options['sessions'])])
+        # bulk_create doesn't return ids on every backend; read the sessions back.
+        sessions = list(ChatSessionModel.objects.filter(main_dataset=dataset))
+
+        per_kind = options['messages'] // 2
+        batch_size = options['batch_size']
+        user_uuids, assistant_uuids = [], []
+        start = time.perf_counter()
+        for offset in range(0, per_kind, batch_size):
+            count = min(batch_size, per_kind - offset)
+            user_messages = [
+                UserMessageModel(uuid=uuid.uuid4(), session=sessions[(offset + i) % len(sessions)], question=f"question {offset + i}", content={})
+                for i in range(count)
+            ]
+            assistant_messages = [
+                AssistantMessageModel(uuid=uuid.uuid4(), session=sessions[(offset + i) % len(sessions)], viz_name='bar_chart', reason='benchmark')
+                for i in range(count)
+            ]
+            UserMessageModel.objects.bulk_create(user_messages, batch_size=batch_size)
+            AssistantMessageModel.objects.bulk_create(assistant_messages, batch_size=batch_size)
+            # Keep a sample of keys to look up later.
+            user_uuids.append(user_messages[0].uuid)
+            assistant_uuids.append(assistant_messages[-1].uuid)
+        self.stdout.write(f"Seeded {2 * per_kind} messages over {len(sessions)} sessions in {time.perf_counter() - start:.1f}s")
+        return sessions, user_uuids, assistant_uuids
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            for model in (ChatSessionModel, UserMessageModel, AssistantMessageModel):
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+    def run_queries(self, sessions, user_uuids, assistant_uuids, repeat):
+        queries = {
+            # ChatConsumer.get_assistant_message
+            'assistant_message_by_uuid': lambda: AssistantMessageModel.objects.filter(uuid=random.choice(assistant_uuids)),
+            # ChatConsumer.get_chat_session
+            'chat_session_by_session_id': lambda: ChatSessionModel.objects.filter(session_id=random.choice(sessions).session_id),
+            'user_message_by_uuid': lambda: UserMessageModel.objects.filter(uuid=random.choice(user_uuids)),
+            # chat_context.load_context_window, with the window the consumer uses
+            'context_summary_of_session': lambda: summary_query(random.choice(sessions)),
+            f'last_{CHAT_CONTEXT_RECENT_TURNS}_questions_of_session': lambda: recent_questions_query(random.choice(sessions)),
+        }
+
+        results = {}
+        for name, make_queryset in queries.items():
+            timings = []
+            for _ in range(repeat):
+                queryset = make_queryset()
+                start = time.perf_counter()
+                list(queryset)
+                timings.append((time.perf_counter() - start) * 1000)
+            p95 = statistics.quantiles(timings, n=20)[-1]
+            plan = make_queryset().explain().replace('\n', '\n    ')
+            results[name] = (statistics.median(timings), p95, plan)
+        return results
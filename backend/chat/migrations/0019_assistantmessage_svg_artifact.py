@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_dataset_status_datasetjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assistantmessage',
+            name='svg_artifact',
+            field=models.CharField(blank=True, max_length=80, null=True),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:20
+
+import uuid
+from django.db import migrations, models
+from django.db.models import Count
+
+
+UUID_FIELDS = [
+    ('AssistantMessage', 'uuid'),
+    ('ChatSession', 'session_id'),
+    ('DatasetJob', 'uuid'),
+    ('UserMessage', 'uuid'),
+]
+
+
+def dedupe_uuids(apps, schema_editor):
+    """
+        Rows that existed when a UUID column was added all got the same default value.
+        Give every row but the first of each duplicate group a fresh UUID so the unique constraints apply.
+    """
+    for model_name, field in UUID_FIELDS:
+        model = apps.get_model('chat', model_name)
+        duplicates = model.objects.values(field).annotate(n=Count('id')).filter(n__gt=1).values_list(field, flat=True)
+        for value in duplicates:
+            for pk in model.objects.filter(**{field: value}).order_by('id').values_list('id', flat=True)[1:]:
+                model.objects.filter(pk=pk).update(**{field: uuid.uuid4()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_assistantmessage_svg_artifact'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_uuids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='assistantmessage',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='chatsession',
+            name='session_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='datasetjob',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='usermessage',
+            name='uuid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='assistantmessage',
+            index=models.Index(fields=['session', '-id'], name='assistantmsg_session_id_desc'),
+        ),
+        migrations.AddIndex(
+            model_name='datasetjob',
+            index=models.Index(fields=['dataset', '-id'], name='datasetjob_dataset_id_desc'),
+        ),
+        migrations.AddIndex(
+            model_name='usermessage',
+            index=models.Index(fields=['session', '-id'], name='usermessage_session_id_desc'),
+        ),
+    ]
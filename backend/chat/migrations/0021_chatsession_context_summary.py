@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0020_unique_uuids_and_session_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='context_summary_until_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
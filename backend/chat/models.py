@@ -4,6 +4,7 @@ from django.db.models import Manager
 from accounts.models import User
 from django.contrib.postgres.fields import ArrayField
 import uuid
+import json
 
 class DatasetManager(Manager):
     def get(self, *args, **kwargs):
@@ -12,12 +13,22 @@ class DatasetManager(Manager):
         return obj
 
 class Dataset(models.Model):
+    ENRICHING = 'enriching'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (ENRICHING, 'Enriching'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
+
     name = models.CharField(max_length=200, null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     publicUrl = models.TextField(null=True, blank=True)
     s3Uri = models.TextField(null=True, blank=True)
     enriched_columns_properties = models.JSONField(null=True, blank=True)
     enriched_dataset_schema = models.JSONField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=READY)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -30,10 +41,46 @@ class Dataset(models.Model):
         return self
 
 
+class DatasetJob(models.Model):
+    """Background ingestion (enrichment) job for a dataset."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.FloatField(default=0.0)
+    error = models.TextField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Latest job of a dataset (ChatSessionStatus).
+            models.Index(fields=['dataset', '-id'], name='datasetjob_dataset_id_desc'),
+        ]
+
+    def __str__(self):
+        return f"{self.dataset} ({self.status})"
+
+
 class ChatSession(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     main_dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, null=True, blank=True, related_name='chat_sessions')
-    session_id = models.UUIDField(default=uuid.uuid4, editable=False)
+    session_id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # Rolling summary of the questions up to context_summary_until_id (see llm_agents/helpers/chat_context.py).
+    context_summary = models.TextField(null=True, blank=True)
+    context_summary_until_id = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -41,29 +88,49 @@ class ChatSession(models.Model):
         return str(self.session_id)
 
 class UserMessage(models.Model):
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, null=True, blank=True)
     question = models.TextField(null=True, blank=True)
     content = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Latest questions of a session (chat_context.load_context_window).
+            models.Index(fields=['session', '-id'], name='usermessage_session_id_desc'),
+        ]
+
     def __str__(self):
         return self.question
     
 class AssistantMessage(models.Model):
     parent_user_message = models.ForeignKey(UserMessage, on_delete=models.CASCADE, null=True, blank=True, related_name="assistant_messages")
-    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, null=True, blank=True)
     viz_name = models.TextField(null=True, blank=True)
     pd_code = models.TextField(null=True, blank=True)
     pd_viz_code = models.TextField(null=True, blank=True)
+    # Legacy inline chart ({"svg", "png_base64"}); new messages keep the SVG in the artifact store (chat/artifacts.py).
     svg_json = models.TextField(null=True, blank=True)
+    svg_artifact = models.CharField(max_length=80, null=True, blank=True)
     reason = models.TextField(null=True, blank=True)
     columns_involved = ArrayField(models.TextField(), null=True, blank=True)
     extra_attrs = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', '-id'], name='assistantmsg_session_id_desc'),
+        ]
+
     def __str__(self):
         return self.viz_name
+    
+    def get_svg_json(self):
+        """The chart as svg_json, read from the artifact store for messages that reference one."""
+        if self.svg_artifact:
+            from chat.artifacts import get_artifact_store
+            return json.dumps({'svg': get_artifact_store().get(self.svg_artifact).decode('utf-8')})
+        return self.svg_json
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Dataset, ChatSession, UserMessage, AssistantMessage   
+from .models import Dataset, ChatSession, UserMessage, AssistantMessage, DatasetJob
 
 class DatasetSerializer(serializers.ModelSerializer):
     class Meta:
@@ -7,6 +7,8 @@ class DatasetSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 class ChatSessionSerializer(serializers.ModelSerializer):
+    status = serializers.CharField(source='main_dataset.status', read_only=True)
+
     class Meta:
         model = ChatSession
         fields = '__all__'
@@ -20,5 +22,8 @@ class AssistantMessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = AssistantMessage
         fields = '__all__'
-        
-    
\ No newline at end of file
+
+class DatasetJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DatasetJob
+        fields = ['uuid', 'status', 'progress', 'error', 'started_at', 'finished_at', 'created_at', 'updated_at']
@@ -0,0 +1,95 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from django.conf import settings
+
+
+class ProgressSender:
+    """
+        Forwards progress events from llm_agents.helpers.progress to a websocket without letting a slow
+        client hold up codegen.
+
+        emit() never blocks. Stage events go through a bounded queue and are only dropped once it's full.
+        llm_token events are coalesced per (viz, stage, LLM call, field) and flushed every flush_interval
+        seconds while the queue is idle; text emitted before a stage event is sent ahead of it, so the
+        client sees a stage's text before its end. When the client falls behind, text waiting to be sent
+        is cut to its last max_pending_chars characters and marked truncated: partial output is only a
+        preview, and the final result is sent in full.
+    """
+    def __init__(self, send: Callable[[dict], Awaitable], max_queue: int = None, flush_interval: float = None, max_pending_chars: int = None) -> None:
+        self.send = send
+        self.flush_interval = flush_interval or settings.PROGRESS_FLUSH_INTERVAL
+        self.max_pending_chars = max_pending_chars or settings.PROGRESS_MAX_PENDING_CHARS
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=max_queue or settings.PROGRESS_QUEUE_SIZE)  # (llm_token events, stage event)
+        self._tokens = OrderedDict()  # (viz_index, stage, call_id, field) -> llm_token event
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def emit(self, event: dict):
+        if event.get('type') == 'llm_token':
+            self._add_token(event)
+            return
+        if self._queue.full():
+            self.dropped += 1
+            return
+        # Text streamed before this event is sent ahead of it.
+        tokens = list(self._tokens.values())
+        self._tokens.clear()
+        self._queue.put_nowait((tokens, event))
+
+    def _add_token(self, event: dict):
+        key = (event.get('viz_index'), event.get('stage'), event.get('call_id'), event.get('field'))
+        pending = self._tokens.get(key)
+        if pending is None:
+            self._tokens[key] = pending = {**event, 'text': ''}
+        pending['text'] += event['text']
+        if len(pending['text']) > self.max_pending_chars:
+            pending['text'] = pending['text'][-self.max_pending_chars:]
+            pending['truncated'] = True
+
+    async def flush(self):
+        """Waits until everything emitted so far has been sent, e.g. before sending a final result."""
+        if self._task is not None:
+            await self._queue.join()
+        await self._send_tokens()
+
+    async def _send_tokens(self):
+        while self._tokens:
+            _, event = self._tokens.popitem(last=False)
+            await self.send(event)
+
+    async def _run(self):
+        while True:
+            try:
+                tokens, event = await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                await self._safe_send_tokens()
+                continue
+            try:
+                for token_event in tokens:
+                    await self.send(token_event)
+                await self.send(event)
+            except Exception as e:
+                print(f"Error sending progress event: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _safe_send_tokens(self):
+        try:
+            await self._send_tokens()
+        except Exception as e:
+            print(f"Error sending progress tokens: {str(e)}")
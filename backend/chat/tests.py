@@ -1,3 +1,91 @@
-from django.test import TestCase
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from chat import jobs
+from chat.consumers import ChatConsumer, AssistantMessageBody
+from chat.streaming import ProgressSender
+from llm_agents.helpers.progress import current_reporter, stage
+
+
+class RecordingChannelLayer:
+    def __init__(self) -> None:
+        self.sent = []
+
+    async def group_send(self, group, message):
+        self.sent.append((group, message, asyncio.get_running_loop()))
+
+
+class GroupSendTests(SimpleTestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        jobs.register_server_loop(self.loop)
+
+    def tearDown(self):
+        jobs.register_server_loop(None)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def test_job_thread_sends_on_the_server_loop(self):
+        layer = RecordingChannelLayer()
+        jobs._group_send(layer, 'chat_session_1', {'type': 'dataset.job'})
+
+        self.assertEqual(len(layer.sent), 1)
+        group, message, loop = layer.sent[0]
+        self.assertEqual(group, 'chat_session_1')
+        self.assertIs(loop, self.loop)
+
+
+class ProgressSenderTests(SimpleTestCase):
+    async def test_drops_stage_events_when_the_queue_is_full(self):
+        sent = []
+
+        async def send(event):
+            sent.append(event)
+
+        sender = ProgressSender(send, max_queue=2, flush_interval=10, max_pending_chars=5)
+        for index in range(3):
+            sender.emit({'type': 'stage_start', 'stage': f'stage_{index}'})
+        sender.emit({'type': 'llm_token', 'stage': 'stage_1', 'call_id': 1, 'field': 'code', 'text': 'extract'})
+        sender.emit({'type': 'llm_token', 'stage': 'stage_1', 'call_id': 1, 'field': 'code', 'text': '_df'})
+        self.assertEqual(sender.dropped, 1)
+
+        sender.start()
+        await sender.flush()
+        await sender.stop()
+        self.assertEqual([event.get('stage') for event in sent], ['stage_0', 'stage_1', 'stage_1'])
+        self.assertEqual(sent[-1]['text'], 'ct_df')
+        self.assertTrue(sent[-1]['truncated'])
+
+    async def test_progress_is_sent_before_the_visualization(self):
+        consumer = ChatConsumer()
+        sent = []
+
+        async def send_json(message):
+            # A slow client, so progress is still queued when the visualization is ready.
+            await asyncio.sleep(0.01)
+            sent.append(message['type'])
+
+        async def agenerate_viz(viz):
+            with stage('render'):
+                stream = current_reporter.get().new_stream()
+                stream.feed('[[ ## code ## ]]\nplt.bar(extract_df.make, extract_df.price)')
+                stream.close()
+            return AssistantMessageBody('reason', viz.visualization_type, ['make'], '', '', '', [], {})
+
+        consumer.send_json = send_json
+        consumer.dataset_viz_handler = SimpleNamespace(agenerate_viz=agenerate_viz)
+        consumer.create_assistant_message = mock.AsyncMock(return_value=SimpleNamespace(uuid='1', svg_artifact=None))
+        consumer.progress_sender = ProgressSender(consumer.send_progress, flush_interval=10)
+        consumer.progress_sender.start()
+        try:
+            await consumer.generate_and_send_visualizations([SimpleNamespace(visualization_type='bar_chart')])
+        finally:
+            await consumer.progress_sender.stop()
+        self.assertEqual(sent, ['stage_start', 'llm_token', 'stage_end', 'viz_code'])
@@ -12,6 +12,9 @@ router = DefaultRouter()
 urlpatterns = [
     # path('', include(router.urls)),
     path('chat-sessions/', views.ChatSession.as_view(), name='chat-sessions'),
+    path('chat-sessions/<uuid:session_id>/status/', views.ChatSessionStatus.as_view(), name='chat-session-status'),
+    re_path(r'^artifacts/(?P<key>[0-9a-f]{64}\.[a-z]+)/$', views.Artifact.as_view(), name='artifact'),
+    path('assistant-messages/<uuid:assistant_message_uuid>/thumbnail/', views.AssistantMessageThumbnail.as_view(), name='assistant-message-thumbnail'),
     re_path(r'ws/chat/$', ChatConsumer.as_asgi(), name='chat-consumer'),
     # path('chat-sessions/<int:pk>/send-message/', views.ChatSessionViewSet.as_view({'post': 'send_message'}), name='chat-send-message'),
     # path('chat-sessions/<int:pk>/chat-history/', views.ChatSessionViewSet.as_view({'get': 'chat_history'}), name='chat-history'),
@@ -4,16 +4,22 @@ from django.utils.decorators import method_decorator
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .models import Dataset as DatasetModel, ChatSession as ChatSessionModel, UserMessage as UserMessageModel, AssistantMessage as AssistantMessageModel
+from .models import Dataset as DatasetModel, ChatSession as ChatSessionModel, UserMessage as UserMessageModel, AssistantMessage as AssistantMessageModel, DatasetJob as DatasetJobModel
 from accounts.models import User
-from .serializers import DatasetSerializer, ChatSessionSerializer, UserMessageSerializer, AssistantMessageSerializer
+from .serializers import DatasetSerializer, ChatSessionSerializer, UserMessageSerializer, AssistantMessageSerializer, DatasetJobSerializer
+from .jobs import enqueue_dataset_job
+from .artifacts import get_artifact_store, artifact_content_type
+from django.db import transaction
 import requests
 import pandas as pd
 from io import StringIO
 from llm_agents.helpers.dataset_enrich import DatasetEnrich, DatasetHelper
 from llm_agents.helpers.question_viz import DatasetVisualizations
+from llm_agents.helpers.rasterize import rasterize, svg_hash, THUMBNAIL_WIDTH, MAX_RASTER_WIDTH
+import json
+import gzip
 from django.views.decorators.csrf import csrf_exempt
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -24,6 +30,9 @@ from pprint import pprint
 
 
 def create_dataset_helper(request):
+    """
+        Creates the dataset in the `enriching` state. Enrichment itself runs as a background job (see chat.jobs).
+    """
     name = request.data.get('name', '')
     s3Uri = request.data.get('s3Uri', '')
     publicUrl = request.data.get('publicUrl', '')
@@ -36,11 +45,7 @@ def create_dataset_helper(request):
     
     try:
         # TODO: Change to s3Uri
-        enrich_schema = DatasetEnrich(s3Uri).forward()
-        
-        dataset = DatasetModel.objects.create(name=name, s3Uri=s3Uri, publicUrl=publicUrl, description=description, enriched_columns_properties=enrich_schema['enriched_column_properties'], enriched_dataset_schema=enrich_schema['enriched_dataset_schema'])
-        
-        # dataset = DatasetModel.objects.last()
+        dataset = DatasetModel.objects.create(name=name, s3Uri=s3Uri, publicUrl=publicUrl, description=description, status=DatasetModel.ENRICHING)
         
         print("dataset", dataset)
         
@@ -55,16 +60,20 @@ class ChatSession(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request, format=None):
-        try:
-            dataset = create_dataset_helper(request)
-        except Exception as e:
-            return Response({'error': f'Failed to create dataset: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        chat_session = ChatSessionModel.objects.create(
-            user=User.objects.first(),
-            session_id=uuid.uuid4(),
-            main_dataset=dataset
-        )
+        with transaction.atomic():
+            try:
+                dataset = create_dataset_helper(request)
+            except Exception as e:
+                return Response({'error': f'Failed to create dataset: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
+            
+            chat_session = ChatSessionModel.objects.create(
+                user=User.objects.first(),
+                session_id=uuid.uuid4(),
+                main_dataset=dataset
+            )
+            
+            # Submitted on commit, so the job always sees the session it reports progress to.
+            enqueue_dataset_job(dataset)
         
         serializer = ChatSessionSerializer(chat_session)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -74,4 +83,91 @@ class ChatSession(APIView):
         print(DatasetModel.objects.all())
         datasets = DatasetModel.objects.first()
         serializer = DatasetSerializer(datasets)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatSessionStatus(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, session_id, format=None):
+        try:
+            chat_session = ChatSessionModel.objects.select_related('main_dataset').get(session_id=session_id)
+        except ChatSessionModel.DoesNotExist:
+            raise Http404
+        
+        dataset = chat_session.main_dataset
+        job = DatasetJobModel.objects.filter(dataset=dataset).order_by('-id').first() if dataset else None
+        
+        return Response({
+            'session_id': str(chat_session.session_id),
+            'status': dataset.status if dataset else None,
+            'job': DatasetJobSerializer(job).data if job else None,
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AssistantMessageThumbnail(APIView):
+    """
+        PNG of an assistant message's chart, rasterized on first request (?width=, default THUMBNAIL_WIDTH) and cached by SVG hash.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, assistant_message_uuid, format=None):
+        try:
+            assistant_message = AssistantMessageModel.objects.only('svg_json', 'svg_artifact').get(uuid=assistant_message_uuid)
+        except AssistantMessageModel.DoesNotExist:
+            raise Http404
+        
+        try:
+            width = min(int(request.query_params.get('width', THUMBNAIL_WIDTH)), MAX_RASTER_WIDTH)
+        except ValueError:
+            width = 0
+        if width <= 0:
+            return Response({'error': 'width must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        svg = json.loads(assistant_message.get_svg_json() or '{}').get('svg')
+        if not svg:
+            raise Http404
+        
+        etag = f'"{svg_hash(svg)}-{width}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponse(status=304)
+        
+        response = HttpResponse(rasterize(svg, width), content_type='image/png')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class Artifact(APIView):
+    """
+        Serves a chart artifact by its content address. Artifacts never change, so they're cacheable forever,
+        and gzip-capable clients get the stored compressed bytes as-is.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, key, format=None):
+        etag = f'"{key}"'
+        if request.headers.get('If-None-Match') == etag:
+            return HttpResponse(status=304)
+        
+        try:
+            compressed = get_artifact_store().get_compressed(key)
+        except KeyError:
+            raise Http404
+        
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response = HttpResponse(compressed, content_type=artifact_content_type(key))
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(compressed), content_type=artifact_content_type(key))
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
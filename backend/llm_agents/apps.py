@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LlmAgentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'llm_agents'
+
+    def ready(self):
+        # Copy-on-write before any request can hand a cached DataFrame to generated code.
+        from llm_agents.helpers.dataframe_cache import configure_pandas
+        configure_pandas()
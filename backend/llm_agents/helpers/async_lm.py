@@ -0,0 +1,57 @@
+import dspy
+import litellm
+
+from llm_agents.helpers.llm_cache import llm_cache
+from llm_agents.helpers.progress import current_reporter
+
+
+async def apredict(module: dspy.Module, config: dict = None, **inputs) -> dspy.Prediction:
+    """
+        Async counterpart of calling a dspy Predict/ChainOfThought module.
+
+        The prompt is built and parsed by the same dspy adapter as the sync path, but the LM request goes
+        through litellm.acompletion, so an in-flight call holds no thread while it waits on the network.
+        Responses are served from / stored in llm_cache like the sync path.
+        When a progress reporter is active (see helpers/progress.py) the completion is streamed and its
+        output fields are reported as they are written.
+
+        :param module: A dspy.Predict or dspy.ChainOfThought instance.
+        :param config: Extra LM kwargs for this call (e.g. timeout, temperature).
+        :param inputs: The signature's input fields.
+        :return: A dspy.Prediction with the signature's output fields.
+    """
+    params, prediction = llm_cache.lookup(module, inputs, config)
+    if prediction is not None:
+        return prediction
+    
+    predictor = module.predictors()[0]
+    # ChainOfThought's predictor carries the signature extended with the reasoning field.
+    signature = getattr(predictor, 'extended_signature', None) or predictor.signature
+    lm = predictor.lm or dspy.settings.lm
+    adapter = dspy.settings.adapter or dspy.ChatAdapter()
+
+    messages = adapter.format(signature, predictor.demos, inputs)
+    lm_kwargs = {**lm.kwargs, **(config or {})}
+    reporter = current_reporter.get()
+    if reporter is None:
+        response = await litellm.acompletion(model=lm.model, messages=messages, **lm_kwargs)
+        completion = response.choices[0].message.content
+    else:
+        completion = await _astream_completion(lm.model, messages, lm_kwargs, reporter.new_stream())
+
+    prediction = dspy.Prediction(**adapter.parse(signature, completion))
+    llm_cache.store(params, prediction)
+    return prediction
+
+
+async def _astream_completion(model: str, messages: list, lm_kwargs: dict, stream) -> str:
+    """Full completion text of a streamed litellm call, feeding each chunk to stream as it arrives."""
+    parts = []
+    response = await litellm.acompletion(model=model, messages=messages, stream=True, **lm_kwargs)
+    async for chunk in response:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            stream.feed(delta)
+    stream.close()
+    return ''.join(parts)
@@ -0,0 +1,273 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Union
+
+# Set CHART_TEMPLATES_ENABLED=False to send every chart through LLM codegen.
+CHART_TEMPLATES_ENABLED = os.environ.get('CHART_TEMPLATES_ENABLED', 'True') == 'True'
+
+# Bars/slices beyond these are folded into one "Other" bar/slice so charts stay readable.
+MAX_BARS = 20
+MAX_PIE_SLICES = 8
+# Scatter plots draw at most this many points.
+MAX_SCATTER_POINTS = 5000
+
+CATEGORY_DTYPES = ('category', 'boolean', 'string')
+
+# What the visualization's reason asks for, by keyword. A template is only used when the reason names exactly
+# one aggregation the template supports (or none, where the template's default is the only sensible reading).
+AGGREGATION_KEYWORDS = {
+    'sum': ('sum', 'sums', 'total', 'totals'),
+    'mean': ('mean', 'means', 'average', 'averages', 'avg'),
+    'count': ('count', 'counts', 'number of', 'how many', 'frequency', 'frequencies'),
+    'share': ('share', 'shares', 'proportion', 'proportions', 'percent', 'percentage', 'percentages', 'composition'),
+}
+# Anything templates can't express: other statistics, derived measures, rankings and filters on rows.
+UNSUPPORTED_KEYWORDS = (
+    'median', 'max', 'maximum', 'min', 'minimum', 'std', 'variance', 'ratio', 'rate', 'rates', 'growth', 'change',
+    'cumulative', 'running', 'rolling', 'difference', 'top', 'bottom', 'highest', 'lowest', 'rank', 'ranking',
+    'only', 'excluding', 'except', 'where', 'filter', 'filtered', 'above', 'below', 'greater', 'less', 'more than',
+    'fewer', 'after', 'before', 'since', 'until', 'last', 'first', 'recent',
+)
+UNSUPPORTED = 'unsupported'
+
+VIZ_CODE_FOOTER = """
+plt.tight_layout()
+plt.savefig(svg_buffer, format='svg')
+plt.close()
+"""
+
+
+@dataclass
+class ChartCode:
+    """Extract and plotting code for one chart, in the same shape the LLM codegen produces."""
+    pd_code: str
+    pd_viz_code: str
+
+
+def _mentions(text: str, keywords) -> bool:
+    return any(re.search(rf"\b{re.escape(keyword)}\b", text) for keyword in keywords)
+
+
+def requested_aggregation(reason: str) -> Union[str, None]:
+    """
+        The aggregation reason asks for: 'sum', 'mean', 'count' or 'share', None when it names none,
+        or UNSUPPORTED when it names several or anything no template computes.
+    """
+    text = (reason or '').lower()
+    if _mentions(text, UNSUPPORTED_KEYWORDS):
+        return UNSUPPORTED
+    found = [aggregation for aggregation, keywords in AGGREGATION_KEYWORDS.items() if _mentions(text, keywords)]
+    if len(found) > 1:
+        return UNSUPPORTED
+    return found[0] if found else None
+
+
+def _columns_by_dtype(columns_involved, enriched_column_properties) -> Union[dict, None]:
+    """
+        Groups columns_involved by enriched dtype into numbers, dates and categories.
+        Returns None if a column is unknown or has a dtype no template handles.
+    """
+    dtypes = {column_dict['column_name']: column_dict.get('properties', {}).get('dtype') for column_dict in enriched_column_properties or []}
+    groups = {'number': [], 'date': [], 'category': []}
+    for column in columns_involved or []:
+        dtype = dtypes.get(column)
+        if dtype == 'number':
+            groups['number'].append(column)
+        elif dtype == 'date':
+            groups['date'].append(column)
+        elif dtype in CATEGORY_DTYPES:
+            groups['category'].append(column)
+        else:
+            return None
+    if len(set(columns_involved)) != len(columns_involved):
+        return None
+    return groups
+
+
+def _category_values_code(x: str, y: Union[str, None], aggregation: str, max_items: int) -> str:
+    """
+        Extract code for one value per category of x, largest first. Categories beyond max_items are folded
+        into a single 'Other' item (aggregated the same way) so nothing is dropped silently.
+    """
+    if y is None:
+        return f"""
+values = df[{x!r}].value_counts()
+if len(values) > {max_items}:
+    values = pd.concat([values.head({max_items - 1}), pd.Series({{'Other': values.iloc[{max_items - 1}:].sum()}})])
+extract_df = values.rename_axis({x!r}).reset_index(name='count')
+"""
+    if aggregation == 'mean':
+        return f"""
+grouped = df.groupby({x!r}, observed=True, dropna=False)[{y!r}].agg(['sum', 'count'])
+grouped['mean'] = grouped['sum'] / grouped['count']
+grouped = grouped.sort_values('mean', ascending=False)
+values = grouped['mean']
+if len(grouped) > {max_items}:
+    rest = grouped.iloc[{max_items - 1}:]
+    values = pd.concat([values.head({max_items - 1}), pd.Series({{'Other': rest['sum'].sum() / rest['count'].sum()}})])
+extract_df = values.rename_axis({x!r}).reset_index(name={y!r})
+"""
+    return f"""
+values = df.groupby({x!r}, observed=True, dropna=False)[{y!r}].sum().sort_values(ascending=False)
+if len(values) > {max_items}:
+    values = pd.concat([values.head({max_items - 1}), pd.Series({{'Other': values.iloc[{max_items - 1}:].sum()}})])
+extract_df = values.rename_axis({x!r}).reset_index(name={y!r})
+"""
+
+
+def _bar_chart(groups: dict, aggregation: Union[str, None]) -> Union[ChartCode, None]:
+    if len(groups['category']) != 1 or groups['date'] or len(groups['number']) > 1:
+        return None
+    x = groups['category'][0]
+    if groups['number']:
+        if aggregation not in ('sum', 'mean'):
+            return None
+        y = groups['number'][0]
+        ylabel = f"{y} ({aggregation})"
+    elif aggregation in (None, 'count'):
+        y, ylabel = None, 'count'
+    else:
+        return None
+    pd_code = _category_values_code(x, y, aggregation, MAX_BARS)
+    pd_viz_code = f"""
+fig, ax = plt.subplots(figsize=(6, 4))
+extract_df.plot.bar(x={x!r}, y={y or 'count'!r}, rot=45, ax=ax, legend=True)
+ax.set_xlabel({x!r})
+ax.set_ylabel({ylabel!r})
+ax.set_title({f"{ylabel} by {x}"!r})
+""" + VIZ_CODE_FOOTER
+    return ChartCode(pd_code=pd_code, pd_viz_code=pd_viz_code)
+
+
+def _pie_chart(groups: dict, aggregation: Union[str, None]) -> Union[ChartCode, None]:
+    if len(groups['category']) != 1 or groups['date'] or len(groups['number']) > 1:
+        return None
+    x = groups['category'][0]
+    if groups['number']:
+        # Slices of a pie are shares of a total, so only sums make sense.
+        if aggregation not in ('sum', 'share'):
+            return None
+        y = groups['number'][0]
+    elif aggregation in (None, 'count', 'share'):
+        y = None
+    else:
+        return None
+    pd_code = _category_values_code(x, y, 'sum', MAX_PIE_SLICES)
+    pd_viz_code = f"""
+fig, ax = plt.subplots(figsize=(6, 4))
+extract_df.plot.pie(y={y or 'count'!r}, labels=extract_df[{x!r}].astype(str), autopct='%1.1f%%', ax=ax, legend=False)
+ax.set_ylabel('')
+ax.set_title({f"{y or 'count'} by {x}"!r})
+""" + VIZ_CODE_FOOTER
+    return ChartCode(pd_code=pd_code, pd_viz_code=pd_viz_code)
+
+
+def _series_over_x(groups: dict, aggregation: Union[str, None], kind: str) -> Union[ChartCode, None]:
+    """Line and area charts: sums or means of the number columns over a date (or, failing that, a number) x axis."""
+    if groups['category'] or len(groups['date']) > 1:
+        return None
+    if groups['date']:
+        x, ys, is_date = groups['date'][0], groups['number'], True
+    elif len(groups['number']) >= 2:
+        x, ys, is_date = groups['number'][0], groups['number'][1:], False
+    else:
+        return None
+
+    convert_x = f"extract_df[{x!r}] = pd.to_datetime(extract_df[{x!r}], errors='coerce')\n" if is_date else ""
+    if ys:
+        if aggregation not in ('sum', 'mean'):
+            return None
+        pd_code = (
+            f"extract_df = df[{[x, *ys]!r}].copy()\n"
+            + convert_x
+            + f"extract_df = extract_df.dropna(subset=[{x!r}]).groupby({x!r})[{ys!r}].{aggregation}().sort_index().reset_index()\n"
+        )
+        ylabel = f"{ys[0]} ({aggregation})" if len(ys) == 1 else aggregation
+    elif aggregation in (None, 'count'):
+        ys = ['count']
+        pd_code = (
+            f"extract_df = df[[{x!r}]].copy()\n"
+            + convert_x
+            + f"extract_df = extract_df.dropna(subset=[{x!r}]).groupby({x!r}).size().sort_index().reset_index(name='count')\n"
+        )
+        ylabel = 'count'
+    else:
+        return None
+    extra = ", stacked=False" if kind == 'area' else ""
+    pd_viz_code = f"""
+fig, ax = plt.subplots(figsize=(6, 4))
+extract_df.plot.{kind}(x={x!r}, y={ys!r}, ax=ax, legend=True{extra})
+ax.set_xlabel({x!r})
+ax.set_ylabel({ylabel!r})
+ax.set_title({f"{ylabel} over {x}"!r})
+""" + VIZ_CODE_FOOTER
+    return ChartCode(pd_code=pd_code, pd_viz_code=pd_viz_code)
+
+
+def _scatter_plot_chart(groups: dict, aggregation: Union[str, None]) -> Union[ChartCode, None]:
+    if len(groups['number']) != 2 or groups['date'] or groups['category'] or aggregation is not None:
+        return None
+    x, y = groups['number']
+    pd_code = f"""
+extract_df = df[[{x!r}, {y!r}]].dropna()
+if len(extract_df) > {MAX_SCATTER_POINTS}:
+    extract_df = extract_df.sample({MAX_SCATTER_POINTS}, random_state=42)
+"""
+    pd_viz_code = f"""
+fig, ax = plt.subplots(figsize=(6, 4))
+extract_df.plot.scatter(x={x!r}, y={y!r}, alpha=0.5, ax=ax, label={f"{y} vs {x}"!r})
+ax.set_xlabel({x!r})
+ax.set_ylabel({y!r})
+ax.set_title({f"{y} vs {x}"!r})
+""" + VIZ_CODE_FOOTER
+    return ChartCode(pd_code=pd_code, pd_viz_code=pd_viz_code)
+
+
+def _hexbin_chart(groups: dict, aggregation: Union[str, None]) -> Union[ChartCode, None]:
+    if len(groups['number']) not in (2, 3) or groups['date'] or groups['category']:
+        return None
+    x, y = groups['number'][:2]
+    c = groups['number'][2] if len(groups['number']) == 3 else None
+    if c is not None and aggregation not in ('sum', 'mean'):
+        return None
+    if c is None and aggregation not in (None, 'count'):
+        return None
+    pd_code = f"extract_df = df[{groups['number']!r}].dropna()\n"
+    c_args = f", C={c!r}, reduce_C_function=np.{aggregation}" if c else ""
+    pd_viz_code = f"""
+fig, ax = plt.subplots(figsize=(6, 4))
+extract_df.plot.hexbin(x={x!r}, y={y!r}{c_args}, gridsize=25, cmap='viridis', ax=ax)
+ax.set_xlabel({x!r})
+ax.set_ylabel({y!r})
+ax.set_title({(f"{aggregation} {c} by {x} and {y}" if c else f"{y} vs {x} density")!r})
+""" + VIZ_CODE_FOOTER
+    return ChartCode(pd_code=pd_code, pd_viz_code=pd_viz_code)
+
+
+CHART_TEMPLATES = {
+    'bar_chart': _bar_chart,
+    'pie_chart': _pie_chart,
+    'line_chart': lambda groups, aggregation: _series_over_x(groups, aggregation, 'line'),
+    'area_chart': lambda groups, aggregation: _series_over_x(groups, aggregation, 'area'),
+    'scatter_plot_chart': _scatter_plot_chart,
+    'hexbin_chart': _hexbin_chart,
+}
+
+
+def render_chart_code(visualization_type: str, columns_involved, enriched_column_properties, reason: str = None) -> Union[ChartCode, None]:
+    """
+        Deterministic extract/plotting code for the standard chart types, built from the enriched dtypes
+        of columns_involved and the aggregation the visualization's reason asks for. Returns None when no
+        template fits or the aggregation is ambiguous, in which case the caller falls back to LLM codegen.
+
+        The code follows the same namespace contract as the LLM code: the extract code reads df and sets
+        extract_df, the plotting code reads extract_df and saves an svg into svg_buffer.
+    """
+    if not CHART_TEMPLATES_ENABLED or visualization_type not in CHART_TEMPLATES:
+        return None
+    groups = _columns_by_dtype(columns_involved, enriched_column_properties)
+    aggregation = requested_aggregation(reason)
+    if groups is None or aggregation == UNSUPPORTED:
+        return None
+    return CHART_TEMPLATES[visualization_type](groups, aggregation)
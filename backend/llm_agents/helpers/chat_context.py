@@ -0,0 +1,175 @@
+import os
+import re
+import json
+from dataclasses import dataclass, field
+from typing import List, Union
+
+import dspy
+import tiktoken
+
+from chat.models import ChatSession as ChatSessionModel, UserMessage as UserMessageModel
+from llm_agents.helpers.llm_cache import predict
+
+# Token budget of the whole chat_context passed to QuestionRefiner, and the part of it the rolling summary may use.
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 1500))
+CHAT_SUMMARY_TOKEN_BUDGET = int(os.environ.get('CHAT_SUMMARY_TOKEN_BUDGET', 400))
+# Most recent questions considered verbatim; older ones only reach the prompt through the summary.
+CHAT_CONTEXT_RECENT_TURNS = int(os.environ.get('CHAT_CONTEXT_RECENT_TURNS', 20))
+# Older questions are folded into the summary once at least this many are pending, at most CHAT_SUMMARY_MAX_BATCH per update.
+CHAT_SUMMARY_MIN_BATCH = int(os.environ.get('CHAT_SUMMARY_MIN_BATCH', 10))
+CHAT_SUMMARY_MAX_BATCH = 200
+
+_encoding = tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding.encode(text or ''))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokens = _encoding.encode(text or '')
+    if len(tokens) <= max_tokens:
+        return text or ''
+    return _encoding.decode(tokens[:max_tokens])
+
+
+@dataclass
+class ChatContextWindow:
+    """What a refine needs from the session history: the rolling summary and the latest questions (oldest first)."""
+    summary: Union[str, None] = None
+    recent_questions: List[str] = field(default_factory=list)
+
+
+class ChatSummary(dspy.Signature):
+    """
+        Given the running summary of a data exploration chat and the user's next questions, return an updated summary.
+        Keep the topics, columns and comparisons the user cared about and drop repetition. Keep it under 200 words.
+    """
+    previous_summary = dspy.InputField(desc="Summary of the chat so far. May be empty.")
+    questions = dspy.InputField(desc="JSON list of the user's questions since the summary, oldest first.")
+    summary = dspy.OutputField(desc="Updated summary of the chat.")
+
+
+def summary_query(chat_session):
+    return ChatSessionModel.objects.filter(pk=chat_session.pk).values_list('context_summary', flat=True)
+
+
+def recent_questions_query(chat_session, recent_turns: int = None):
+    """The last recent_turns questions of the session, newest first."""
+    recent_turns = recent_turns or CHAT_CONTEXT_RECENT_TURNS
+    return UserMessageModel.objects.filter(session=chat_session).order_by('-id').values_list('question', flat=True)[:recent_turns]
+
+
+def load_context_window(chat_session, recent_turns: int = None) -> ChatContextWindow:
+    """Reads the summary and the last recent_turns questions. Both reads are bounded regardless of session length."""
+    summary = summary_query(chat_session).first()
+    recent = recent_questions_query(chat_session, recent_turns)
+    return ChatContextWindow(summary=summary, recent_questions=[question for question in reversed(recent) if question])
+
+
+def update_context_summary(chat_session, recent_turns: int = None) -> bool:
+    """
+        Folds questions that have left the recent window into the session's rolling summary.
+        Does nothing until CHAT_SUMMARY_MIN_BATCH questions are pending. Returns whether the summary changed.
+        The write only applies if nobody else folded questions since the read, so concurrent updates
+        (e.g. from several tabs) never fold the same batch twice.
+    """
+    recent_turns = recent_turns or CHAT_CONTEXT_RECENT_TURNS
+    session = ChatSessionModel.objects.only('context_summary', 'context_summary_until_id').get(pk=chat_session.pk)
+    messages = UserMessageModel.objects.filter(session=chat_session).order_by('-id')
+    window_start = messages.values_list('id', flat=True)[recent_turns:recent_turns + 1].first()
+    if window_start is None:
+        return False
+
+    pending = list(
+        UserMessageModel.objects
+        .filter(session=chat_session, id__gt=session.context_summary_until_id or 0, id__lte=window_start)
+        .order_by('id')
+        .values_list('id', 'question')[:CHAT_SUMMARY_MAX_BATCH]
+    )
+    if len(pending) < CHAT_SUMMARY_MIN_BATCH:
+        return False
+
+    result = predict(
+        dspy.ChainOfThought(ChatSummary),
+        previous_summary=session.context_summary or '',
+        questions=json.dumps([question for _, question in pending if question])
+    )
+    updated = ChatSessionModel.objects.filter(pk=session.pk, context_summary_until_id=session.context_summary_until_id).update(
+        context_summary=truncate_tokens(result.summary, CHAT_SUMMARY_TOKEN_BUDGET),
+        context_summary_until_id=pending[-1][0]
+    )
+    return updated > 0
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9_]+", (text or '').lower()))
+
+
+def select_turns(current_question: str, questions: List[str], token_budget: int) -> List[str]:
+    """
+        Picks the questions most worth keeping within token_budget, scored by word overlap with the current
+        question plus recency, and returns them in chat order.
+    """
+    current_words = _words(current_question)
+    n = len(questions)
+
+    def score(idx):
+        overlap = len(_words(questions[idx]) & current_words) / max(len(current_words), 1)
+        return overlap + (idx + 1) / n
+
+    chosen, used = [], 0
+    for idx in sorted(range(n), key=score, reverse=True):
+        tokens = count_tokens(questions[idx])
+        if used + tokens > token_budget:
+            continue
+        chosen.append(idx)
+        used += tokens
+    return [questions[idx] for idx in sorted(chosen)]
+
+
+def build_chat_context(current_question: str, assistant_message, window: ChatContextWindow, token_budget: int = None) -> str:
+    """
+        chat_context for QuestionRefiner within token_budget: the previous chart, then the rolling summary,
+        then as many relevant recent questions as still fit.
+    """
+    token_budget = token_budget or CHAT_CONTEXT_TOKEN_BUDGET
+    previous_questions = [question for question in window.recent_questions if question != current_question]
+    prev_question = previous_questions[-1] if len(previous_questions) > 0 else current_question
+
+    chat_context = f"""
+            current question: {current_question}
+            previous question: {prev_question}
+            Previous reason: {assistant_message.reason}
+            Previous visualization name: {assistant_message.viz_name}
+            Previous columns involved: {assistant_message.columns_involved}
+        """
+    remaining = token_budget - count_tokens(chat_context)
+
+    # The wrappers around the summary and the question list count towards the budget too.
+    summary = ''
+    if window.summary:
+        summary_budget = min(CHAT_SUMMARY_TOKEN_BUDGET, remaining - count_tokens(_render_prefix('x', [])))
+        summary = truncate_tokens(window.summary, max(summary_budget, 0))
+        remaining -= count_tokens(_render_prefix(summary, []))
+
+    remaining -= count_tokens(_render_prefix('', ['x']))
+    turns = select_turns(current_question, previous_questions[:-1], remaining) if remaining > 0 else []
+
+    # select_turns counts the questions alone; drop the oldest while list quoting pushes the total over budget.
+    while turns and count_tokens(_render_prefix(summary, turns) + chat_context) > token_budget:
+        turns = turns[1:]
+    return _render_prefix(summary, turns) + chat_context
+
+
+def _render_prefix(summary: str, turns: List[str]) -> str:
+    prefix = ''
+    if summary:
+        prefix += f"""
+                Summary of the earlier chat: {summary}
+            """
+    if turns:
+        prefix += f"""
+                User's last questions: {turns}
+            """
+    return prefix
@@ -0,0 +1,324 @@
+import io
+import os
+import queue
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+
+import pandas as pd
+import pyarrow as pa
+
+# 'inprocess' keeps the old exec() on the calling thread; 'process' opts in to a pool of sandboxed worker
+# processes. RLIMIT_AS counts the datasets a worker memory-maps, so with the process backend
+# CODE_EXECUTOR_MEMORY_BYTES has to leave room for the largest dataset on top of what the code allocates.
+CODE_EXECUTOR_BACKEND = os.environ.get('CODE_EXECUTOR_BACKEND', 'inprocess')
+CODE_EXECUTOR_WORKERS = int(os.environ.get('CODE_EXECUTOR_WORKERS', min(4, os.cpu_count() or 1)))
+# Per-task limits. Wall time is enforced by the parent (the worker is killed and replaced),
+# CPU time and address space by the worker's own rlimits.
+CODE_EXECUTOR_TIMEOUT = float(os.environ.get('CODE_EXECUTOR_TIMEOUT', 60))
+CODE_EXECUTOR_CPU_SECONDS = int(os.environ.get('CODE_EXECUTOR_CPU_SECONDS', 60))
+CODE_EXECUTOR_MEMORY_BYTES = int(os.environ.get('CODE_EXECUTOR_MEMORY_BYTES', 8 * 1024 ** 3))
+
+
+class CodeExecutionError(Exception):
+    """Generated code raised, or its worker was killed for exceeding a limit."""
+
+
+class CodeLimitExceeded(CodeExecutionError):
+    """The worker timed out or was killed for exceeding its CPU or memory limit."""
+
+
+def clean_code(code):
+    return code.strip('`').replace('python', '').strip()
+
+
+def dataframe_to_shared(df: pd.DataFrame):
+    """Writes df as an Arrow IPC stream into a new shared memory segment. Returns (name, size)."""
+    sink = pa.BufferOutputStream()
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    payload = sink.getvalue()
+    shm = shared_memory.SharedMemory(create=True, size=max(payload.size, 1))
+    # Arrow buffers export signed bytes ('b'); the segment's view is unsigned ('B').
+    shm.buf[:payload.size] = memoryview(payload).cast('B')
+    shm.close()
+    return shm.name, payload.size
+
+
+def dataframe_from_shared(name: str, size: int, unlink: bool = False) -> pd.DataFrame:
+    """Reads a DataFrame written by dataframe_to_shared, optionally freeing the segment."""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # Copy out before closing: Arrow buffers must not outlive the mapping.
+        payload = pa.py_buffer(bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+    return pa.ipc.open_stream(payload).read_pandas()
+
+
+def _set_cpu_limit(seconds):
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = int(usage.ru_utime + usage.ru_stime) + seconds
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    # Exceeding the soft limit delivers SIGXCPU, which terminates the worker.
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+
+
+def _set_memory_limit(nbytes):
+    import resource
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        nbytes = min(nbytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (nbytes, hard))
+
+
+class _WorkerState:
+    """Datasets (memory-mapped, see shared_datasets.py) and samples held by one worker process, reused across tasks."""
+    def __init__(self) -> None:
+        self.datasets = {}
+        self.samples = {}
+
+    def dataset(self, path: str) -> pd.DataFrame:
+        # Unmap datasets whose last user has released them (the registry deletes the file).
+        for released in [p for p in self.datasets if not os.path.exists(p)]:
+            del self.datasets[released]
+            self.samples = {k: v for k, v in self.samples.items() if k[0] != released}
+        if path not in self.datasets:
+            from llm_agents.helpers.shared_datasets import map_dataset
+            self.datasets[path] = map_dataset(path)
+        return self.datasets[path]
+
+    def frame(self, task: dict) -> pd.DataFrame:
+        df = self.dataset(task['dataset'])
+        if not task.get('sample_rows'):
+            return df
+        from llm_agents.helpers import sampling
+        key = (task['dataset'], task['sample_rows'], task.get('stratify_by'))
+        if key not in self.samples:
+            self.samples[key] = sampling.sample_dataframe(df, task['sample_rows'], stratify_by=task.get('stratify_by'))
+        return self.samples[key]
+
+    def run(self, task: dict) -> dict:
+        import numpy as np
+        import matplotlib.pyplot as plt
+        import mplcursors
+
+        if task['kind'] == 'load':
+            self.dataset(task['dataset'])
+            return {}
+
+        # Lazy copy (copy-on-write is on), so generated code can't change the mapped frame, even in place.
+        local_namespace = {'pd': pd, 'df': self.frame(task).copy(deep=False), 'plt': plt, 'mplcursors': mplcursors, 'np': np, 'columns_involved': task.get('columns_involved')}
+
+        if task['kind'] == 'extract':
+            exec(clean_code(task['code']), local_namespace, local_namespace)
+            extract_df = local_namespace.get('extract_df')
+            if not isinstance(extract_df, pd.DataFrame):
+                extract_df = pd.DataFrame(extract_df)
+            name, size = dataframe_to_shared(extract_df)
+            return {'extract_df': (name, size)}
+
+        if task['kind'] == 'viz':
+            local_namespace['extract_df'] = dataframe_from_shared(*task['extract_df'])
+            local_namespace['svg_buffer'] = io.BytesIO()
+            try:
+                exec(clean_code(task['code']), local_namespace, local_namespace)
+            finally:
+                plt.close('all')
+            return {'svg': local_namespace['svg_buffer'].getvalue().decode('utf-8')}
+
+        raise ValueError(f"Unknown task kind {task['kind']}")
+
+
+def _worker_main(conn, memory_bytes, preload_paths):
+    """Entry point of a worker process: warm imports, apply limits, then serve tasks until the pipe closes."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import mplcursors
+    # Mapped datasets are shared read-only between tasks; see dataframe_cache.configure_pandas().
+    from llm_agents.helpers.dataframe_cache import configure_pandas
+    configure_pandas()
+
+    _set_memory_limit(memory_bytes)
+    state = _WorkerState()
+    for path in preload_paths:
+        try:
+            state.dataset(path)
+        except Exception as e:
+            print("Skipping dataset preload because of error: ", e, path)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        _set_cpu_limit(task.get('cpu_seconds'))
+        try:
+            result = {'ok': True, **state.run(task)}
+        except BaseException as e:
+            result = {'ok': False, 'error': f"{type(e).__name__}: {e}", 'traceback': traceback.format_exc()}
+        finally:
+            _set_cpu_limit(None)
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, context, memory_bytes: int, preload_paths: list) -> None:
+        self.context = context
+        self.memory_bytes = memory_bytes
+        self.start(preload_paths)
+
+    def start(self, preload_paths: list):
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_worker_main, args=(child_conn, self.memory_bytes, preload_paths), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def restart(self, preload_paths: list):
+        """Replaces the process (and its mapped datasets) in place, so the pool keeps one slot per worker."""
+        self.kill()
+        self.start(preload_paths)
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ProcessCodeExecutor:
+    """
+        Runs generated pandas/matplotlib code in a pool of pre-warmed, sandboxed worker processes.
+
+        Workers are spawned with pandas/matplotlib already imported and memory-map the datasets published
+        by the SharedDatasetRegistry, so a task only ships code, a dataset path and small arguments. Each task runs under an RLIMIT_CPU budget
+        and the worker under RLIMIT_AS; tasks exceeding the wall-clock timeout get their worker killed
+        and replaced. extract_df travels between processes as Arrow IPC in shared memory.
+    """
+    def __init__(self, workers: int = None, timeout: float = None, cpu_seconds: int = None, memory_bytes: int = None) -> None:
+        self.workers = workers or CODE_EXECUTOR_WORKERS
+        self.timeout = timeout or CODE_EXECUTOR_TIMEOUT
+        self.cpu_seconds = cpu_seconds or CODE_EXECUTOR_CPU_SECONDS
+        self.memory_bytes = memory_bytes or CODE_EXECUTOR_MEMORY_BYTES
+        # spawn, not fork: the server process has threads and an event loop we don't want copied.
+        self._context = multiprocessing.get_context('spawn')
+        self._preload_paths = []
+        self._preload_lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(self.workers):
+            self._idle.put(_Worker(self._context, self.memory_bytes, []))
+
+    def _published_paths(self) -> list:
+        with self._preload_lock:
+            self._preload_paths = [path for path in self._preload_paths if os.path.exists(path)]
+            return list(self._preload_paths)
+
+    def _submit(self, task: dict, timeout: float = None) -> dict:
+        worker = self._idle.get()
+        try:
+            return self._run_on(worker, task, timeout)
+        finally:
+            self._idle.put(worker)
+
+    def _run_on(self, worker: _Worker, task: dict, timeout: float = None) -> dict:
+        timeout = timeout or self.timeout
+        try:
+            worker.conn.send({'cpu_seconds': self.cpu_seconds, **task})
+            if not worker.conn.poll(timeout):
+                worker.restart(self._published_paths())
+                raise CodeLimitExceeded(f"Code execution timed out after {timeout}s")
+            result = worker.conn.recv()
+        except (EOFError, OSError):
+            # The worker died mid-task: CPU limit (SIGXCPU), OOM kill or a crash in native code.
+            exitcode = worker.process.exitcode
+            worker.restart(self._published_paths())
+            raise CodeLimitExceeded(f"Code execution worker died (exit code {exitcode}), likely exceeding its CPU or memory limit")
+
+        if not result.pop('ok'):
+            print("Generated code failed in worker: ", result.get('traceback'))
+            raise CodeExecutionError(result['error'])
+        return result
+
+    def preload(self, dataset_path: str):
+        """
+            Maps a published dataset into the workers in the background so the first chart doesn't pay for it.
+            Workers started later (replacements) map it on startup while the dataset is still published.
+        """
+        with self._preload_lock:
+            if dataset_path in self._preload_paths:
+                return
+            self._preload_paths.append(dataset_path)
+
+        def load_all():
+            # Hold each worker until every one has loaded, so no worker is handed the load twice.
+            loaded = []
+            try:
+                for _ in range(self.workers):
+                    worker = self._idle.get()
+                    loaded.append(worker)
+                    try:
+                        self._run_on(worker, {'kind': 'load', 'dataset': dataset_path})
+                    except Exception as e:
+                        print("Skipping dataset preload because of error: ", e, dataset_path)
+            finally:
+                for worker in loaded:
+                    self._idle.put(worker)
+        threading.Thread(target=load_all, daemon=True).start()
+
+    def run_extract(self, dataset_path: str, code: str, columns_involved, sample_rows: int = None, stratify_by: str = None) -> pd.DataFrame:
+        """Runs extract code against a published dataset (or a sample of it) and returns extract_df."""
+        result = self._submit({
+            'kind': 'extract',
+            'dataset': dataset_path,
+            'code': code,
+            'columns_involved': columns_involved,
+            'sample_rows': sample_rows,
+            'stratify_by': stratify_by,
+        })
+        return dataframe_from_shared(*result['extract_df'], unlink=True)
+
+    def run_viz(self, dataset_path: str, code: str, extract_df: pd.DataFrame, columns_involved) -> str:
+        """Runs plotting code with extract_df in its namespace and returns the SVG it saved into svg_buffer."""
+        name, size = dataframe_to_shared(extract_df)
+        try:
+            result = self._submit({
+                'kind': 'viz',
+                'dataset': dataset_path,
+                'code': code,
+                'extract_df': (name, size),
+                'columns_involved': columns_involved,
+            })
+        finally:
+            segment = shared_memory.SharedMemory(name=name)
+            segment.close()
+            segment.unlink()
+        return result['svg']
+
+    def shutdown(self):
+        while not self._idle.empty():
+            self._idle.get().kill()
+
+
+_code_executor = None
+_code_executor_lock = threading.Lock()
+
+
+def get_code_executor():
+    """The process-wide ProcessCodeExecutor, or None when CODE_EXECUTOR_BACKEND is 'inprocess'."""
+    global _code_executor
+    if CODE_EXECUTOR_BACKEND != 'process':
+        return None
+    with _code_executor_lock:
+        if _code_executor is None:
+            _code_executor = ProcessCodeExecutor()
+        return _code_executor
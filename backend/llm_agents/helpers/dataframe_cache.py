@@ -0,0 +1,123 @@
+import os
+import warnings
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from llm_agents.helpers import utils
+
+
+def configure_pandas():
+    """
+        Turns on copy-on-write for this process. Called from LlmAgentsConfig.ready() and by each code executor worker.
+
+        Cached frames are shared by every session on a dataset and handed to generated code. With copy-on-write,
+        writes through any derived frame (shallow copies, column views, inplace=True) copy the data first instead
+        of changing the cached frame. Chained assignment (df[col][mask] = ...) silently stops writing through, so
+        its ChainedAssignmentError warning is raised instead: generated code doing it fails and gets regenerated.
+    """
+    pd.set_option('mode.copy_on_write', True)
+    warnings.filterwarnings('error', category=pd.errors.ChainedAssignmentError)
+
+
+class DataFrameCache:
+    """
+        Process-wide LRU cache of parsed DataFrames keyed by (uri, file version).
+
+        Entries are evicted least-recently-used first once their combined memory footprint
+        (df.memory_usage(deep=True)) exceeds max_bytes. Concurrent loads of the same file are
+        single-flighted: one caller parses it, the others wait and share the result.
+
+        Cached frames are shared between sessions and must be treated as read-only.
+    """
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (uri, version) -> (df, nbytes)
+        self._loading = {}  # (uri, version) -> threading.Event
+        self._lock = threading.Lock()
+
+    def get(self, uri: str, loader=None) -> pd.DataFrame:
+        loader = loader or utils.read_dataframe
+
+        while True:
+            key = (uri, utils.get_file_version(uri))
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+
+                event = self._loading.get(key)
+                is_loader = event is None
+                if is_loader:
+                    event = threading.Event()
+                    self._loading[key] = event
+                    self.misses += 1
+
+            if not is_loader:
+                # Another caller is parsing this file. If it failed, the loop retries the load here.
+                event.wait()
+                continue
+
+            try:
+                df = loader(uri)
+                # read_dataframe may rewrite the source with cleaned column names, which bumps its version.
+                self._put((uri, utils.get_file_version(uri)), df)
+                return df
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+                event.set()
+
+    def _put(self, key, df: pd.DataFrame):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            # Older versions of the same file will never be asked for again.
+            for stale_key in [k for k in self._entries if k[0] == key[0]]:
+                self._evict(stale_key)
+
+            if nbytes > self.max_bytes:
+                print(f"DataFrame for {key[0]} ({nbytes} bytes) exceeds the cache budget, not caching")
+                return
+
+            self._entries[key] = (df, nbytes)
+            self.total_bytes += nbytes
+
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, nbytes = self._entries.pop(key)
+        self.total_bytes -= nbytes
+
+    def version_of(self, df: pd.DataFrame):
+        """(True, file version) df was cached under when it's a cached frame, else (False, None)."""
+        with self._lock:
+            for (_, version), (cached_df, _) in self._entries.items():
+                if cached_df is df:
+                    return True, version
+        return False, None
+
+    def nbytes(self, df: pd.DataFrame) -> int:
+        """Memory footprint of df, from its cache entry when it's a cached frame."""
+        with self._lock:
+            for cached_df, nbytes in self._entries.values():
+                if cached_df is df:
+                    return nbytes
+        return int(df.memory_usage(deep=True).sum())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+
+dataframe_cache = DataFrameCache(max_bytes=int(os.environ.get('DATAFRAME_CACHE_MAX_BYTES', 2 * 1024 ** 3)))
@@ -3,16 +3,24 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import json
+import hashlib
 import warnings
 import pandas as pd
+from typing import Union
 from pprint import pprint
 from llm_agents.helpers import utils 
+from llm_agents.helpers.dataframe_cache import dataframe_cache
+from llm_agents.helpers import sampling
+from llm_agents.helpers.profiler import ColumnProfiler, check_type
 # import utils
 import dspy
 import os
 from pydantic import BaseModel, Field
 from dataclasses import dataclass
 from asgiref.sync import sync_to_async
+import time
+import concurrent.futures
+from diskcache import Cache
 
 API_KEY = os.environ.get('OPENAI_API_KEY')
 print("api_key", API_KEY)
@@ -23,29 +31,81 @@ anthropic_lm = dspy.LM('anthropic/claude-3-5-sonnet-20240620', api_key=os.enviro
 dspy.settings.configure(lm=openai_lm)
 print("dspy.settings.lm", dspy.settings.lm)
 
+# Persistent cache of semantic_type/description keyed by column fingerprint, shared across uploads.
+ENRICH_CACHE_DIR = os.environ.get('ENRICH_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'enrich'))
+ENRICH_CACHE_SIZE_LIMIT = int(os.environ.get('ENRICH_CACHE_SIZE_LIMIT', 256 * 1024 * 1024))
+enrich_cache = Cache(ENRICH_CACHE_DIR, size_limit=ENRICH_CACHE_SIZE_LIMIT, eviction_policy='least-recently-used')
+ENRICHED_FIELDS = ('semantic_type', 'description')
+# Hit/miss counters live in the cache itself, so they add up across uploads, workers and restarts.
+ENRICH_CACHE_HITS_KEY = 'stats:hits'
+ENRICH_CACHE_MISSES_KEY = 'stats:misses'
+
+
+def enrich_cache_stats(cache: Cache = None) -> dict:
+    cache = cache if cache is not None else enrich_cache
+    hits = cache.get(ENRICH_CACHE_HITS_KEY, 0)
+    misses = cache.get(ENRICH_CACHE_MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / max(hits + misses, 1)}
+
+# Rows in sample_df. With APPROXIMATE_EXTRACT the generated extract_df code runs on this sample instead
+# of the full frame; otherwise it's only used for example values when profiling large datasets.
+PROFILE_SAMPLE_ROWS = int(os.environ.get('PROFILE_SAMPLE_ROWS', 50_000))
+APPROXIMATE_EXTRACT = os.environ.get('APPROXIMATE_EXTRACT', 'False') == 'True'
+
 class DatasetHelper():
     # TODO: Move this to the models file or a helper folder for models. 
-    def __init__(self, csv_file_uri, enriched_columns_properties=None, enriched_dataset_schema=None, save_to_db=False) -> None:
+    def __init__(self, csv_file_uri, enriched_columns_properties=None, enriched_dataset_schema=None, save_to_db=False, sample_rows: int = None, approximate: bool = None) -> None:
         self.summary = None
-        self.df = utils.read_dataframe(csv_file_uri)
+        # Shared across sessions/connections in this process; copy-on-write keeps writes through derived frames off it.
+        self.df = dataframe_cache.get(csv_file_uri)
         print("df", self.df)
         self.file_name = csv_file_uri.split("/")[-1]
         self._column_properties = enriched_columns_properties
         self._dataset_schema = enriched_dataset_schema
         self.uri = csv_file_uri
+        self.sample_rows = sample_rows or PROFILE_SAMPLE_ROWS
+        self.approximate = APPROXIMATE_EXTRACT if approximate is None else approximate
+        self._sample_df = None
+        self._schema_fingerprint = None
         
         # if save_to_db:
         #     self.dataset_model = DatasetModel.objects.create(name=self.file_name, uri=csv_file_uri, description="new dataset", enriched_columns_properties=self._column_properties, enriched_dataset_schema=self._dataset_schema)
 
     def check_type(self, dtype: str, value):
         """Cast value to right type to ensure it is JSON serializable"""
-        if "float" in str(dtype):
-            return float(value)
-        elif "int" in str(dtype):
-            return int(value)
-        else:
-            return value
+        return check_type(dtype, value)
+    
+    @property
+    def schema_fingerprint(self) -> str:
+        """
+            Hash of the dataset's column names and dtypes. Datasets with the same fingerprint can run the same generated code.
+        """
+        if self._schema_fingerprint is None:
+            schema = [[str(column), str(dtype)] for column, dtype in self.df.dtypes.items()]
+            self._schema_fingerprint = hashlib.sha256(json.dumps(schema).encode('utf-8')).hexdigest()
+        return self._schema_fingerprint
         
+    @property
+    def sample_df(self):
+        """
+            Reproducible sample of at most sample_rows rows (the full df when it's smaller), stratified
+            on the lowest-cardinality category column once column properties are known.
+        """
+        if self._sample_df is None:
+            self._sample_df = sampling.sample_dataframe(self.df, self.sample_rows, stratify_by=self.stratify_column())
+        return self._sample_df
+    
+    def stratify_column(self):
+        if self._column_properties is None:
+            return None
+        category_columns = [
+            column_dict for column_dict in self._column_properties
+            if column_dict.get('properties', {}).get('dtype') == 'category' and column_dict['column_name'] in self.df.columns
+        ]
+        if not category_columns:
+            return None
+        return min(category_columns, key=lambda column_dict: column_dict['properties'].get('num_unique_values', 0))['column_name']
+    
     @property
     def enriched_column_properties(self):
         """
@@ -56,64 +116,11 @@ class DatasetHelper():
         return self._column_properties
 
     def _calculate_column_properties(self, n_samples: int = 3) -> list[dict]:
-        """Get properties of each column in a pandas DataFrame"""
-        self.properties_list = []
-        
-        for column in self.df.columns:
-            dtype = self.df[column].dtype
-            properties = {}
-            if dtype in [int, float, complex]:
-                properties["dtype"] = "number"
-                properties["std"] = self.check_type(dtype, self.df[column].std())
-                properties["min"] = self.check_type(dtype, self.df[column].min())
-                properties["max"] = self.check_type(dtype, self.df[column].max())
-
-            elif dtype == bool:
-                properties["dtype"] = "boolean"
-            elif dtype == object:
-                # Check if the string column can be cast to a valid datetime
-                try:
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        pd.to_datetime(self.df[column], errors='raise')
-                        properties["dtype"] = "date"
-                except ValueError:
-                    # Check if the string column has a limited number of values
-                    if self.df[column].nunique() / len(self.df[column]) < 0.5:
-                        properties["dtype"] = "category"
-                    else:
-                        properties["dtype"] = "string"
-            elif pd.api.types.is_categorical_dtype(self.df[column]):
-                properties["dtype"] = "category"
-            elif pd.api.types.is_datetime64_any_dtype(self.df[column]):
-                properties["dtype"] = "date"
-            else:
-                properties["dtype"] = str(dtype)
-
-            # add min max if dtype is date
-            if properties["dtype"] == "date":
-                try:
-                    properties["min"] = self.df[column].min()
-                    properties["max"] = self.df[column].max()
-                except TypeError:
-                    cast_date_col = pd.to_datetime(self.df[column], errors='coerce')
-                    properties["min"] = cast_date_col.min()
-                    properties["max"] = cast_date_col.max()
-            # Add additional properties to the output dictionary
-            nunique = self.df[column].nunique()
-            if "samples" not in properties:
-                non_null_values = self.df[column][self.df[column].notnull()].unique()
-                n_samples = min(n_samples, len(non_null_values))
-                samples = pd.Series(non_null_values).sample(
-                    n_samples, random_state=42).tolist()
-                properties["samples"] = samples
-            properties["num_unique_values"] = nunique
-            # properties["semantic_type"] = ""
-            # properties["description"] = ""
-            self.properties_list.append(
-                {"column_name": column, "properties": properties})
-            
-            
+        """
+            Get properties of each column in a pandas DataFrame. Statistics cover the full df (streamed through
+            sketches for large frames); example values come from sample_df.
+        """
+        self.properties_list = ColumnProfiler(self.df, sample_df=self.sample_df).profile(n_samples=n_samples)
         return self.properties_list
     
     @property
@@ -152,6 +159,13 @@ class FieldEnrich(dspy.Signature):
     field_json = dspy.InputField(desc="JSON of field details.")
     enriched_field_json = dspy.OutputField(desc="JSON for the semantic_type and description of the field. description should be one-liner. semantic_type should be one word with underscore and very descriptive.")
     
+class FieldsEnrich(dspy.Signature):
+    """
+        Given a JSON list of field details, generate a JSON list with the column_name, semantic_type and description of every field, in the same order.
+    """
+    fields_json = dspy.InputField(desc="JSON list of field details.")
+    enriched_fields_json = dspy.OutputField(desc="JSON list with one object per field, in the same order, each with column_name, semantic_type and description. description should be one-liner. semantic_type should be one word with underscore and very descriptive. Output begins with [ and ends with ].")
+    
 #Define a simple signature for basic question answering
 class EnrichDatasetDescription(dspy.Signature):
     """
@@ -161,27 +175,141 @@ class EnrichDatasetDescription(dspy.Signature):
     dataset_description = dspy.OutputField(desc="One line description of the dataset")
     
 class DatasetEnrich(dspy.Module):
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, max_workers: int = None, column_timeout: float = None, max_retries: int = None, batch_token_budget: int = None) -> None:
         self.dataset = DatasetHelper(url)
         self.enriched_field_json = dspy.ChainOfThought(FieldEnrich)
+        self.enriched_fields_json = dspy.ChainOfThought(FieldsEnrich)
         self.dataset_description = dspy.ChainOfThought(EnrichDatasetDescription)
+        self.max_workers = max_workers or int(os.environ.get('ENRICH_MAX_WORKERS', 8))
+        self.column_timeout = column_timeout or float(os.environ.get('ENRICH_COLUMN_TIMEOUT', 60))
+        self.max_retries = max_retries if max_retries is not None else int(os.environ.get('ENRICH_MAX_RETRIES', 2))
+        # Token budget for the field details packed into one batched prompt. 0 disables batching.
+        self.batch_token_budget = batch_token_budget if batch_token_budget is not None else int(os.environ.get('ENRICH_BATCH_TOKEN_BUDGET', 2000))
+        self.cache = enrich_cache
         
-    def enrich_fields(self):
+    def _column_fingerprint(self, column_dict: dict) -> dict:
         """
-            Enriches each field in the csv with description & semantic_type.
+            Cache key params for a column: its name plus dtype, stats and samples from _calculate_column_properties.
+        """
+        properties = {k: v for k, v in column_dict['properties'].items() if k not in ENRICHED_FIELDS}
+        # Round-trip through JSON so timestamps/numpy scalars hash the same way on every upload.
+        return json.loads(json.dumps({'column_name': column_dict['column_name'], 'properties': properties}, sort_keys=True, default=str))
+    
+    def _get_cached_column(self, column_dict: dict) -> Union[dict, None]:
+        enriched_fields = utils.cache_request(self.cache, self._column_fingerprint(column_dict))
+        self.cache.incr(ENRICH_CACHE_MISSES_KEY if enriched_fields is None else ENRICH_CACHE_HITS_KEY)
+        if enriched_fields is None:
+            return None
+        return {**column_dict, 'properties': {**column_dict['properties'], **enriched_fields}}
+    
+    def _cache_column(self, column_dict: dict):
+        enriched_fields = {k: column_dict['properties'][k] for k in ENRICHED_FIELDS if k in column_dict['properties']}
+        if len(enriched_fields) == len(ENRICHED_FIELDS):
+            utils.cache_request(self.cache, self._column_fingerprint(column_dict), enriched_fields)
+        
+    def _enrich_column(self, column_dict: dict) -> Union[dict, None]:
+        """
+            Enriches a single column, retrying on LLM/JSON errors. Returns None if every attempt fails.
         """
-        column_properties_enriched = []
-        for column_dict in self.dataset.enriched_column_properties:
+        for attempt in range(self.max_retries + 1):
             try:
-                pred = self.enriched_field_json(field_json=column_dict)
+                # The timeout is forwarded to the LM call so a hung request doesn't pin a worker. Retries skip
+                # dspy's LM cache, which would otherwise return the same bad completion for the same prompt.
+                config = {'timeout': self.column_timeout}
+                if attempt > 0:
+                    config['cache'] = False
+                pred = self.enriched_field_json(field_json=column_dict, config=config)
                 enriched_fields = json.loads(pred.enriched_field_json)
+                return {**column_dict, 'properties': {**column_dict['properties'], **enriched_fields}}
             except json.decoder.JSONDecodeError:
-                print("Error in decoding JSON for column: ", column_dict['column_name'])
-                continue
+                print("Error in decoding JSON for column: ", column_dict['column_name'], "attempt", attempt + 1)
+            except Exception as e:
+                print("Error enriching column: ", column_dict['column_name'], "attempt", attempt + 1, e)
+            if attempt < self.max_retries:
+                time.sleep(0.5 * 2 ** attempt)
+        return None
+    
+    def _column_tokens(self, column_dict: dict) -> int:
+        return utils.num_tokens_from_messages([{"role": "user", "content": json.dumps(column_dict, default=str)}])
+    
+    def _make_batches(self, column_dicts: list[dict]) -> list[list[int]]:
+        """
+            Greedily packs column indexes into batches whose field details fit in batch_token_budget.
+        """
+        batches, current, current_tokens = [], [], 0
+        for idx, column_dict in enumerate(column_dicts):
+            tokens = self._column_tokens(column_dict)
+            if current and current_tokens + tokens > self.batch_token_budget:
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(idx)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _enrich_batch(self, batch: list[dict]) -> list[Union[dict, None]]:
+        """
+            Enriches several columns with one LLM call. If the response can't be matched back to the
+            columns, the batch is split in halves and retried; single columns use _enrich_column.
+        """
+        if len(batch) == 1:
+            return [self._enrich_column(batch[0])]
+        
+        try:
+            fields_json = json.dumps(batch, default=str)
+            pred = self.enriched_fields_json(fields_json=fields_json, config={'timeout': self.column_timeout * len(batch)})
+            enriched_list = json.loads(utils.clean_code_snippet(pred.enriched_fields_json))
+            enriched_by_name = {field['column_name']: field for field in enriched_list if isinstance(field, dict) and 'column_name' in field}
+            
+            if all(column_dict['column_name'] in enriched_by_name for column_dict in batch):
+                results = []
+                for column_dict in batch:
+                    enriched_fields = {k: v for k, v in enriched_by_name[column_dict['column_name']].items() if k != 'column_name'}
+                    results.append({**column_dict, 'properties': {**column_dict['properties'], **enriched_fields}})
+                return results
+            print("Batched enrichment missed columns, splitting batch of", len(batch))
+        except Exception as e:
+            print("Error in batched enrichment, splitting batch of", len(batch), e)
+        
+        mid = len(batch) // 2
+        return self._enrich_batch(batch[:mid]) + self._enrich_batch(batch[mid:])
+        
+    def enrich_fields(self, progress_callback=None):
+        """
+            Enriches each field in the csv with description & semantic_type.
+            Columns are enriched concurrently (bounded by max_workers) and returned in column order.
+            With a batch_token_budget, several columns share one prompt.
+            Columns whose fingerprint is already in the enrichment cache skip the LLM entirely.
+            progress_callback(done, total) is called from this thread as columns complete.
+        """
+        column_dicts = self.dataset.enriched_column_properties
+        results = [self._get_cached_column(column_dict) for column_dict in column_dicts]
+        missing = [idx for idx, column_dict in enumerate(results) if column_dict is None]
+        print(f"Enrichment cache: {len(column_dicts) - len(missing)} hits, {len(missing)} misses (all uploads: {enrich_cache_stats(self.cache)})")
+        
+        if self.batch_token_budget > 0:
+            batches = [[missing[i] for i in batch] for batch in self._make_batches([column_dicts[idx] for idx in missing])]
+        else:
+            batches = [[idx] for idx in missing]
+        
+        done = len(column_dicts) - len(missing)
+        if progress_callback is not None:
+            progress_callback(done, len(column_dicts))
         
-            column_dict['properties'] = {**column_dict['properties'], **enriched_fields}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._enrich_batch, [column_dicts[idx] for idx in batch]): batch for batch in batches}
+            for future in concurrent.futures.as_completed(futures):
+                for idx, column_dict in zip(futures[future], future.result()):
+                    results[idx] = column_dict
+                    if column_dict is not None:
+                        self._cache_column(column_dict)
+                done += len(futures[future])
+                if progress_callback is not None:
+                    progress_callback(done, len(column_dicts))
         
-            column_properties_enriched.append(column_dict)
+        # Columns that failed every retry are dropped, same as before.
+        column_properties_enriched = [column_dict for column_dict in results if column_dict is not None]
                 
         self.dataset.enriched_column_properties = column_properties_enriched
         
@@ -196,8 +324,8 @@ class DatasetEnrich(dspy.Module):
         self.dataset.enriched_column_properties.append({'dataset_description': pred.dataset_description})
     
         
-    def forward(self) -> dict:
-        self.enrich_fields()
+    def forward(self, progress_callback=None) -> dict:
+        self.enrich_fields(progress_callback=progress_callback)
         self.enrich_dataset_description()
         
         # Return the enriched dataset information
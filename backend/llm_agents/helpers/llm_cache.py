@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import threading
+from collections import defaultdict
+
+import dspy
+from diskcache import Cache
+
+from llm_agents.helpers import utils
+
+LLM_CACHE_DIR = os.environ.get('LLM_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'llm'))
+LLM_CACHE_SIZE_LIMIT = int(os.environ.get('LLM_CACHE_SIZE_LIMIT', 512 * 1024 * 1024))
+LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 60 * 60))
+# Comma separated signature names to cache, '*' for all, empty to disable.
+LLM_CACHE_SIGNATURES = os.environ.get('LLM_CACHE_SIGNATURES', 'QuestionRefiner,VisualizationRecommender,PandasTransformationCode,PandasVisualizationCode')
+
+
+def signature_name(module: dspy.Module) -> str:
+    # ChainOfThought keeps the user's signature class; its predictor only has the extended copy.
+    signature = getattr(module, 'signature', None) or module.predictors()[0].signature
+    return signature.__name__
+
+
+def _canonicalize(value):
+    """JSON-safe copy of the inputs with whitespace runs in strings collapsed, so cosmetic differences share a key."""
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    if isinstance(value, dict):
+        return {str(k): _canonicalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(v) for v in value]
+    return json.loads(json.dumps(value, default=str))
+
+
+class LLMResponseCache:
+    """
+        Persistent cache of dspy predictions keyed by signature name, canonicalized inputs, model and temperature.
+        Backed by diskcache (SQLite) with a TTL per entry and least-recently-used eviction past size_limit.
+    """
+    def __init__(self, directory: str, size_limit: int, ttl: float, signatures: str) -> None:
+        self.cache = Cache(directory, size_limit=size_limit, eviction_policy='least-recently-used')
+        self.ttl = ttl
+        self.signatures = None if signatures.strip() == '*' else {name.strip() for name in signatures.split(',') if name.strip()}
+        self._stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._lock = threading.Lock()
+
+    def enabled(self, name: str) -> bool:
+        return self.signatures is None or name in self.signatures
+
+    def key_params(self, module: dspy.Module, inputs: dict, config: dict = None) -> dict:
+        lm = module.predictors()[0].lm or dspy.settings.lm
+        lm_kwargs = {**lm.kwargs, **(config or {})}
+        return {
+            'signature': signature_name(module),
+            'inputs': _canonicalize(inputs),
+            'model': lm.model,
+            'temperature': lm_kwargs.get('temperature'),
+        }
+
+    def lookup(self, module: dspy.Module, inputs: dict, config: dict = None):
+        """Returns (key params, cached dspy.Prediction or None). Key params are None when caching is off for the signature."""
+        name = signature_name(module)
+        if not self.enabled(name):
+            return None, None
+
+        params = self.key_params(module, inputs, config)
+        values = utils.cache_request(self.cache, params)
+        with self._lock:
+            self._stats[name]['hits' if values is not None else 'misses'] += 1
+        return params, dspy.Prediction(**values) if values is not None else None
+
+    def store(self, params: dict, prediction: dspy.Prediction):
+        if params is not None:
+            utils.cache_request(self.cache, params, prediction.toDict(), expire=self.ttl)
+
+    def invalidate(self, module: dspy.Module, config: dict = None, **inputs):
+        """Drops a cached response, e.g. when the code it produced failed to run."""
+        if self.enabled(signature_name(module)):
+            params = self.key_params(module, inputs, config)
+            self.cache.delete(utils.cache_key(params))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                name: {**counts, 'hit_rate': counts['hits'] / max(counts['hits'] + counts['misses'], 1)}
+                for name, counts in self._stats.items()
+            }
+
+
+llm_cache = LLMResponseCache(LLM_CACHE_DIR, LLM_CACHE_SIZE_LIMIT, LLM_CACHE_TTL, LLM_CACHE_SIGNATURES)
+
+
+def predict(module: dspy.Module, config: dict = None, **inputs) -> dspy.Prediction:
+    """Calls a dspy module, serving and storing the response through llm_cache."""
+    params, prediction = llm_cache.lookup(module, inputs, config)
+    if prediction is not None:
+        return prediction
+
+    prediction = module(**inputs, config=config or {})
+    llm_cache.store(params, prediction)
+    return prediction
@@ -0,0 +1,54 @@
+import os
+import json
+
+from django.db.models import F
+from django.utils import timezone
+
+from llm_agents.models import CodePlan as CodePlanModel
+
+# Set PLAN_CACHE_ENABLED=False to always ask the LLM for fresh code.
+PLAN_CACHE_ENABLED = os.environ.get('PLAN_CACHE_ENABLED', 'True') == 'True'
+
+
+def columns_key(columns_involved) -> str:
+    """Order-insensitive key for the columns a visualization uses."""
+    return json.dumps(sorted(columns_involved or []))
+
+
+def _plans(schema_fingerprint: str, visualization_type: str, columns_involved):
+    return CodePlanModel.objects.filter(
+        schema_fingerprint=schema_fingerprint,
+        visualization_type=visualization_type,
+        columns_key=columns_key(columns_involved)
+    )
+
+
+def lookup_plan(schema_fingerprint: str, visualization_type: str, columns_involved):
+    """
+        Returns the verified CodePlan for this schema/visualization/columns, or None.
+    """
+    if not PLAN_CACHE_ENABLED:
+        return None
+    plan = _plans(schema_fingerprint, visualization_type, columns_involved).first()
+    if plan is not None:
+        CodePlanModel.objects.filter(pk=plan.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    return plan
+
+
+def save_plan(schema_fingerprint: str, visualization_type: str, columns_involved, pd_code: str, pd_viz_code: str):
+    """
+        Stores code that has just executed successfully.
+    """
+    if not PLAN_CACHE_ENABLED:
+        return None
+    plan, _ = CodePlanModel.objects.update_or_create(
+        schema_fingerprint=schema_fingerprint,
+        visualization_type=visualization_type,
+        columns_key=columns_key(columns_involved),
+        defaults={'pd_code': pd_code, 'pd_viz_code': pd_viz_code, 'last_used_at': timezone.now()}
+    )
+    return plan
+
+
+def invalidate_plan(schema_fingerprint: str, visualization_type: str, columns_involved):
+    _plans(schema_fingerprint, visualization_type, columns_involved).delete()
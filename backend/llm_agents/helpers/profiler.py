@@ -0,0 +1,185 @@
+import os
+import warnings
+import concurrent.futures
+
+import pandas as pd
+
+from llm_agents.helpers.sketches import HyperLogLog, KLLSketch, MisraGries
+
+# Rows tried with pd.to_datetime before converting a whole object column.
+DATETIME_SNIFF_ROWS = 100
+PROFILER_MAX_WORKERS = int(os.environ.get('PROFILER_MAX_WORKERS', 4))
+
+# Frames with more rows than this are profiled with bounded-memory sketches (see sketches.py).
+APPROX_STATS_MIN_ROWS = int(os.environ.get('APPROX_STATS_MIN_ROWS', 1_000_000))
+APPROX_CHUNK_ROWS = 100_000
+PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+TOP_K = 5
+
+
+def check_type(dtype, value):
+    """Cast value to right type to ensure it is JSON serializable"""
+    if "float" in str(dtype):
+        return float(value)
+    elif "int" in str(dtype):
+        return int(value)
+    else:
+        return value
+
+
+class ColumnProfiler:
+    """
+        Computes the per-column properties used for enrichment (dtype, stats, samples, num_unique_values).
+
+        Numeric stats for all number columns come from one vectorized agg() over the numeric block,
+        distinct values are computed once per column and reused for both the count and the samples,
+        and object columns only get a full datetime conversion when a small sample parses as dates.
+        Columns are profiled in parallel.
+
+        Number columns also get `percentiles` and category/string/boolean columns `top_values`.
+        In approximate mode (default for frames over APPROX_STATS_MIN_ROWS rows) distinct counts,
+        percentiles and top values come from HyperLogLog/KLL/Misra-Gries sketches fed in chunks,
+        and each property carries its error bound.
+
+        Statistics always describe the full df, so approximate mode is decided by its row count. When
+        sample_df is given, approximate mode draws example values from it and object columns are sniffed
+        for dates on it, so those costs don't grow with the dataset.
+    """
+    def __init__(self, df: pd.DataFrame, sample_df: pd.DataFrame = None, max_workers: int = None, approximate: bool = None) -> None:
+        self.df = df
+        self.sample_df = df if sample_df is None else sample_df
+        self.max_workers = max_workers or PROFILER_MAX_WORKERS
+        self.approximate = len(df) > APPROX_STATS_MIN_ROWS if approximate is None else approximate
+
+    def profile(self, n_samples: int = 3) -> list[dict]:
+        numeric_columns = [column for column in self.df.columns if self.df[column].dtype in [int, float, complex]]
+        numeric_stats = self._numeric_stats(numeric_columns)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            properties_list = list(executor.map(
+                lambda column: self._profile_column(column, numeric_stats.get(column), n_samples),
+                self.df.columns
+            ))
+
+        return [{"column_name": column, "properties": properties} for column, properties in zip(self.df.columns, properties_list)]
+
+    def _numeric_stats(self, numeric_columns: list) -> dict:
+        if not numeric_columns:
+            return {}
+        stats = self.df[numeric_columns].agg(['std', 'min', 'max'])
+        real_columns = [column for column in numeric_columns if not pd.api.types.is_complex_dtype(self.df[column])]
+        if not self.approximate and real_columns:
+            percentiles = self.df[real_columns].quantile(PERCENTILES)
+            stats = pd.concat([stats, percentiles.reindex(columns=numeric_columns)])
+        return {column: stats[column] for column in numeric_columns}
+
+    def _distinct(self, series: pd.Series, is_number: bool) -> dict:
+        """
+            Distinct values of a column: exact value_counts, or sketches streamed over fixed-size chunks.
+        """
+        if not self.approximate:
+            counts = series.value_counts(dropna=True)
+            return {"num_unique_values": len(counts), "uniques": counts.index, "counts": counts}
+
+        hll, kll, heavy_hitters = HyperLogLog(), KLLSketch(), MisraGries()
+        for start in range(0, len(series), APPROX_CHUNK_ROWS):
+            chunk = series.iloc[start:start + APPROX_CHUNK_ROWS].dropna()
+            hll.update(chunk)
+            if is_number:
+                kll.update(chunk.to_numpy(dtype=float))
+            else:
+                heavy_hitters.update(chunk)
+
+        # Samples only need a handful of distinct values, so draw them from a small random subset.
+        sample_series = self.sample_df[series.name]
+        subset = sample_series.sample(min(len(sample_series), 10_000), random_state=42).dropna()
+        return {
+            "num_unique_values": hll.count(),
+            "num_unique_values_error": hll.relative_error,
+            "uniques": subset.unique(),
+            "kll": kll,
+            "heavy_hitters": heavy_hitters,
+        }
+
+    def _profile_column(self, column, numeric_stats, n_samples: int) -> dict:
+        series = self.df[column]
+        dtype = series.dtype
+        properties = {}
+        distinct = self._distinct(series, is_number=numeric_stats is not None and not pd.api.types.is_complex_dtype(dtype))
+
+        if numeric_stats is not None:
+            properties["dtype"] = "number"
+            properties["std"] = check_type(dtype, numeric_stats['std'])
+            properties["min"] = check_type(dtype, numeric_stats['min'])
+            properties["max"] = check_type(dtype, numeric_stats['max'])
+        elif dtype == bool:
+            properties["dtype"] = "boolean"
+        elif dtype == object:
+            if self._is_datetime(self.sample_df[column]):
+                properties["dtype"] = "date"
+            elif distinct["num_unique_values"] / max(len(series), 1) < 0.5:
+                properties["dtype"] = "category"
+            else:
+                properties["dtype"] = "string"
+        elif isinstance(dtype, pd.CategoricalDtype):
+            properties["dtype"] = "category"
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            properties["dtype"] = "date"
+        else:
+            properties["dtype"] = str(dtype)
+
+        # add min max if dtype is date
+        if properties["dtype"] == "date":
+            try:
+                properties["min"] = series.min()
+                properties["max"] = series.max()
+            except TypeError:
+                cast_date_col = pd.to_datetime(series, errors='coerce')
+                properties["min"] = cast_date_col.min()
+                properties["max"] = cast_date_col.max()
+
+        uniques = distinct["uniques"]
+        n = min(n_samples, len(uniques))
+        properties["samples"] = pd.Series(uniques).sample(n, random_state=42).tolist()
+        properties["num_unique_values"] = distinct["num_unique_values"]
+        if self.approximate:
+            properties["num_unique_values_error"] = distinct["num_unique_values_error"]
+
+        if properties["dtype"] == "number" and not pd.api.types.is_complex_dtype(dtype):
+            self._add_percentiles(properties, numeric_stats, distinct)
+        elif properties["dtype"] in ("category", "string", "boolean"):
+            self._add_top_values(properties, distinct)
+        return properties
+
+    def _add_percentiles(self, properties: dict, numeric_stats, distinct: dict):
+        if self.approximate:
+            values = distinct["kll"].quantiles(PERCENTILES)
+            properties["percentiles_rank_error"] = distinct["kll"].rank_error
+        else:
+            values = [numeric_stats[q] for q in PERCENTILES]
+        properties["percentiles"] = {
+            f"p{int(q * 100)}": None if value is None or pd.isna(value) else float(value)
+            for q, value in zip(PERCENTILES, values)
+        }
+
+    def _add_top_values(self, properties: dict, distinct: dict):
+        if self.approximate:
+            properties["top_values"] = distinct["heavy_hitters"].top(TOP_K)
+            properties["top_values_count_error"] = distinct["heavy_hitters"].count_error
+        else:
+            top = distinct["counts"].head(TOP_K)
+            properties["top_values"] = [{"value": value, "count": int(count)} for value, count in zip(top.index.tolist(), top.tolist())]
+
+    def _is_datetime(self, series: pd.Series) -> bool:
+        """Whether every value of an object column parses as a datetime, checking a small sample first."""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                pd.to_datetime(series.dropna().head(DATETIME_SNIFF_ROWS), errors='raise')
+            except (ValueError, TypeError, OverflowError):
+                return False
+            try:
+                pd.to_datetime(series, errors='raise')
+            except (ValueError, TypeError, OverflowError):
+                return False
+        return True
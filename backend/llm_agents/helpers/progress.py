@@ -0,0 +1,127 @@
+import re
+import time
+import itertools
+import contextlib
+from contextvars import ContextVar
+from typing import Callable, Union
+
+# The reporter of the request being served and the stage it's in. Context variables follow each asyncio
+# task, so concurrently generated visualizations report under their own tags without passing them around.
+current_reporter: ContextVar = ContextVar('current_reporter', default=None)
+current_stage: ContextVar = ContextVar('current_stage', default=None)
+
+_call_ids = itertools.count(1)
+
+HEADER_PREFIX = '[[ ## '
+HEADER_SUFFIX = ' ## ]]'
+FIELD_HEADER = re.compile(r"\[\[ ## (\w+) ## \]\]\n?")
+
+
+class ProgressReporter:
+    """
+        Turns codegen progress into events for emit(event): stage_start/stage_end with timings, and llm_token
+        with partial LLM output. emit is called on the event loop and must not block. tags (e.g. viz_index)
+        are added to every event.
+    """
+    def __init__(self, emit: Callable[[dict], None], **tags) -> None:
+        self.emit = emit
+        self.tags = tags
+
+    def event(self, event_type: str, **payload):
+        try:
+            self.emit({'type': event_type, **self.tags, **payload})
+        except Exception as e:
+            print("Dropping progress event because of error: ", e)
+
+    def new_stream(self) -> 'LLMStream':
+        return LLMStream(self, current_stage.get(), next(_call_ids))
+
+
+class LLMStream:
+    """
+        Splits a streamed dspy ChatAdapter completion into its output fields and reports the text of each
+        as it arrives. Field headers ([[ ## name ## ]]) can be split across chunks, so a trailing partial
+        header is held back until the next chunk.
+    """
+    def __init__(self, reporter: ProgressReporter, stage: Union[str, None], call_id: int) -> None:
+        self.reporter = reporter
+        self.stage = stage
+        self.call_id = call_id
+        self.field = None
+        self._field_start = False
+        self._pending = ''
+
+    def feed(self, delta: str):
+        self._pending += delta
+        while True:
+            match = FIELD_HEADER.search(self._pending)
+            if match is None:
+                break
+            self._report(self._pending[:match.start()])
+            self.field = match.group(1)
+            self._field_start = True
+            self._pending = self._pending[match.end():]
+
+        cut = self._pending.rfind('[')
+        if cut > 0 and self._pending[cut - 1] == '[':
+            cut -= 1
+        if cut != -1 and _is_header_prefix(self._pending[cut:]):
+            text, self._pending = self._pending[:cut], self._pending[cut:]
+        else:
+            text, self._pending = self._pending, ''
+        self._report(text)
+
+    def close(self):
+        self._report(self._pending)
+        self._pending = ''
+
+    def _report(self, text: str):
+        if self._field_start:
+            text = text.lstrip('\n')
+            self._field_start = not text
+        # Text before the first header is adapter preamble, and 'completed' only marks the end.
+        if text and self.field is not None and self.field != 'completed':
+            self.reporter.event('llm_token', stage=self.stage, call_id=self.call_id, field=self.field, text=text)
+
+
+def _is_header_prefix(text: str) -> bool:
+    if len(text) <= len(HEADER_PREFIX):
+        return HEADER_PREFIX.startswith(text)
+    if not text.startswith(HEADER_PREFIX):
+        return False
+    rest = text[len(HEADER_PREFIX):]
+    name = re.match(r"\w*", rest).group(0)
+    return bool(name) and HEADER_SUFFIX.startswith(rest[len(name):])
+
+
+@contextlib.contextmanager
+def reporting(reporter: Union[ProgressReporter, None]):
+    """Makes reporter the current one for the enclosed code (and tasks it starts)."""
+    token = current_reporter.set(reporter)
+    try:
+        yield reporter
+    finally:
+        current_reporter.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name: str, **payload):
+    """
+        Reports the enclosed block as a stage: stage_start, then stage_end with elapsed_ms and whether it
+        raised. LLM output streamed inside the block is tagged with the stage. No-op without a reporter.
+    """
+    reporter = current_reporter.get()
+    if reporter is None:
+        yield
+        return
+
+    token = current_stage.set(name)
+    reporter.event('stage_start', stage=name, **payload)
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        yield
+        status = 'ok'
+    finally:
+        current_stage.reset(token)
+        reporter.event('stage_end', stage=name, status=status, elapsed_ms=round((time.perf_counter() - start) * 1000, 1), **payload)
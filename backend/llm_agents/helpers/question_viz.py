@@ -14,15 +14,25 @@ from pydantic import BaseModel, Field
 from typing import List
 from dataclasses import dataclass
 import time
+import threading
 import concurrent.futures
-from asgiref.sync import sync_to_async
+from asgiref.sync import sync_to_async, async_to_sync
+import asyncio
+from llm_agents.helpers.async_lm import apredict
+from llm_agents.helpers.llm_cache import llm_cache
+from llm_agents.helpers import plan_store
+from llm_agents.helpers import chart_templates
+from llm_agents.helpers import progress
+from llm_agents.helpers.code_executor import get_code_executor, CodeExecutionError, CodeLimitExceeded
+from llm_agents.helpers.shared_datasets import get_shared_dataset_registry
+from llm_agents.helpers.rasterize import apng_base64_for
+from llm_agents.helpers.chat_context import ChatContextWindow, build_chat_context
 import matplotlib.pyplot as plt
 import mplcursors
 import numpy as np
 from chat.models import User as UserModel
 import uuid
 from typing import Optional
-from cairosvg import svg2png
 import base64
 from io import BytesIO
 
@@ -31,6 +41,39 @@ openai_lm = dspy.LM('openai/gpt-4o-mini', api_key=os.environ.get('OPENAI_API_KEY
 anthropic_lm = dspy.LM('anthropic/claude-3-5-sonnet-20240620', api_key=os.environ.get('ANTHROPIC_API_KEY'))
 dspy.settings.configure(lm=anthropic_lm)
 
+PANDAS_TRANSFORMATION_TEMPLATE_CODE = """
+import pandas as pd
+import numpy as np
+import os
+import csv
+# <other imports here>
+
+def extract_data(df, columns_involved):
+    # <insert code here>
+    return extracted_df
+    
+extract_df = extract_data(df, columns_involved) # No code beyond this line.
+"""
+
+PANDAS_VISUALIZATION_TEMPLATE_CODE = """
+import pandas as pd
+import numpy as np
+import os
+import csv
+
+# <other imports here>
+
+figsize=(6, 4) # Charts should always be of size 6x4.
+
+# <insert code here>
+
+plt.savefig(svg_buffer, format='svg')
+plt.close()
+"""
+
+# pyplot keeps global figure state, so generated plotting code must not run on two threads at once.
+plot_lock = threading.Lock()
+
 @dataclass
 class Visualization(BaseModel):
     visualization_type: str
@@ -108,7 +151,7 @@ class PandasTransformationCode(dspy.Signature):
         1. Use the df variable from local namespace to extract the data. 
         2. Return the df in the fomrat that is compatible with the visualization docs. 
         3. Do not change the column names.
-        4. 'pd', 'df', 'plt', 'np', 'save_file_name' are in the local namespace.
+        4. 'pd', 'df', 'plt', 'np' are in the local namespace.
         5. Remove NaNs, Infs, Nulls, and other invalid values.
     """
     enriched_dataset_schema = dspy.InputField(desc="The enriched schema of the entire dataset")
@@ -124,12 +167,12 @@ class PandasVisualizationCode(dspy.Signature):
     """
         Given a visualization type, details of columns involved in the visualization, and sample docs for pandas code to generate this visualization, return well-thought and clean pandas code to generate this visualization using best practices. Please follow the following instructions strictly:
         
-        1. This visualization should be saved as an svg using the save_file_name.
+        1. This visualization should be saved as an svg into the svg_buffer file object.
         2. Use best practices to generate the visualization code for pandas. Always include labels and legends.
         3. If the previous pandas code has an error, use the error_prev_pd_code and prev_pd_code to fix and rewrite the correct version of the pandas code.
         4. If the solution requires a single value (e.g. max, min, median, first, last etc), ALWAYS add a line (axvline or axhline) to the chart, ALWAYS with a legend containing the single value (formatted with 0.2F).
-        5. 'pd', 'df', 'plt', 'np', 'save_file_name' are in the local namespace.
-        6. Save the generated visualization as an svg file in the save_file_name.
+        5. 'pd', 'df', 'plt', 'np', 'svg_buffer' are in the local namespace.
+        6. Save the generated visualization with plt.savefig(svg_buffer, format='svg'). Do not write any files.
         7. Avoid deduplicating data or creating duplicate charts/axis.
         8. Charts should be of size 6x4.
     """
@@ -146,7 +189,7 @@ class VisualizationAnalyzer():
         Given a visualization PNG, the columns involved in the visualization, and the reason for the visualization, return a detailed analysis of the visualization.
     """
     # ... existing imports ...
-from openai import OpenAI
+from openai import AsyncOpenAI
 import base64
 from io import BytesIO
 
@@ -157,15 +200,49 @@ class VisualizationAnalyzer:
     return a detailed analysis of the visualization.
     """
     def __init__(self):
-        self.client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+        self.async_client = AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+        
+    def _build_messages(self, png_base64: str, enriched_column_properties: List[dict], reason: str) -> List[dict]:
+        # Construct the prompt
+        prompt = f"""You are an expert data analyst. Analyze this visualization:
+        - Details of columns: {enriched_column_properties}
+        - Purpose: {reason}
+        
+        Please provide:
+        1. A clear description of what the visualization shows
+        2. Key patterns or trends and potential reasons for them.
+        3. Any notable outliers or interesting points
+        """
+        
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/png;base64,{png_base64}"
+                        }
+                    }
+                ]
+            }
+        ]
         
     def analyze(self, png_base64: str, enriched_column_properties: List[dict], reason: str) -> str:
+        """Sync entry point for scripts; see aanalyze."""
+        return async_to_sync(self.aanalyze)(png_base64, enriched_column_properties, reason)
+        
+    async def aanalyze(self, png_base64: str, enriched_column_properties: List[dict], reason: str) -> str:
         """
         Analyze a visualization using OpenAI's vision model.
         
         Args:
             png_base64: PNG base64 data
-            columns_involved: List of column names used in visualization
+            enriched_column_properties: Properties of the columns used in the visualization
             reason: Reason for creating this visualization
         
         Returns:
@@ -175,37 +252,9 @@ class VisualizationAnalyzer:
             if not png_base64:
                 return "Error: No image data found"
 
-            # Construct the prompt
-            prompt = f"""You are an expert data analyst. Analyze this visualization:
-            - Details of columns: {enriched_column_properties}
-            - Purpose: {reason}
-            
-            Please provide:
-            1. A clear description of what the visualization shows
-            2. Key patterns or trends and potential reasons for them.
-            3. Any notable outliers or interesting points
-            """
-
-            # Call OpenAI Vision API
-            response = self.client.chat.completions.create(
+            response = await self.async_client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{png_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=self._build_messages(png_base64, enriched_column_properties, reason),
                 max_tokens=500
             )
             
@@ -216,7 +265,7 @@ class VisualizationAnalyzer:
     
 
 class DatasetVisualizations(dspy.Module):
-    def __init__(self, dataset, question: str) -> None:
+    def __init__(self, dataset) -> None:
         self.main_dataset = dataset
         self.viz_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example_charts_pd')
 
@@ -225,126 +274,124 @@ class DatasetVisualizations(dspy.Module):
         self.pandas_code_generator = dspy.ChainOfThought(PandasTransformationCode)
         self.pandas_visualization_code_generator = dspy.ChainOfThought(PandasVisualizationCode)
         self.visualization_refiner = dspy.ChainOfThought(VisualizationRefiner)
-        self.question = question
         self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
+        # Generated code runs in sandboxed worker processes when CODE_EXECUTOR_BACKEND is 'process'.
+        self.code_executor = get_code_executor()
+        self.shared_dataset_path = None
+        if self.code_executor is not None:
+            # Published once per dataset version and memory-mapped by the workers; released in close().
+            try:
+                self.shared_dataset_path = get_shared_dataset_registry().acquire(self.main_dataset.uri, self.main_dataset.df)
+            except Exception as e:
+                # Arrow rejects some frames pandas handles, e.g. object columns mixing strings and numbers.
+                print("Running generated code in-process because the dataset can't be shared with the workers: ", e)
+                self.code_executor = None
+        if self.code_executor is not None:
+            self.code_executor.preload(self.shared_dataset_path)
         self.question_viz_details = {}
         
     
+    def close(self):
+        """Releases the handler's reference to its published dataset and its thread pool."""
+        self.executor.shutdown(wait=False)
+        if self.shared_dataset_path is not None:
+            get_shared_dataset_registry().release(self.shared_dataset_path)
+            self.shared_dataset_path = None
+    
     def visualization_recommender_helper(self, user_message_body: UserMessageBody):
+        """Sync entry point for scripts; the pipeline lives in avisualization_recommender_helper."""
+        return async_to_sync(self.avisualization_recommender_helper)(user_message_body)
+            
+    async def avisualization_recommender_helper(self, user_message_body: UserMessageBody):
         try:
-            visualization_list = []
             print("about to recommend visualization")
             
-            refined_questions = self.question_refiner(enriched_dataset_schema=self.main_dataset.enriched_dataset_schema, chat_context=user_message_body.question, question=user_message_body.question)
+            with progress.stage('refine_question'):
+                refined_questions = await apredict(self.question_refiner, enriched_dataset_schema=self.main_dataset.enriched_dataset_schema, chat_context=user_message_body.question, question=user_message_body.question)
             
-            for question in refined_questions.questions:
-                print("new question", question)
-                visualizations = self.visualization_recommender(schema=self.main_dataset.enriched_dataset_schema, question=question)
-                visualization_list.extend(visualizations.visualizations)
-            return visualization_list
+            return await self.arecommend_for_questions(refined_questions.questions)
         except Exception as e:
             print("Skipping visualization recommendation because of error: ", e)
             
-    def visualization_refine_helper(self, user_message, assistant_message, last_x_questions):
-        try:
-            print("about to refine visualization")
-            
-            # TODO: Think if we need to do this for all messages in the chat session
-            # TODO: Think if we need PD code here
-            
-            visualization_list = []
-            current_question = user_message.question
-            prev_reason = assistant_message.reason
-            prev_viz_name = assistant_message.viz_name
-            prev_columns_involved = assistant_message.columns_involved
-
-            last_x_questions = [question for question in last_x_questions if question != current_question]
+    async def arecommend_for_questions(self, questions: List[str]) -> list:
+        """
+            Runs the visualization recommender for every refined question concurrently and merges the results,
+            dropping duplicate charts so they don't cost pandas/viz codegen twice.
+        """
+        with progress.stage('recommend', questions=len(questions)):
+            recommendations = await asyncio.gather(*[
+                apredict(self.visualization_recommender, schema=self.main_dataset.enriched_dataset_schema, question=question)
+                for question in questions
+            ])
+        return self.dedupe_visualizations([viz for recommendation in recommendations for viz in recommendation.visualizations])
+    
+    @staticmethod
+    def dedupe_visualizations(visualizations: list) -> list:
+        """Keeps the first visualization for each (visualization_type, set of columns_involved)."""
+        seen = set()
+        unique_visualizations = []
+        for viz in visualizations:
+            key = (viz.visualization_type, frozenset(viz.columns_involved))
+            if key not in seen:
+                seen.add(key)
+                unique_visualizations.append(viz)
+        return unique_visualizations
+    
+    def build_refine_chat_context(self, user_message, assistant_message, chat_context_window: ChatContextWindow) -> str:
+        # TODO: Think if we need PD code here
+        chat_context = build_chat_context(user_message.question, assistant_message, chat_context_window)
+        print("chat_context", chat_context)
+        return chat_context
             
-            print("last_x_questions", last_x_questions)
-                        
-            prev_question = last_x_questions[-1] if len(last_x_questions) > 0 else current_question
+    def visualization_refine_helper(self, user_message, assistant_message, chat_context_window: ChatContextWindow):
+        """Sync entry point for scripts; the pipeline lives in avisualization_refine_helper."""
+        return async_to_sync(self.avisualization_refine_helper)(user_message, assistant_message, chat_context_window)
             
-            chat_context = f"""
-                current question: {current_question}
-                previous question: {prev_question}
-                Previous reason: {prev_reason}
-                Previous visualization name: {prev_viz_name}
-                Previous columns involved: {prev_columns_involved}
-            """
+    async def avisualization_refine_helper(self, user_message, assistant_message, chat_context_window: ChatContextWindow):
+        try:
+            print("about to refine visualization")
             
-            if len(last_x_questions) > 0:
-                chat_context = f"""
-                    User's last questions: {last_x_questions}
-                """ + chat_context 
+            chat_context = self.build_refine_chat_context(user_message, assistant_message, chat_context_window)
 
-            refined_questions = self.question_refiner(enriched_dataset_schema=self.main_dataset.enriched_dataset_schema, chat_context=chat_context, question=current_question)
-            for question in refined_questions.questions:
-                visualizations = self.visualization_recommender(schema=self.main_dataset.enriched_dataset_schema, question=question)
-                visualization_list.extend(visualizations.visualizations)
-            return visualization_list
+            with progress.stage('refine_question'):
+                refined_questions = await apredict(self.question_refiner, enriched_dataset_schema=self.main_dataset.enriched_dataset_schema, chat_context=chat_context, question=user_message.question)
+            return await self.arecommend_for_questions(refined_questions.questions)
         except Exception as e:
             print("Skipping visualization refinement because of error: ", e)
             
             
-    def analyze_visualization(self, assistant_message: AssistantMessageBody):
+    def analyze_visualization(self, assistant_message: AssistantMessageBody, svg_json: str = None):
+        """Sync entry point for scripts; see aanalyze_visualization."""
+        return async_to_sync(self.aanalyze_visualization)(assistant_message, svg_json=svg_json)
+    
+    async def aanalyze_visualization(self, assistant_message: AssistantMessageBody, svg_json: str = None):
         analyzer = VisualizationAnalyzer()
         enriched_column_properties = self.get_enriched_extracted_columns(assistant_message.columns_involved)
-        png_base64 = json.loads(assistant_message.svg_json).get('png_base64')
+        png_base64 = await apng_base64_for(svg_json or assistant_message.svg_json)
         
-        analysis = analyzer.analyze(
+        return await analyzer.aanalyze(
             png_base64=png_base64,
             enriched_column_properties=enriched_column_properties,
             reason=assistant_message.reason
         )
-        
-        return analysis
     
-    def pandas_code_generator_helper(self, enriched_dataset_schema, visualization_type, columns_involved, viz_docs):
-        PANDAS_TRANSFORMATION_TEMPLATE_CODE = """
-        import pandas as pd
-        import numpy as np
-        import os
-        import csv
-        # <other imports here>
-        
-        def extract_data(df, columns_involved):
-            # <insert code here>
-            return extracted_df
-            
-        extract_df = extract_data(df, columns_involved) # No code beyond this line.
-        """
-
+    async def apandas_code_generator_helper(self, enriched_dataset_schema, visualization_type, columns_involved, viz_docs):
         try:
-            pandas_code = self.pandas_code_generator(
+            return await apredict(
+                self.pandas_code_generator,
                 enriched_dataset_schema=enriched_dataset_schema, 
                 visualization_type=visualization_type, 
                 columns_involved=columns_involved, 
                 visualization_docs=viz_docs,
                 template_code=PANDAS_TRANSFORMATION_TEMPLATE_CODE
             )
-            return pandas_code
         except Exception as e:
             print("Skipping pandas code generation because of error: ", e, visualization_type)
             
-            
-    def pandas_visualization_code_generator_helper(self, visualization_type, enriched_column_properties, visualization_docs, prev_pd_code, error_prev_pd_code):
-        PANDAS_VISUALIZATION_TEMPLATE_CODE = """
-        import pandas as pd
-        import numpy as np
-        import os
-        import csv
-        
-        # <other imports here>
-        
-        figsize=(6, 4) # Charts should always be of size 6x4.
-        
-        # <insert code here>
-        
-        plt.savefig(save_file_name, format='svg')
-        plt.close()
-        """
+    async def apandas_visualization_code_generator_helper(self, visualization_type, enriched_column_properties, visualization_docs, prev_pd_code, error_prev_pd_code):
         try:
-            pandas_code = self.pandas_visualization_code_generator(
+            return await apredict(
+                self.pandas_visualization_code_generator,
                 visualization_type=visualization_type, 
                 enriched_column_properties=enriched_column_properties, 
                 visualization_docs=visualization_docs,
@@ -352,7 +399,6 @@ class DatasetVisualizations(dspy.Module):
                 prev_pd_code=prev_pd_code,
                 error_prev_pd_code=error_prev_pd_code
             )
-            return pandas_code
         except Exception as e:
             print("Skipping pandas visualization code generation because of error: ", e, visualization_type)
     
@@ -380,83 +426,216 @@ class DatasetVisualizations(dspy.Module):
         return enriched_extracted_columns
     
     
-    def generate_viz(self, visualization) -> AssistantMessageBody:
+    def invalidate_pandas_code(self, visualization, viz_docs):
+        """Drops a cached extract-code response whose code failed to run."""
+        llm_cache.invalidate(
+            self.pandas_code_generator,
+            enriched_dataset_schema=self.main_dataset.enriched_dataset_schema,
+            visualization_type=visualization.visualization_type,
+            columns_involved=visualization.columns_involved,
+            visualization_docs=viz_docs,
+            template_code=PANDAS_TRANSFORMATION_TEMPLATE_CODE
+        )
         
-        if os.path.exists(os.path.join(self.viz_dir, f"{visualization.visualization_type}.py")):
-            viz_docs = open(os.path.join(self.viz_dir, f"{visualization.visualization_type}.py")).read()            
-        elif os.path.exists(os.path.join(self.viz_dir, f"{visualization.visualization_type}_chart.py")):
-            viz_docs = open(os.path.join(self.viz_dir, f"{visualization.visualization_type}_chart.py")).read()
+    def invalidate_pandas_visualization_code(self, visualization, enriched_extracted_columns, viz_docs, prev_pd_code, error_prev_pd_code):
+        """Drops a cached plotting-code response whose code failed to run."""
+        llm_cache.invalidate(
+            self.pandas_visualization_code_generator,
+            visualization_type=visualization.visualization_type,
+            enriched_column_properties=enriched_extracted_columns,
+            visualization_docs=viz_docs,
+            template_code=PANDAS_VISUALIZATION_TEMPLATE_CODE,
+            prev_pd_code=prev_pd_code,
+            error_prev_pd_code=error_prev_pd_code
+        )
+    
+    def load_viz_docs(self, visualization_type: str) -> str:
+        if os.path.exists(os.path.join(self.viz_dir, f"{visualization_type}.py")):
+            return open(os.path.join(self.viz_dir, f"{visualization_type}.py")).read()            
+        elif os.path.exists(os.path.join(self.viz_dir, f"{visualization_type}_chart.py")):
+            return open(os.path.join(self.viz_dir, f"{visualization_type}_chart.py")).read()
         else:
-            raise ValueError(f"No visualization docs found for {visualization.visualization_type}")
+            raise ValueError(f"No visualization docs found for {visualization_type}")
         
-        pd_code = self.pandas_code_generator_helper(
-            self.main_dataset.enriched_dataset_schema, 
-            visualization.visualization_type,
-            visualization.columns_involved,
-            viz_docs
-        )
+    def run_extract_code(self, pandas_code: str, visualization):
+        """
+            Runs the generated extract code and returns (extract_df, namespace for the viz code).
+        """
+        print("self.main_dataset.df", self.main_dataset)
+        if self.code_executor is not None:
+            return self.run_extract_code_in_worker(pandas_code, visualization)
+        
+        # With APPROXIMATE_EXTRACT the code runs on the sample only. If it fails there (e.g. a category the
+        # sample happens to miss), it gets one run on the full frame before the error is reported.
+        sample_df = self.main_dataset.sample_df
+        if self.main_dataset.approximate and sample_df is not self.main_dataset.df:
+            local_namespace_sample = {'pd': pd, 'df': sample_df.copy(deep=False), 'plt': plt, 'mplcursors': mplcursors, 'np': np, 'columns_involved': visualization.columns_involved}
+            try:
+                return self.execute_pandas_code(pandas_code, local_namespace_sample, 'extract_df'), local_namespace_sample
+            except Exception as e:
+                print("Extract code failed on the sample, running it on the full dataset: ", e)
         
-        print("pd_code", pd_code)
+        # Lazy copy: copy-on-write (enabled in LlmAgentsConfig.ready()) keeps in-place writes off the shared cached frame.
+        namespace_df = self.main_dataset.df.copy(deep=False)
+        local_namespace_pd_code = {'pd': pd, 'df': namespace_df, 'plt': plt, 'mplcursors': mplcursors, 'np': np, 'columns_involved': visualization.columns_involved}
+        extracted_df = self.execute_pandas_code(pandas_code, local_namespace_pd_code, 'extract_df')
+        return extracted_df, local_namespace_pd_code
+    
+    def run_extract_code_in_worker(self, pandas_code: str, visualization):
+        """
+            run_extract_code on the code executor: same sample/full-frame choice, but the worker holds the
+            dataset, so only the code and extract_df cross the process boundary.
+        """
+        dataset_path = self.shared_dataset_path
+        is_sampled = len(self.main_dataset.df) > self.main_dataset.sample_rows
         
-        print("self.main_dataset.df", self.main_dataset)
-        namespace_df = self.main_dataset.df
-        save_file_name = f"{visualization.visualization_type}_test.svg"
+        extracted_df = None
+        if self.main_dataset.approximate and is_sampled:
+            sample_kwargs = {'sample_rows': self.main_dataset.sample_rows, 'stratify_by': self.main_dataset.stratify_column()}
+            try:
+                extracted_df = self.code_executor.run_extract(dataset_path, pandas_code, visualization.columns_involved, **sample_kwargs)
+            except CodeLimitExceeded:
+                # Over the limits on the sample means over them on the full frame too.
+                raise
+            except CodeExecutionError as e:
+                print("Extract code failed on the sample, running it on the full dataset: ", e)
+        if extracted_df is None:
+            extracted_df = self.code_executor.run_extract(dataset_path, pandas_code, visualization.columns_involved)
+        
+        return extracted_df, {'extract_df': extracted_df, 'columns_involved': visualization.columns_involved}
+    
+    def run_viz_code(self, pandas_code: str, local_namespace: dict) -> str:
+        """
+            Runs the generated plotting code and returns the SVG it saved into svg_buffer.
+        """
+        if self.code_executor is not None:
+            return self.code_executor.run_viz(self.shared_dataset_path, pandas_code, local_namespace['extract_df'], local_namespace['columns_involved'])
         
-        local_namespace_pd_code = {'pd': pd, 'df': namespace_df, 'plt': plt, 'mplcursors': mplcursors, 'np': np, 'save_file_name': save_file_name, 'columns_involved': visualization.columns_involved}
+        # A fresh buffer per render: retries reuse the namespace, and concurrent renders never share one.
+        svg_buffer = BytesIO()
+        local_namespace['svg_buffer'] = svg_buffer
+        with plot_lock:
+            extracted_viz = self.execute_pandas_code(pandas_code, local_namespace, 'extract_viz')
         
-        extracted_df = self.execute_pandas_code(pd_code.pandas_code, local_namespace_pd_code, 'extract_df')
-        namespace_df = extracted_df # Update the namespace df for the namespace dict
+        return svg_buffer.getvalue().decode('utf-8')
             
-        enriched_extracted_columns = self.get_enriched_extracted_columns(extracted_df.columns.to_list())
-        print("enriched_extracted_columns", enriched_extracted_columns)
-
+    def build_assistant_message(self, visualization, pd_code: str, pd_viz_code: str, svg_content: str, extracted_df) -> AssistantMessageBody:
+        # The PNG is rasterized on demand (analysis, thumbnails), see rasterize.py.
+        svg_json = json.dumps({
+            'svg': svg_content
+        })
+        
+        return AssistantMessageBody(
+            reason=visualization.reason,
+            viz_name=visualization.visualization_type,
+            columns_involved=visualization.columns_involved,
+            pd_code=pd_code,
+            pd_viz_code=pd_viz_code,
+            svg_json=svg_json,
+            data=extracted_df.to_dict(orient='records'),
+            extra_attrs={}
+        )
+    
+    def lookup_plan(self, visualization):
+        return plan_store.lookup_plan(self.main_dataset.schema_fingerprint, visualization.visualization_type, visualization.columns_involved)
+    
+    def invalidate_plan(self, visualization):
+        plan_store.invalidate_plan(self.main_dataset.schema_fingerprint, visualization.visualization_type, visualization.columns_involved)
+    
+    def save_plan(self, visualization, pd_code: str, pd_viz_code: str):
+        try:
+            plan_store.save_plan(self.main_dataset.schema_fingerprint, visualization.visualization_type, visualization.columns_involved, pd_code, pd_viz_code)
+        except Exception as e:
+            print("Skipping saving code plan because of error: ", e, visualization)
+    
+    def template_chart_code(self, visualization):
+        return chart_templates.render_chart_code(visualization.visualization_type, visualization.columns_involved, self.main_dataset.enriched_column_properties, visualization.reason)
+    
+    def run_plan(self, plan, visualization) -> AssistantMessageBody:
+        """
+            Runs a known extract/plotting code pair (a stored plan or a chart template), with no LLM calls.
+        """
+        extracted_df, local_namespace_pd_code = self.run_extract_code(plan.pd_code, visualization)
+        svg_content = self.run_viz_code(plan.pd_viz_code, local_namespace_pd_code)
+        return self.build_assistant_message(visualization, plan.pd_code, plan.pd_viz_code, svg_content, extracted_df)
+    
+    def generate_viz(self, visualization) -> AssistantMessageBody:
+        """Sync entry point for scripts; the pipeline lives in agenerate_viz."""
+        return async_to_sync(self.agenerate_viz)(visualization)
+                
+    async def agenerate_viz(self, visualization) -> AssistantMessageBody:
+        """
+            Generates one visualization: a stored code plan, then a chart template, then LLM codegen with up to
+            5 plotting-code attempts. LLM calls are awaited on the event loop and only the generated code runs on
+            the handler's thread pool (or the code executor). Each step is reported as a progress stage.
+        """
+        loop = asyncio.get_running_loop()
+        plan = await sync_to_async(self.lookup_plan)(visualization)
+        if plan is not None:
+            try:
+                with progress.stage('run_plan'):
+                    return await loop.run_in_executor(self.executor, self.run_plan, plan, visualization)
+            except Exception as e:
+                print("Cached code plan failed, regenerating because of error: ", e, visualization)
+                await sync_to_async(self.invalidate_plan)(visualization)
+        
+        chart_code = self.template_chart_code(visualization)
+        if chart_code is not None:
+            try:
+                with progress.stage('run_template'):
+                    return await loop.run_in_executor(self.executor, self.run_plan, chart_code, visualization)
+            except Exception as e:
+                print("Chart template failed, falling back to LLM codegen because of error: ", e, visualization)
+        
+        viz_docs = self.load_viz_docs(visualization.visualization_type)
+        
+        with progress.stage('pandas_codegen'):
+            pd_code = await self.apandas_code_generator_helper(
+                self.main_dataset.enriched_dataset_schema, 
+                visualization.visualization_type,
+                visualization.columns_involved,
+                viz_docs
+            )
+        
+        print("pd_code", pd_code)
+        
+        try:
+            with progress.stage('run_pandas_code'):
+                extracted_df, local_namespace_pd_code = await loop.run_in_executor(self.executor, self.run_extract_code, pd_code.pandas_code, visualization)
+        except Exception:
+            self.invalidate_pandas_code(visualization, viz_docs)
+            raise
+        
         try_count = 0
         prev_pd_code = None
         error_prev_pd_code = None
         
         while try_count < 5:
+            pd_viz_code = None
             try:
                 enriched_extracted_columns = self.get_enriched_extracted_columns(extracted_df.columns.to_list())
                 
-                pd_viz_code = self.pandas_visualization_code_generator_helper(
-                    visualization.visualization_type,
-                    enriched_extracted_columns,
-                    viz_docs, 
-                    prev_pd_code,
-                    error_prev_pd_code
-                )
+                with progress.stage('visualization_codegen', attempt=try_count + 1):
+                    pd_viz_code = await self.apandas_visualization_code_generator_helper(
+                        visualization.visualization_type,
+                        enriched_extracted_columns,
+                        viz_docs, 
+                        prev_pd_code,
+                        error_prev_pd_code
+                    )
                 
-                extracted_viz = self.execute_pandas_code(pd_viz_code.pandas_code, local_namespace_pd_code, 'extract_viz')
-                
-                with open(save_file_name, "r") as f:
-                    svg_content = f.read()
-                
-                # Convert SVG to PNG
-                png_bytes = svg2png(bytestring=svg_content.encode('utf-8'))
-                png_base64 = base64.b64encode(png_bytes).decode('utf-8')
-                
-                svg_json = json.dumps({
-                    'svg': svg_content,
-                    'png_base64': png_base64
-                })
-                
-                assistant_message_body = AssistantMessageBody(
-                    reason=visualization.reason,
-                    viz_name=visualization.visualization_type,
-                    columns_involved=visualization.columns_involved,
-                    pd_code=pd_code.pandas_code,
-                    pd_viz_code=pd_viz_code.pandas_code,
-                    svg_json=svg_json,
-                    data=extracted_df.to_dict(orient='records'),
-                    extra_attrs={}
-                )
-                
-                return assistant_message_body
+                with progress.stage('render', attempt=try_count + 1):
+                    svg_content = await loop.run_in_executor(self.executor, self.run_viz_code, pd_viz_code.pandas_code, local_namespace_pd_code)
+                    assistant_message = await loop.run_in_executor(self.executor, self.build_assistant_message, visualization, pd_code.pandas_code, pd_viz_code.pandas_code, svg_content, extracted_df)
+                await sync_to_async(self.save_plan)(visualization, pd_code.pandas_code, pd_viz_code.pandas_code)
+                return assistant_message
                 
             except Exception as e:
                 try_count += 1
                 print("Skipping pandas visualization code execution because of error: ", e, visualization)
-                prev_pd_code = pd_viz_code.pandas_code
+                if pd_viz_code is not None:
+                    self.invalidate_pandas_visualization_code(visualization, enriched_extracted_columns, viz_docs, prev_pd_code, error_prev_pd_code)
+                prev_pd_code = pd_viz_code.pandas_code if pd_viz_code is not None else prev_pd_code
                 error_prev_pd_code = e
                 
     async def process_all_visualizations(self, question):
@@ -467,16 +646,13 @@ class DatasetVisualizations(dspy.Module):
             print(result)
             # yield result
             
-    def forward(self):
+    def forward(self, question: str):
         start_time = time.time()
-        if len(self.question) > 1:
-            raise ValueError("More than one questions provided")
-        
         results = []
         
-        # asyncio.run(self.process_all_visualizations(self.question))
+        # asyncio.run(self.process_all_visualizations(question))
         
-        results = [result for result in self.process_all_visualizations(self.questions[0])]
+        results = [result for result in self.process_all_visualizations(question)]
         
         end_time = time.time()
         print(f"Time taken: {end_time - start_time:.2f} seconds") 
@@ -0,0 +1,86 @@
+import os
+import json
+import base64
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+import concurrent.futures
+from typing import Union
+
+from diskcache import Cache
+
+# PNGs rendered from chart SVGs, keyed by SVG hash and output width. Only built when something needs
+# a PNG (visualization analysis, thumbnails), never while generating the chart.
+RASTER_CACHE_DIR = os.environ.get('RASTER_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'raster'))
+RASTER_CACHE_SIZE_LIMIT = int(os.environ.get('RASTER_CACHE_SIZE_LIMIT', 512 * 1024 * 1024))
+RASTER_WORKERS = int(os.environ.get('RASTER_WORKERS', 2))
+THUMBNAIL_WIDTH = 320
+MAX_RASTER_WIDTH = 2000
+
+raster_cache = Cache(RASTER_CACHE_DIR, size_limit=RASTER_CACHE_SIZE_LIMIT, eviction_policy='least-recently-used')
+
+_raster_pool = None
+_raster_pool_lock = threading.Lock()
+
+
+def _get_raster_pool() -> concurrent.futures.ProcessPoolExecutor:
+    # cairosvg is CPU-bound and holds the GIL, so it renders in separate processes.
+    global _raster_pool
+    with _raster_pool_lock:
+        if _raster_pool is None:
+            _raster_pool = concurrent.futures.ProcessPoolExecutor(max_workers=RASTER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _raster_pool
+
+
+def _svg_to_png(svg: str, width: Union[int, None]) -> bytes:
+    from cairosvg import svg2png
+    return svg2png(bytestring=svg.encode('utf-8'), output_width=width)
+
+
+def svg_hash(svg: str) -> str:
+    return hashlib.sha256(svg.encode('utf-8')).hexdigest()
+
+
+def _cache_key(svg: str, width: Union[int, None]) -> str:
+    return f"{svg_hash(svg)}:{width or 'full'}"
+
+
+def rasterize(svg: str, width: int = None) -> bytes:
+    """PNG bytes for an SVG (at its own size, or scaled to width), from the cache or the raster pool."""
+    key = _cache_key(svg, width)
+    png_bytes = raster_cache.get(key)
+    if png_bytes is None:
+        png_bytes = _get_raster_pool().submit(_svg_to_png, svg, width).result()
+        raster_cache.set(key, png_bytes)
+    return png_bytes
+
+
+async def arasterize(svg: str, width: int = None) -> bytes:
+    """Async version of rasterize: the event loop only waits on the pool's future."""
+    key = _cache_key(svg, width)
+    png_bytes = raster_cache.get(key)
+    if png_bytes is None:
+        png_bytes = await asyncio.wrap_future(_get_raster_pool().submit(_svg_to_png, svg, width))
+        raster_cache.set(key, png_bytes)
+    return png_bytes
+
+
+def _legacy_png_base64(svg_json: str):
+    """Returns (svg, png_base64) from a stored svg_json. Messages saved before lazy rasterization carry their PNG."""
+    chart = json.loads(svg_json or '{}')
+    return chart.get('svg'), chart.get('png_base64')
+
+
+def png_base64_for(svg_json: str) -> Union[str, None]:
+    svg, png_base64 = _legacy_png_base64(svg_json)
+    if png_base64 or not svg:
+        return png_base64
+    return base64.b64encode(rasterize(svg)).decode('utf-8')
+
+
+async def apng_base64_for(svg_json: str) -> Union[str, None]:
+    svg, png_base64 = _legacy_png_base64(svg_json)
+    if png_base64 or not svg:
+        return png_base64
+    return base64.b64encode(await arasterize(svg)).decode('utf-8')
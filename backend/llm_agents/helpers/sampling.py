@@ -0,0 +1,72 @@
+from typing import Iterable, Union
+
+import numpy as np
+import pandas as pd
+
+
+def reservoir_sample(chunks: Iterable[pd.DataFrame], k: int, random_state: int = 42) -> pd.DataFrame:
+    """
+    Uniformly sample k rows from a stream of DataFrame chunks (Algorithm R, vectorized per chunk).
+    Memory stays bounded by k rows plus one chunk regardless of stream length.
+
+    :param chunks: Iterable of DataFrames with the same columns, e.g. pd.read_csv(..., chunksize=n).
+    :param k: Number of rows to keep.
+    :param random_state: Seed for reproducible samples.
+    :return: A DataFrame with at most k rows.
+    """
+    rng = np.random.default_rng(random_state)
+    reservoir = None
+    seen = 0
+
+    for chunk in chunks:
+        n = len(chunk)
+        if n == 0:
+            continue
+
+        # Global position of every row in the stream; row t replaces slot j ~ U[0, t] when j < k.
+        positions = seen + np.arange(n)
+        slots = np.where(positions < k, positions, rng.integers(0, positions + 1))
+        chosen = np.flatnonzero(slots < k)
+        seen += n
+        if len(chosen) == 0:
+            continue
+
+        # Within a chunk a later row overwrites an earlier one that landed in the same slot.
+        winners = pd.Series(chosen, index=slots[chosen]).groupby(level=0).last()
+        new_rows = chunk.iloc[winners.to_numpy()].set_axis(winners.index, axis=0)
+
+        if reservoir is None:
+            reservoir = new_rows
+        else:
+            reservoir = pd.concat([reservoir.drop(index=winners.index, errors='ignore'), new_rows])
+
+    if reservoir is None:
+        return pd.DataFrame()
+    return reservoir.sort_index().reset_index(drop=True)
+
+
+def stratified_sample(df: pd.DataFrame, column: str, k: int, random_state: int = 42) -> pd.DataFrame:
+    """
+    Sample about k rows keeping each value of `column` in proportion, with at least one row per value
+    so rare categories still show up. Falls back to a uniform sample when there are more values than k.
+    """
+    n_strata = df[column].nunique(dropna=False)
+    if n_strata == 0 or n_strata > k:
+        return df.sample(k, random_state=random_state)
+
+    frac = k / len(df)
+    sample = df.groupby(column, group_keys=False, dropna=False, observed=True).sample(frac=frac, random_state=random_state)
+    missing = df.drop_duplicates(column).loc[lambda d: ~d[column].isin(sample[column])]
+    return pd.concat([sample, missing]).sort_index()
+
+
+def sample_dataframe(df: pd.DataFrame, k: int, stratify_by: Union[str, None] = None, random_state: int = 42) -> pd.DataFrame:
+    """
+    Return df itself if it has at most k rows, otherwise a reproducible sample of about k rows,
+    stratified on `stratify_by` when given.
+    """
+    if len(df) <= k:
+        return df
+    if stratify_by is not None and stratify_by in df.columns:
+        return stratified_sample(df, stratify_by, k, random_state=random_state)
+    return df.sample(k, random_state=random_state)
@@ -0,0 +1,126 @@
+import os
+import hashlib
+import tempfile
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from llm_agents.helpers import utils
+from llm_agents.helpers.dataframe_cache import dataframe_cache
+
+# Published datasets live in RAM-backed /dev/shm when the host has it.
+SHARED_DATASET_DIR = os.environ.get(
+    'SHARED_DATASET_DIR',
+    '/dev/shm/langviz' if os.path.isdir('/dev/shm') else os.path.join(tempfile.gettempdir(), 'langviz_shared')
+)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedDatasetRegistry:
+    """
+        Publishes DataFrames once as uncompressed Arrow IPC (Feather v2) files for the code executor workers.
+
+        Entries are keyed by (uri, file version) and reference counted: every DatasetVisualizations handler
+        acquires the dataset it works on and releases it when it's closed; the file is deleted when the
+        last reference goes. Each server process publishes under its own pid directory, and directories of
+        dead processes are removed on startup.
+    """
+    def __init__(self, directory: str) -> None:
+        self.directory = os.path.join(directory, str(os.getpid()))
+        self._entries = {}  # path -> reference count
+        self._lock = threading.Lock()
+        self._remove_stale(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _remove_stale(self, directory: str):
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.isdigit() and not _pid_alive(int(name)):
+                stale_dir = os.path.join(directory, name)
+                for file_name in os.listdir(stale_dir):
+                    os.remove(os.path.join(stale_dir, file_name))
+                os.rmdir(stale_dir)
+
+    def _path(self, uri: str, df: pd.DataFrame) -> str:
+        # Frames from the DataFrameCache carry the version they were loaded at; only others cost a lookup (an S3 HEAD).
+        cached, version = dataframe_cache.version_of(df)
+        if not cached:
+            version = utils.get_file_version(uri)
+        key = hashlib.sha256(f"{uri}:{version}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def acquire(self, uri: str, df: pd.DataFrame) -> str:
+        """
+            Returns the path of the published copy of df, writing it on first use. Raises pa.ArrowException
+            if df can't be stored as Arrow (e.g. object columns mixing types).
+        """
+        path = self._path(uri, df)
+        with self._lock:
+            if path not in self._entries:
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                try:
+                    feather.write_feather(df, tmp_path, compression='uncompressed')
+                except Exception:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+                os.replace(tmp_path, path)
+                self._entries[path] = 0
+            self._entries[path] += 1
+        return path
+
+    def release(self, path: str):
+        with self._lock:
+            if path not in self._entries:
+                return
+            self._entries[path] -= 1
+            if self._entries[path] > 0:
+                return
+            del self._entries[path]
+            # Removed under the lock, so a concurrent acquire() can't republish the file in between and lose it.
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _arrow_strings(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.StringDtype('pyarrow')
+    return None
+
+
+def map_dataset(path: str) -> pd.DataFrame:
+    """
+        Opens a published dataset read-only through a memory map. Numeric columns without nulls are
+        views of the mapped pages, shared by every process mapping the file, and string columns stay
+        Arrow-backed (string[pyarrow]) on the mapped buffers instead of becoming Python objects. Other
+        columns (numbers with nulls, dates) are materialized by to_pandas. The mapping outlives the
+        file's deletion until the frame is dropped.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(split_blocks=True, types_mapper=_arrow_strings)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_shared_dataset_registry() -> SharedDatasetRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SharedDatasetRegistry(SHARED_DATASET_DIR)
+        return _registry
@@ -0,0 +1,130 @@
+import numpy as np
+import pandas as pd
+
+
+def _hash_values(values: pd.Series) -> np.ndarray:
+    """64-bit hashes of a Series' values (not its index), vectorized."""
+    try:
+        return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+    except TypeError:
+        # Unhashable/mixed objects (lists, dicts, ...) hash by their string form.
+        return pd.util.hash_pandas_object(values.astype(str), index=False).to_numpy(dtype=np.uint64)
+
+
+class HyperLogLog:
+    """
+        Distinct-count sketch using 2**p one-byte registers (16 KB at the default p=14).
+        Relative standard error is about 1.04 / sqrt(2**p), ~0.8% at p=14.
+    """
+    def __init__(self, p: int = 14) -> None:
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update(self, values: pd.Series):
+        if len(values) == 0:
+            return
+        hashes = _hash_values(values)
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        # Shift out the index bits; the sentinel bit caps the rank at 64 - p + 1 when the rest is zero.
+        w = (hashes << np.uint64(self.p)) | np.uint64(1 << (self.p - 1))
+        # Rank = leading zeros + 1. float64 rounding only matters for w within 2**-53 of a power of two.
+        rank = (64 - np.floor(np.log2(w.astype(np.float64)))).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros > 0:
+            # Small-range correction (linear counting).
+            estimate = self.m * np.log(self.m / zeros)
+        return int(round(estimate))
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / np.sqrt(self.m)
+
+
+class KLLSketch:
+    """
+        Quantile sketch (Karnin-Lang-Liberty). Memory is O(k) items; normalized rank error is about
+        2.296 / k**0.9723 (~1.3% at the default k=200).
+    """
+    def __init__(self, k: int = 200, c: float = 2 / 3, random_state: int = 42) -> None:
+        self.k = k
+        self.c = c
+        self.n = 0
+        self.rng = np.random.default_rng(random_state)
+        self.compactors = [np.empty(0)]
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(2, int(np.ceil(self.k * self.c ** depth)))
+
+    def update(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            if len(self.compactors[level]) > self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                items = np.sort(self.compactors[level])
+                leftover = items[-1:] if len(items) % 2 else items[:0]
+                items = items[:len(items) - len(leftover)]
+                # Keep every other item (random parity) at twice the weight on the next level.
+                promoted = items[self.rng.integers(0, 2)::2]
+                self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], promoted])
+                self.compactors[level] = leftover
+            level += 1
+
+    def quantiles(self, qs: list[float]) -> list[float]:
+        if self.n == 0:
+            return [None for _ in qs]
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(compactor), 2.0 ** level) for level, compactor in enumerate(self.compactors)])
+        order = np.argsort(items)
+        items, cumulative = items[order], np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return [float(items[min(pos, len(items) - 1)]) for pos in positions]
+
+    @property
+    def rank_error(self) -> float:
+        return 2.296 / self.k ** 0.9723
+
+
+class MisraGries:
+    """
+        Heavy-hitters summary keeping at most `capacity` counters, merged chunk by chunk.
+        Reported counts are lower bounds; each true count is at most `count_error` higher,
+        and count_error <= n / (capacity + 1).
+    """
+    def __init__(self, capacity: int = 64) -> None:
+        self.capacity = capacity
+        self.n = 0
+        self.count_error = 0
+        self.counts = pd.Series(dtype='int64')
+
+    def update(self, values: pd.Series):
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        merged = self.counts.add(values.value_counts(), fill_value=0)
+        if len(merged) > self.capacity:
+            # Mergeable Misra-Gries: subtract the (capacity+1)-th largest count from every counter.
+            threshold = merged.nlargest(self.capacity + 1).iloc[-1]
+            merged = merged[merged > threshold] - threshold
+            self.count_error += int(threshold)
+        self.counts = merged
+
+    def top(self, k: int) -> list[dict]:
+        top = self.counts.nlargest(k)
+        return [{"value": value, "count": int(count)} for value, count in zip(top.index.tolist(), top.tolist())]
@@ -15,6 +15,25 @@ import io
 import boto3
 from smart_open import smart_open
 from urllib.parse import urlparse
+import threading
+import tempfile
+import pyarrow.parquet as pq
+from botocore.config import Config as BotoConfig
+from boto3.s3.transfer import TransferConfig
+
+# Parsed copies of source files, stored as Parquet with cleaned column names.
+COLUMNAR_CACHE_DIR = os.environ.get('COLUMNAR_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'columnar'))
+COLUMNAR_CACHE_MAX_BYTES = int(os.environ.get('COLUMNAR_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+
+# S3 downloads: objects are fetched with parallel ranged GETs and spooled to disk past S3_SPOOL_MAX_BYTES.
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024)),
+    max_concurrency=int(os.environ.get('S3_MAX_CONCURRENCY', 10)),
+    use_threads=True,
+)
+S3_SPOOL_MAX_BYTES = int(os.environ.get('S3_SPOOL_MAX_BYTES', 64 * 1024 * 1024))
 
 def get_dirs(path: str) -> List[str]:
     return next(os.walk(path))[1]
@@ -45,7 +64,9 @@ def clean_column_names(df: pd.DataFrame) -> pd.DataFrame:
 def read_dataframe(file_location: str, encoding: str = 'utf-8') -> pd.DataFrame:
     """
     Read a dataframe from a given file location and clean its column names.
-    It also samples down to 4500 rows if the data exceeds that limit.
+    Parses are cached as Parquet under COLUMNAR_CACHE_DIR, keyed by the source's
+    size/mtime or ETag, so later loads skip parsing the source. Sampling for profiling
+    and approximate answers happens on the loaded frame (see sampling.py).
 
     :param file_location: The path to the file containing the data.
     :param encoding: Encoding to use for the file reading.
@@ -53,24 +74,26 @@ def read_dataframe(file_location: str, encoding: str = 'utf-8') -> pd.DataFrame:
     """
     file_extension = file_location.split('.')[-1]
     
+    try:
+        version = get_file_version(file_location)
+    except Exception as e:
+        print(f"Could not get version of {file_location}, skipping columnar cache: {e}")
+        version = None
+    
+    if version is not None:
+        cached_df = _read_columnar_cache(_columnar_cache_path(file_location, version))
+        if cached_df is not None:
+            return cached_df
+    
     try:
         if file_location.startswith('s3://'):
-            # Configure S3 client
-            session = boto3.Session(
-                aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
-                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
-                region_name=os.environ.get('AWS_REGION')
-            )
+            bucket, key = _parse_s3_uri(file_location)
+            s3 = _get_s3_client()
             
-            # Parse S3 URI
-            parsed_uri = urlparse(file_location)
-            bucket = parsed_uri.netloc
-            key = parsed_uri.path.lstrip('/')
-            
-            # Use session to read the file
-            s3 = session.client('s3')
-            obj = s3.get_object(Bucket=bucket, Key=key)
-            df = _read_file_by_extension(obj['Body'], file_extension)
+            with tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_BYTES) as f:
+                s3.download_fileobj(bucket, key, f, Config=S3_TRANSFER_CONFIG)
+                f.seek(0)
+                df = _read_file_by_extension(f, file_extension)
                 
         else:
             # Handle local files
@@ -82,7 +105,7 @@ def read_dataframe(file_location: str, encoding: str = 'utf-8') -> pd.DataFrame:
     
     # Clean column names
     cleaned_df = clean_column_names(df)
-
+    
     if cleaned_df.columns.tolist() != df.columns.tolist():
         write_funcs = {
             'csv': lambda: cleaned_df.to_csv(file_location, index=False, encoding=encoding),
@@ -102,9 +125,120 @@ def read_dataframe(file_location: str, encoding: str = 'utf-8') -> pd.DataFrame:
         except Exception as e:
             print(f"Failed to write file: {file_location}. Error: {e}")
             raise
+        
+        # The rewrite above changed the source, so key the cache on its new version.
+        version = get_file_version(file_location)
+
+    if version is not None:
+        _write_columnar_cache(_columnar_cache_path(file_location, version), cleaned_df)
 
     return cleaned_df
 
+
+def _columnar_cache_path(file_location: str, version: str) -> str:
+    key = hashlib.md5(f"{file_location}|{version}".encode("utf-8")).hexdigest()
+    return os.path.join(COLUMNAR_CACHE_DIR, f"{key}.parquet")
+
+
+def _read_columnar_cache(path: str) -> Union[pd.DataFrame, None]:
+    """
+    Read a cached Parquet copy with pyarrow, memory-mapping the file. Returns None on a miss.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        df = pq.read_table(path, memory_map=True).to_pandas()
+        # Touch the file so pruning evicts the least recently used copies first.
+        os.utime(path)
+        return df
+    except Exception as e:
+        print(f"Failed to read columnar cache {path}: {e}")
+        return None
+
+
+def _write_columnar_cache(path: str, df: pd.DataFrame):
+    """
+    Write a Parquet copy of df to the columnar cache and prune the cache down to COLUMNAR_CACHE_MAX_BYTES.
+    Failures are logged and ignored; the cache is only an optimisation.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(tmp_path, index=False, engine='pyarrow')
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Failed to write columnar cache {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    _prune_columnar_cache()
+
+
+def _prune_columnar_cache():
+    entries = []
+    for name in os.listdir(COLUMNAR_CACHE_DIR):
+        if name.endswith('.parquet'):
+            path = os.path.join(COLUMNAR_CACHE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= COLUMNAR_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total_bytes -= size
+        except FileNotFoundError:
+            pass
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def _get_s3_client():
+    """
+    Return the process-wide S3 client, created from the AWS_* environment variables on first use.
+    boto3 clients are thread-safe, so one client (and its connection pool) is shared by all callers.
+    """
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            session = boto3.Session(
+                aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+                aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                region_name=os.environ.get('AWS_REGION')
+            )
+            _s3_client = session.client('s3', config=BotoConfig(max_pool_connections=S3_MAX_POOL_CONNECTIONS))
+    return _s3_client
+
+
+def _parse_s3_uri(file_location: str) -> Tuple[str, str]:
+    parsed_uri = urlparse(file_location)
+    return parsed_uri.netloc, parsed_uri.path.lstrip('/')
+
+
+def get_file_version(file_location: str) -> Union[str, None]:
+    """
+    Return a cheap version identifier for a file: ETag/VersionId for S3 objects,
+    size + mtime for local files, None when the source can't be versioned.
+
+    :param file_location: The path or s3:// URI of the file.
+    :return: A string that changes whenever the file contents change.
+    """
+    if file_location.startswith('s3://'):
+        bucket, key = _parse_s3_uri(file_location)
+        head = _get_s3_client().head_object(Bucket=bucket, Key=key)
+        return f"{head.get('ETag', '').strip(chr(34))}:{head.get('VersionId', '')}:{head.get('ContentLength', '')}"
+    if os.path.exists(file_location):
+        stat = os.stat(file_location)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    return None
+
+
 def _read_file_by_extension(file_obj, file_extension: str) -> pd.DataFrame:
     """
     Helper function to read different file formats into a pandas DataFrame
@@ -215,20 +349,26 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
             f"""num_tokens_from_messages() is not presently implemented for model {model}.""")
 
 
-def cache_request(cache: Cache, params: Any, values: Any = None) -> Any:
-    # Generate a unique key for the request
-
-    key = hashlib.md5(json.dumps(
+def cache_key(params: Any) -> str:
+    """Unique key for a JSON-serializable set of request params."""
+    return hashlib.md5(json.dumps(
         params, sort_keys=True).encode("utf-8")).hexdigest()
-    # Check if the request is cached
-    if key in cache and values is None:
-        print("retrieving from cache")
-        return cache[key]
+
+
+def cache_request(cache: Cache, params: Any, values: Any = None, expire: Union[float, None] = None) -> Any:
+    # Generate a unique key for the request
+    key = cache_key(params)
+    # Check if the request is cached (a single get, so an entry can't expire between check and read)
+    if values is None:
+        cached = cache.get(key)
+        if cached is not None:
+            print("retrieving from cache")
+        return cached
 
     # Cache the provided values and return them
     if values:
         print("saving to cache")
-        cache[key] = values
+        cache.set(key, values, expire=expire)
     return values
 
 
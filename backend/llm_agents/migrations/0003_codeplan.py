@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('llm_agents', '0002_alter_vizualization_question'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodePlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema_fingerprint', models.CharField(max_length=64)),
+                ('visualization_type', models.CharField(max_length=200)),
+                ('columns_key', models.TextField()),
+                ('pd_code', models.TextField()),
+                ('pd_viz_code', models.TextField()),
+                ('hits', models.IntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('schema_fingerprint', 'visualization_type', 'columns_key'), name='unique_code_plan')],
+            },
+        ),
+    ]
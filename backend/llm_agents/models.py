@@ -22,4 +22,28 @@ class DerivedDataset(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+
+class CodePlan(models.Model):
+    """
+        Verified pandas extract/plot code for a (dataset schema, visualization type, columns) combination.
+        Only code that has executed successfully is stored; plans that later fail are deleted.
+    """
+    schema_fingerprint = models.CharField(max_length=64)
+    visualization_type = models.CharField(max_length=200)
+    columns_key = models.TextField()
+    pd_code = models.TextField()
+    pd_viz_code = models.TextField()
+    hits = models.IntegerField(default=0)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['schema_fingerprint', 'visualization_type', 'columns_key'], name='unique_code_plan'),
+        ]
+    
+    def __str__(self):
+        return f"{self.visualization_type} {self.columns_key}"
@@ -1,3 +1,530 @@
-from django.test import TestCase
+import io
+import os
+import json
+import time
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import dspy
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+from django.test import SimpleTestCase, TestCase
+
+from chat.models import ChatSession as ChatSessionModel, UserMessage as UserMessageModel
+from llm_agents.helpers import chart_templates, chat_context, sampling, shared_datasets
+from llm_agents.helpers.profiler import ColumnProfiler
+from llm_agents.helpers.progress import ProgressReporter, reporting, stage
+from llm_agents.helpers.sketches import HyperLogLog, KLLSketch, MisraGries
+from llm_agents.helpers.dataframe_cache import DataFrameCache, configure_pandas
+from llm_agents.helpers.code_executor import ProcessCodeExecutor, CodeExecutionError, CodeLimitExceeded
+from diskcache import Cache
+
+from llm_agents.helpers.dataset_enrich import DatasetEnrich, enrich_cache_stats
+from llm_agents.helpers.llm_cache import LLMResponseCache, _canonicalize
+from llm_agents.helpers.question_viz import DatasetVisualizations
+
+
+class EnrichColumnRetryTests(SimpleTestCase):
+    def make_enrich(self, **kwargs):
+        with mock.patch('llm_agents.helpers.dataset_enrich.DatasetHelper'):
+            return DatasetEnrich('s3://bucket/data.csv', **kwargs)
+
+    def test_bad_reply_is_retried_without_the_lm_cache(self):
+        enrich = self.make_enrich(max_retries=2)
+        replies = ['not json', '{"semantic_type": "price", "description": "Price of the car"}']
+        configs = []
+
+        def field_enrich(field_json, config):
+            configs.append(config)
+            return SimpleNamespace(enriched_field_json=replies[len(configs) - 1])
+
+        enrich.enriched_field_json = field_enrich
+        with mock.patch('llm_agents.helpers.dataset_enrich.time.sleep'):
+            column = enrich._enrich_column({'column_name': 'price', 'properties': {'dtype': 'number'}})
+
+        self.assertEqual(column['properties']['semantic_type'], 'price')
+        self.assertEqual(column['properties']['dtype'], 'number')
+        self.assertEqual(len(configs), 2)
+        self.assertNotIn('cache', configs[0])
+        self.assertIs(configs[1]['cache'], False)
+
+    def test_gives_up_after_max_retries(self):
+        enrich = self.make_enrich(max_retries=1)
+        enrich.enriched_field_json = mock.Mock(return_value=SimpleNamespace(enriched_field_json='not json'))
+        with mock.patch('llm_agents.helpers.dataset_enrich.time.sleep'):
+            self.assertIsNone(enrich._enrich_column({'column_name': 'price', 'properties': {}}))
+        self.assertEqual(enrich.enriched_field_json.call_count, 2)
+
+
+class EnrichCacheTests(SimpleTestCase):
+    columns = [
+        {'column_name': 'make', 'properties': {'dtype': 'category', 'samples': ['bmw', 'audi'], 'num_unique_values': 2}},
+        {'column_name': 'price', 'properties': {'dtype': 'number', 'min': 10, 'max': 30, 'samples': [10, 30], 'num_unique_values': 3}},
+    ]
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = Cache(tmp_dir.name)
+        self.addCleanup(self.cache.close)
+
+    def upload(self):
+        with mock.patch('llm_agents.helpers.dataset_enrich.DatasetHelper') as dataset_helper, \
+                mock.patch('llm_agents.helpers.dataset_enrich.enrich_cache', self.cache):
+            dataset_helper.return_value.enriched_column_properties = [dict(column) for column in self.columns]
+            enrich = DatasetEnrich('s3://bucket/cars.csv', batch_token_budget=0)
+        enrich.enriched_field_json = mock.Mock(side_effect=lambda field_json, config: SimpleNamespace(
+            enriched_field_json=json.dumps({'semantic_type': field_json['column_name'], 'description': f"The car's {field_json['column_name']}"})
+        ))
+        enrich.enrich_fields()
+        return enrich
+
+    def test_reupload_with_the_same_fingerprint_skips_the_llm(self):
+        first = self.upload()
+        self.assertEqual(first.enriched_field_json.call_count, 2)
+
+        second = self.upload()
+        second.enriched_field_json.assert_not_called()
+        self.assertEqual(second.dataset.enriched_column_properties, first.dataset.enriched_column_properties)
+        self.assertEqual(second.dataset.enriched_column_properties[1]['properties']['description'], "The car's price")
+        self.assertEqual(enrich_cache_stats(self.cache), {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+
+class ProcessCodeExecutorTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.dataset_path = os.path.join(cls.tmp_dir.name, 'cars.arrow')
+        feather.write_feather(pd.DataFrame({'make': ['bmw', 'audi', 'bmw'], 'price': [10, 20, 30]}), cls.dataset_path, compression='uncompressed')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def make_executor(self, **kwargs):
+        executor = ProcessCodeExecutor(workers=1, **kwargs)
+        self.addCleanup(executor.shutdown)
+        return executor
+
+    def assertStillServes(self, executor):
+        extract_df = executor.run_extract(self.dataset_path, "extract_df = df.groupby('make', as_index=False)['price'].sum()", ['make', 'price'])
+        self.assertEqual(dict(zip(extract_df['make'], extract_df['price'])), {'audi': 20, 'bmw': 40})
+
+    def test_timeout_kills_and_replaces_the_worker(self):
+        executor = self.make_executor(timeout=2, cpu_seconds=60)
+        worker = executor._idle.queue[0]
+        pid = worker.process.pid
+        with self.assertRaisesRegex(CodeLimitExceeded, 'timed out'):
+            executor.run_extract(self.dataset_path, "import time\ntime.sleep(60)", None)
+        self.assertNotEqual(worker.process.pid, pid)
+        self.assertStillServes(executor)
+
+    def test_cpu_limit_kills_the_worker(self):
+        executor = self.make_executor(timeout=60, cpu_seconds=1)
+        with self.assertRaisesRegex(CodeLimitExceeded, 'died'):
+            executor.run_extract(self.dataset_path, "while True:\n    pass", None)
+        self.assertStillServes(executor)
+
+    def test_memory_limit_fails_the_task(self):
+        executor = self.make_executor(memory_bytes=4 * 1024 ** 3)
+        with self.assertRaisesRegex(CodeExecutionError, 'MemoryError'):
+            executor.run_extract(self.dataset_path, "extract_df = bytearray(16 * 1024 ** 3)", None)
+        self.assertStillServes(executor)
+
+    def test_preload_loads_each_worker_once(self):
+        executor = ProcessCodeExecutor(workers=2)
+        self.addCleanup(executor.shutdown)
+        calls = []
+        executor._run_on = lambda worker, task, timeout=None: calls.append(worker)
+        with mock.patch('llm_agents.helpers.code_executor.threading.Thread') as thread:
+            executor.preload(self.dataset_path)
+            executor.preload(self.dataset_path)
+        self.assertEqual(thread.call_count, 1)
+        thread.call_args.kwargs['target']()
+        self.assertEqual(len(set(map(id, calls))), 2)
+        self.assertEqual(executor._idle.qsize(), 2)
+
+
+class SharedDatasetTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.registry = shared_datasets.SharedDatasetRegistry(tmp_dir.name)
+        self.df = pd.DataFrame({'make': ['bmw', None, 'audi'], 'price': [10, 20, 30]})
+
+    def test_string_columns_stay_arrow_backed(self):
+        with mock.patch('llm_agents.helpers.shared_datasets.utils.get_file_version', return_value='v1'):
+            path = self.registry.acquire('s3://bucket/cars.csv', self.df)
+        mapped = shared_datasets.map_dataset(path)
+        self.assertEqual(mapped['make'].dtype, pd.StringDtype('pyarrow'))
+        self.assertEqual(mapped['price'].tolist(), [10, 20, 30])
+        self.assertTrue(mapped['make'].isna().iloc[1])
+
+    def test_cached_frames_reuse_the_cached_version(self):
+        cache = DataFrameCache(max_bytes=10 ** 9)
+        with mock.patch('llm_agents.helpers.dataframe_cache.utils.get_file_version', return_value='v1'):
+            df = cache.get('s3://bucket/cars.csv', loader=lambda uri: self.df)
+        with mock.patch('llm_agents.helpers.shared_datasets.dataframe_cache', cache), \
+                mock.patch('llm_agents.helpers.shared_datasets.utils.get_file_version') as get_file_version:
+            path = self.registry.acquire('s3://bucket/cars.csv', df)
+            self.assertEqual(self.registry.acquire('s3://bucket/cars.csv', df), path)
+        get_file_version.assert_not_called()
+
+
+class CopyOnWriteTests(SimpleTestCase):
+    def test_generated_code_cannot_write_to_a_shared_frame(self):
+        configure_pandas()
+        shared = pd.DataFrame({'price': [10, 20, 30]})
+        namespace = {'pd': pd, 'df': shared.copy(deep=False)}
+
+        exec("df['price'] = df['price'] * 2\ndf.loc[0, 'price'] = 0", namespace, namespace)
+        self.assertEqual(shared['price'].tolist(), [10, 20, 30])
+        with self.assertRaises(pd.errors.ChainedAssignmentError):
+            exec("df['price'][df['price'] > 15] = 0", namespace, namespace)
+
+
+def fake_module(signature: str, temperature: float = 0.0):
+    lm = SimpleNamespace(model='gpt-4o-mini', kwargs={'temperature': temperature})
+    return SimpleNamespace(signature=type(signature, (), {}), predictors=lambda: [SimpleNamespace(lm=lm)])
+
+
+class LLMResponseCacheTests(SimpleTestCase):
+    def make_cache(self, signatures='QuestionRefiner', ttl=60):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache = LLMResponseCache(tmp_dir.name, size_limit=10 ** 8, ttl=ttl, signatures=signatures)
+        self.addCleanup(cache.cache.close)
+        return cache
+
+    def test_canonicalization_ignores_whitespace(self):
+        self.assertEqual(
+            _canonicalize({'question': '  Price  by\n\tmake ', 'columns': ('make', 'price'), 'rows': 3}),
+            {'question': 'Price by make', 'columns': ['make', 'price'], 'rows': 3},
+        )
+        cache = self.make_cache()
+        module = fake_module('QuestionRefiner')
+        params, _ = cache.lookup(module, {'question': 'Price by make'})
+        cache.store(params, dspy.Prediction(refined_questions=['Total price by make']))
+        _, prediction = cache.lookup(module, {'question': ' Price\nby   make '})
+        self.assertEqual(prediction.refined_questions, ['Total price by make'])
+
+    def test_key_includes_temperature(self):
+        cache = self.make_cache()
+        params, _ = cache.lookup(fake_module('QuestionRefiner'), {'question': 'q'})
+        cache.store(params, dspy.Prediction(answer='a'))
+        self.assertIsNone(cache.lookup(fake_module('QuestionRefiner', temperature=0.7), {'question': 'q'})[1])
+
+    def test_only_configured_signatures_are_cached(self):
+        cache = self.make_cache(signatures=' QuestionRefiner, VisualizationRecommender ')
+        self.assertTrue(cache.enabled('VisualizationRecommender'))
+        self.assertEqual(cache.lookup(fake_module('VisualizationAnalyzer'), {'question': 'q'}), (None, None))
+        self.assertTrue(self.make_cache(signatures='*').enabled('VisualizationAnalyzer'))
+        self.assertFalse(self.make_cache(signatures='').enabled('QuestionRefiner'))
+
+    def test_entries_expire_after_ttl(self):
+        cache = self.make_cache(ttl=0.2)
+        module = fake_module('QuestionRefiner')
+        params, _ = cache.lookup(module, {'question': 'q'})
+        cache.store(params, dspy.Prediction(answer='a'))
+        self.assertIsNotNone(cache.lookup(module, {'question': 'q'})[1])
+        time.sleep(0.3)
+        self.assertIsNone(cache.lookup(module, {'question': 'q'})[1])
+        self.assertEqual(cache.stats()['QuestionRefiner'], {'hits': 1, 'misses': 2, 'hit_rate': 1 / 3})
+
+
+class SketchTests(SimpleTestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(7)
+
+    def test_hyperloglog_within_three_standard_errors(self):
+        for n_distinct in (500, 50_000, 500_000):
+            values = pd.Series(self.rng.permutation(n_distinct).repeat(2))
+            hll = HyperLogLog()
+            for start in range(0, len(values), 100_000):
+                hll.update(values.iloc[start:start + 100_000])
+            self.assertLessEqual(abs(hll.count() - n_distinct) / n_distinct, 3 * hll.relative_error, n_distinct)
+
+    def test_kll_quantiles_within_rank_error(self):
+        values = self.rng.lognormal(size=300_000)
+        kll = KLLSketch()
+        for chunk in np.array_split(values, 30):
+            kll.update(chunk)
+        sorted_values = np.sort(values)
+        qs = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+        for q, estimate in zip(qs, kll.quantiles(qs)):
+            rank = np.searchsorted(sorted_values, estimate, side='right') / len(values)
+            self.assertLessEqual(abs(rank - q), 2 * kll.rank_error, q)
+
+    def test_misra_gries_counts_within_count_error(self):
+        # Zipf-distributed categories: a few heavy hitters and a long tail.
+        values = pd.Series(self.rng.zipf(1.5, size=200_000) % 5_000).astype(str)
+        heavy_hitters = MisraGries(capacity=64)
+        for start in range(0, len(values), 20_000):
+            heavy_hitters.update(values.iloc[start:start + 20_000])
+
+        true_counts = values.value_counts()
+        self.assertLessEqual(heavy_hitters.count_error, len(values) / (64 + 1))
+        for top in heavy_hitters.top(10):
+            true_count = true_counts[top['value']]
+            self.assertLessEqual(top['count'], true_count)
+            self.assertLessEqual(true_count - top['count'], heavy_hitters.count_error)
+        self.assertEqual([top['value'] for top in heavy_hitters.top(3)], true_counts.index[:3].tolist())
+
+
+class ColumnProfilerModeTests(SimpleTestCase):
+    def test_switches_to_approximate_mode_above_min_rows(self):
+        df = pd.DataFrame({'price': np.arange(101, dtype=float), 'make': ['bmw', 'audi'] * 50 + ['kia']})
+        with mock.patch('llm_agents.helpers.profiler.APPROX_STATS_MIN_ROWS', 101):
+            self.assertFalse(ColumnProfiler(df).approximate)
+        with mock.patch('llm_agents.helpers.profiler.APPROX_STATS_MIN_ROWS', 100):
+            profiler = ColumnProfiler(df, sample_df=df.head(10))
+            self.assertTrue(profiler.approximate)
+            price, make = profiler.profile()
+
+        self.assertIn('percentiles_rank_error', price['properties'])
+        self.assertEqual(price['properties']['max'], 100)
+        self.assertIn('num_unique_values_error', make['properties'])
+        self.assertEqual(make['properties']['num_unique_values'], 3)
+
+
+class SamplingTests(SimpleTestCase):
+    def test_reservoir_sample_is_uniform(self):
+        df = pd.DataFrame({'row': range(20)})
+        counts = np.zeros(20)
+        for seed in range(1000):
+            chunks = (df.iloc[start:start + 6] for start in range(0, len(df), 6))
+            counts[sampling.reservoir_sample(chunks, 5, random_state=seed)['row']] += 1
+        # Every row should be kept with probability 5/20.
+        np.testing.assert_allclose(counts / 1000, 0.25, atol=0.05)
+
+    def test_reservoir_sample_does_not_depend_on_chunking(self):
+        df = pd.DataFrame({'row': range(1000)})
+        samples = [
+            sampling.reservoir_sample((df.iloc[start:start + size] for start in range(0, len(df), size)), 50, random_state=3)
+            for size in (7, 64, 1000)
+        ]
+        self.assertEqual(len(samples[0]), 50)
+        for sample in samples[1:]:
+            pd.testing.assert_frame_equal(sample, samples[0])
+
+    def test_stratified_sample_keeps_every_stratum(self):
+        df = pd.DataFrame({'make': ['bmw'] * 9_000 + ['audi'] * 990 + ['kia'] * 10, 'price': range(10_000)})
+        sample = sampling.sample_dataframe(df, 100, stratify_by='make')
+        counts = sample['make'].value_counts()
+        self.assertEqual(set(counts.index), {'bmw', 'audi', 'kia'})
+        self.assertEqual(counts['bmw'], 90)
+        self.assertEqual(counts['audi'], 10)
+
+
+class RunExtractCodeTests(SimpleTestCase):
+    # Fails wherever the filtered category is missing, as on a sample that missed a rare value.
+    code = "extract_df = df[df['make'] == 'kia']\nassert len(extract_df) > 0"
+
+    def make_handler(self, sample_df, code_executor=None):
+        handler = DatasetVisualizations.__new__(DatasetVisualizations)
+        full_df = pd.DataFrame({'make': ['bmw', 'audi', 'kia'], 'price': [10, 20, 30]})
+        handler.main_dataset = SimpleNamespace(df=full_df, sample_df=sample_df, approximate=True, sample_rows=2, stratify_column=lambda: None)
+        handler.code_executor = code_executor
+        handler.shared_dataset_path = '/dev/shm/cars.arrow'
+        return handler
+
+    def test_runs_on_the_sample_when_it_succeeds(self):
+        handler = self.make_handler(sample_df=pd.DataFrame({'make': ['kia'], 'price': [99]}))
+        extract_df, _ = handler.run_extract_code(self.code, SimpleNamespace(columns_involved=['make']))
+        self.assertEqual(extract_df['price'].tolist(), [99])
+
+    def test_falls_back_to_the_full_frame_when_the_sample_fails(self):
+        handler = self.make_handler(sample_df=pd.DataFrame({'make': ['bmw'], 'price': [10]}))
+        extract_df, _ = handler.run_extract_code(self.code, SimpleNamespace(columns_involved=['make']))
+        self.assertEqual(extract_df['price'].tolist(), [30])
+
+    def test_worker_falls_back_to_the_full_frame_on_errors_but_not_limits(self):
+        executor = mock.Mock()
+        executor.run_extract.side_effect = [CodeExecutionError('AssertionError'), pd.DataFrame({'price': [30]})]
+        handler = self.make_handler(sample_df=None, code_executor=executor)
+        extract_df, _ = handler.run_extract_code(self.code, SimpleNamespace(columns_involved=['make']))
+        self.assertEqual(extract_df['price'].tolist(), [30])
+        self.assertEqual(executor.run_extract.call_args_list[0].kwargs['sample_rows'], 2)
+        self.assertNotIn('sample_rows', executor.run_extract.call_args_list[1].kwargs)
+
+        executor.run_extract.side_effect = [CodeLimitExceeded('timed out')]
+        with self.assertRaises(CodeLimitExceeded):
+            handler.run_extract_code(self.code, SimpleNamespace(columns_involved=['make']))
+
+
+class LLMStreamTests(SimpleTestCase):
+    def stream_fields(self, chunks):
+        events = []
+        with reporting(ProgressReporter(events.append, viz_index=1)) as reporter:
+            with stage('pandas_codegen'):
+                stream = reporter.new_stream()
+                for chunk in chunks:
+                    stream.feed(chunk)
+                stream.close()
+        tokens = [event for event in events if event['type'] == 'llm_token']
+        fields = {}
+        for event in tokens:
+            self.assertEqual((event['viz_index'], event['stage']), (1, 'pandas_codegen'))
+            fields[event['field']] = fields.get(event['field'], '') + event['text']
+        return fields, tokens
+
+    def test_headers_split_across_chunks(self):
+        completion = "[[ ## reasoning ## ]]\nSum price by make.\n\n[[ ## pandas_code ## ]]\nextract_df = df[['make', 'price']]\n\n[[ ## completed ## ]]"
+        expected = {'reasoning': 'Sum price by make.\n\n', 'pandas_code': "extract_df = df[['make', 'price']]\n\n"}
+        for size in (1, 2, 3, 5, 8, 13, len(completion)):
+            chunks = [completion[start:start + size] for start in range(0, len(completion), size)]
+            fields, tokens = self.stream_fields(chunks)
+            self.assertEqual(fields, expected, size)
+            self.assertFalse(any('[[ ##' in event['text'] for event in tokens), size)
+
+    def test_text_is_reported_as_it_arrives(self):
+        _, tokens = self.stream_fields(["[[ ## reasoning ## ]]\nSum", " price", " by make.[", "["])
+        self.assertEqual([event['text'] for event in tokens], ['Sum', ' price', ' by make.', '[['])
+
+
+class ChatContextTests(SimpleTestCase):
+    def test_select_turns_prefers_overlap_then_recency(self):
+        questions = [
+            'How does the price vary by fuel type?',
+            'Show the number of cars per body style',
+            'Which makes have the highest horsepower?',
+            'Plot city mileage against weight',
+        ]
+        budget = chat_context.count_tokens(questions[0]) + chat_context.count_tokens(questions[3])
+        turns = chat_context.select_turns('How does price vary by fuel type and year?', questions, budget)
+        # The overlapping question beats newer ones, and the rest of the budget goes to the most recent; chat order is kept.
+        self.assertEqual(turns, [questions[0], questions[3]])
+
+    def test_select_turns_stays_within_budget(self):
+        questions = [f'Question {index} about price and horsepower by make' for index in range(50)]
+        turns = chat_context.select_turns('price by make', questions, 40)
+        self.assertTrue(turns)
+        self.assertLessEqual(sum(chat_context.count_tokens(question) for question in turns), 40)
+        self.assertEqual(turns, [question for question in questions if question in turns])
+
+    def test_build_chat_context_truncates_to_the_budget(self):
+        window = chat_context.ChatContextWindow(
+            summary='The user explored prices by make and fuel type. ' * 100,
+            recent_questions=[f'What is the price of make {index}?' for index in range(20)],
+        )
+        previous_chart = SimpleNamespace(reason='Compare prices', viz_name='bar_chart', columns_involved=['make', 'price'])
+        context = chat_context.build_chat_context('What is the price of make 19?', previous_chart, window, token_budget=600)
+
+        self.assertLessEqual(chat_context.count_tokens(context), 600)
+        self.assertLess(context.index('Summary of the earlier chat'), context.index("User's last questions"))
+        self.assertIn('previous question: What is the price of make 18?', context)
+
+
+class UpdateContextSummaryTests(TestCase):
+    def setUp(self):
+        self.session = ChatSessionModel.objects.create()
+        self.messages = [UserMessageModel.objects.create(session=self.session, question=f'question {index}', content={}) for index in range(35)]
+
+    def test_folds_questions_that_left_the_window(self):
+        with mock.patch('llm_agents.helpers.chat_context.predict', return_value=SimpleNamespace(summary='Prices by make.')) as predict:
+            self.assertTrue(chat_context.update_context_summary(self.session, recent_turns=20))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.context_summary, 'Prices by make.')
+        self.assertEqual(self.session.context_summary_until_id, self.messages[14].id)
+        self.assertEqual(json.loads(predict.call_args.kwargs['questions']), [f'question {index}' for index in range(15)])
+
+    def test_concurrent_update_wins(self):
+        def concurrent_predict(module, **inputs):
+            # Another tab folds the same batch while this summary is being generated.
+            ChatSessionModel.objects.filter(pk=self.session.pk).update(context_summary='From the other tab.', context_summary_until_id=self.messages[14].id)
+            return SimpleNamespace(summary='Prices by make.')
+
+        with mock.patch('llm_agents.helpers.chat_context.predict', side_effect=concurrent_predict):
+            self.assertFalse(chat_context.update_context_summary(self.session, recent_turns=20))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.context_summary, 'From the other tab.')
+
+
+class ChartTemplateTests(SimpleTestCase):
+    columns = [
+        {'column_name': 'make', 'properties': {'dtype': 'category'}},
+        {'column_name': 'price', 'properties': {'dtype': 'number'}},
+    ]
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        makes = [f'make_{index:02d}' for index in range(30)]
+        self.df = pd.DataFrame({'make': rng.choice(makes, size=3_000), 'price': rng.integers(1, 100, size=3_000)})
+
+    def run_chart(self, chart):
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        namespace = {'pd': pd, 'np': np, 'plt': plt, 'df': self.df, 'svg_buffer': io.BytesIO()}
+        exec(chart.pd_code, namespace, namespace)
+        exec(chart.pd_viz_code, namespace, namespace)
+        self.assertTrue(namespace['svg_buffer'].getvalue().startswith(b'<?xml'))
+        return namespace['extract_df']
+
+    def test_requested_aggregation(self):
+        cases = [
+            ('Total price by make', 'sum'),
+            ('Sum of sales per region', 'sum'),
+            ('Average price for each make', 'mean'),
+            ('Mean mileage by body style', 'mean'),
+            ('Number of cars per make', 'count'),
+            ('How many listings each make has', 'count'),
+            ('Share of revenue by region', 'share'),
+            ('Percentage of cars by fuel type', 'share'),
+            ('Price by make', None),
+            ('Top 10 makes by price', chart_templates.UNSUPPORTED),
+            ('Median price by make', chart_templates.UNSUPPORTED),
+            ('Highest average price by make', chart_templates.UNSUPPORTED),
+            ('Total price by make for cars after 2015', chart_templates.UNSUPPORTED),
+            ('Average price of only electric cars', chart_templates.UNSUPPORTED),
+            ('Total and average price by make', chart_templates.UNSUPPORTED),
+        ]
+        for reason, expected in cases:
+            with self.subTest(reason=reason):
+                self.assertEqual(chart_templates.requested_aggregation(reason), expected)
+
+    def test_template_or_fallback_by_reason(self):
+        cases = [
+            ('bar_chart', 'Total price by make', "['price'].sum()"),
+            ('bar_chart', 'Average price by make', "grouped['mean']"),
+            ('pie_chart', 'Share of price by make', "['price'].sum()"),
+            ('bar_chart', 'Top 5 makes by price', None),
+            ('bar_chart', 'Median price by make', None),
+            ('bar_chart', 'Total price by make where price is above 50', None),
+            ('bar_chart', 'Price by make', None),
+            ('pie_chart', 'Average price by make', None),
+        ]
+        for visualization_type, reason, expected in cases:
+            with self.subTest(visualization_type=visualization_type, reason=reason):
+                chart = chart_templates.render_chart_code(visualization_type, ['make', 'price'], self.columns, reason=reason)
+                if expected is None:
+                    self.assertIsNone(chart)
+                else:
+                    self.assertIn(expected, chart.pd_code)
+
+    def test_bars_beyond_the_limit_are_folded_into_other(self):
+        for reason, aggregate in (('Total price by make', 'sum'), ('Average price by make', 'mean')):
+            with self.subTest(reason=reason):
+                chart = chart_templates.render_chart_code('bar_chart', ['make', 'price'], self.columns, reason=reason)
+                extract_df = self.run_chart(chart)
+                self.assertEqual(len(extract_df), chart_templates.MAX_BARS)
+                self.assertEqual(extract_df['make'].iloc[-1], 'Other')
+
+                expected = self.df.groupby('make')['price'].agg(aggregate).sort_values(ascending=False)
+                shown = expected.index[:chart_templates.MAX_BARS - 1]
+                rest = self.df[~self.df['make'].isin(shown)]['price']
+                self.assertEqual(extract_df['make'].iloc[:-1].tolist(), shown.tolist())
+                self.assertAlmostEqual(extract_df['price'].iloc[-1], rest.agg(aggregate))
+
+    def test_pie_slices_beyond_the_limit_are_folded_into_other(self):
+        chart = chart_templates.render_chart_code('pie_chart', ['make'], self.columns, reason='Share of cars by make')
+        extract_df = self.run_chart(chart)
+        self.assertEqual(len(extract_df), chart_templates.MAX_PIE_SLICES)
+        self.assertEqual(extract_df['make'].iloc[-1], 'Other')
+        self.assertEqual(extract_df['count'].sum(), len(self.df))
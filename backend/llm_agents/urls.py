@@ -8,4 +8,5 @@ router.register(r'derived-datasets', views.DerivedDatasetViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('cache-stats/', views.CacheStats.as_view(), name='cache-stats'),
 ]
\ No newline at end of file
@@ -1,7 +1,13 @@
 from django.shortcuts import render
 from rest_framework import viewsets
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
 from .models import Vizualization, DerivedDataset
 from .serializers import VizualizationSerializer, DerivedDatasetSerializer
+from llm_agents.helpers.llm_cache import llm_cache
+from llm_agents.helpers.dataframe_cache import dataframe_cache
+from llm_agents.helpers.dataset_enrich import enrich_cache_stats
 
 class VizualizationViewSet(viewsets.ModelViewSet):
     queryset = Vizualization.objects.all()
@@ -10,3 +16,18 @@ class VizualizationViewSet(viewsets.ModelViewSet):
 class DerivedDatasetViewSet(viewsets.ModelViewSet):
     queryset = DerivedDataset.objects.all()
     serializer_class = DerivedDatasetSerializer
+
+class CacheStats(APIView):
+    """Hit/miss counters of the LLM response and DataFrame caches (this server process) and the column enrichment cache (all uploads)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'llm_cache': llm_cache.stats(),
+            'dataframe_cache': {
+                'hits': dataframe_cache.hits,
+                'misses': dataframe_cache.misses,
+                'bytes': dataframe_cache.total_bytes,
+            },
+            'enrich_cache': enrich_cache_stats(),
+        })